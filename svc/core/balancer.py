@@ -1,59 +1,412 @@
+import random
+import time
+import zlib
 from logging import Logger
 
 from redis import Redis
 
 from core.pubsub import Pubsub
 from core.schema import S1
+from core.stats import PollerStats
+from utils import config
 
 
 class Balancer:
-    def __init__(self, logger, redis, pubsub):
+    # KEYS: shard lease, shard fence, ...; ARGV: owner, fencing token, ...
+    # rejects writes of a master which lost the shard lease, e.g. after a long pause, empty owner skips the check
+    FENCE_CHECK = """
+if ARGV[1] ~= '' and (redis.call('GET', KEYS[1]) ~= ARGV[1] or redis.call('GET', KEYS[2]) ~= ARGV[2]) then
+    return false
+end
+"""
+
+    # KEYS: lease, fence, gid set; ARGV: owner, token, up_to_epoch, lease_until_epoch, max count
+    # grabs due gids and moves them to the lease epoch in one step, a gid which is not
+    # re-scheduled by the poller before the lease epoch simply becomes due again
+    # returns flat list of gid, scheduled epoch pairs, nil if fenced out
+    CLAIM_SCRIPT = FENCE_CHECK + """
+local due = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[3], 'WITHSCORES', 'LIMIT', 0, ARGV[5])
+for i = 1, #due, 2 do
+    redis.call('ZADD', KEYS[3], ARGV[4], due[i])
+end
+return due
+"""
+
+    # KEYS: lease, fence, gid set, priority gid set; ARGV: owner, token, due up to epoch, start epoch, window seconds
+    # re-scores due gids evenly over the window keeping their order, gids of higher priority plans stay due as they are
+    SPREAD_SCRIPT = FENCE_CHECK + """
+local due = {}
+for _, gid in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[3])) do
+    if redis.call('SISMEMBER', KEYS[4], gid) == 0 then
+        due[#due + 1] = gid
+    end
+end
+local step = tonumber(ARGV[5]) / math.max(#due, 1)
+for i = 1, #due do
+    redis.call('ZADD', KEYS[3], tonumber(ARGV[4]) + (i - 1) * step, due[i])
+end
+return #due
+"""
+
+    # KEYS: lease, fence pairs of the shards; ARGV: owner, lease ms, 1 to acquire or renew / 0 to release each shard
+    # a free lease is taken with the next fencing token, a held one is extended, a foreign one is left alone
+    # returns fencing token of each shard held by the owner, 0 if not held
+    LEASE_SCRIPT = """
+local tokens = {}
+for i = 1, #KEYS, 2 do
+    local n = (i + 1) / 2
+    local holder = redis.call('GET', KEYS[i])
+    tokens[n] = 0
+    if ARGV[n + 2] == '0' then
+        if holder == ARGV[1] then
+            redis.call('DEL', KEYS[i])
+        end
+    elseif holder == ARGV[1] then
+        redis.call('PEXPIRE', KEYS[i], ARGV[2])
+        tokens[n] = tonumber(redis.call('GET', KEYS[i + 1])) or 0
+    elseif not holder then
+        redis.call('SET', KEYS[i], ARGV[1], 'PX', ARGV[2])
+        tokens[n] = redis.call('INCR', KEYS[i + 1])
+    end
+end
+return tokens
+"""
+
+    # KEYS: queued gid set, work list, queued gid count of the work list; ARGV: queued epoch, stale before epoch,
+    # chunk size, message prefix, followed by gid, scheduled epoch pairs
+    # pushes gids not yet waiting in any work list as update messages of up to chunk size gids and adds them to the count
+    # returns number of pushed and skipped gids
+    DISPATCH_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local chunk = tonumber(ARGV[3])
+local gids, stamps, msgs = {}, {}, {}
+local pushed, skipped = 0, 0
+for i = 5, #ARGV, 2 do
+    if redis.call('ZSCORE', KEYS[1], ARGV[i]) then
+        skipped = skipped + 1
+    else
+        redis.call('ZADD', KEYS[1], ARGV[1], ARGV[i])
+        gids[#gids + 1] = ARGV[i]
+        stamps[#stamps + 1] = ARGV[i + 1]
+    end
+    if #gids == chunk or (i + 2 > #ARGV and #gids > 0) then
+        msgs[#msgs + 1] = ARGV[4] .. table.concat(gids, ',') .. '/' .. table.concat(stamps, ',')
+        pushed = pushed + #gids
+        gids, stamps = {}, {}
+    end
+end
+if #msgs > 0 then
+    redis.call('RPUSH', KEYS[2], unpack(msgs))
+    redis.call('INCRBY', KEYS[3], pushed)
+end
+return {pushed, skipped}
+"""
+
+    # registered gids are polled through priority lane, master polls them after the lease if the lane is not served
+    PRIORITY_LEASE_S = 60
+
+    def __init__(self, logger, redis, pubsub, shards=config.DEFAULT_POLLER_SHARDS, stats=None):
         """
         @type pubsub: Pubsub
         @type logger: Logger
         @type redis: Redis
+        @param shards: number of gid schedule shards
+        @type stats: PollerStats
         """
         self.logger = logger
         self.rc = redis
         self.pubsub = pubsub
+        self.shards = shards
+        self.stats = stats
+        self.claim_script = self.rc.register_script(Balancer.CLAIM_SCRIPT)
+        self.spread_script = self.rc.register_script(Balancer.SPREAD_SCRIPT)
+        self.dispatch_script = self.rc.register_script(Balancer.DISPATCH_SCRIPT)
+        self.lease_script = self.rc.register_script(Balancer.LEASE_SCRIPT)
+
+    # ****************************************************
+    # *********       GID SCHEDULE SHARDING      *********
+    # ****************************************************
+    @staticmethod
+    def _hash(value):
+        return zlib.crc32(value) & 0xffffffff
+
+    def shard_of(self, gid):
+        """ shard number the gid is scheduled in """
+        return Balancer._hash(gid) % self.shards
 
-    def get_next_poll_set(self, up_to_epoch):
+    def shard_key(self, shard):
+        """ single shard schedule lives in legacy 'all' gid set """
+        return S1.gid_set('all') if self.shards == 1 else S1.gid_shard_set(shard)
+
+    def gid_set_key(self, gid):
+        return self.shard_key(self.shard_of(gid))
+
+    def shard_keys(self):
+        return [self.shard_key(shard) for shard in xrange(0, self.shards)]
+
+    def assign_shards(self, name, masters):
+        """
+        rendezvous hashing of shards to masters: each shard goes to the master with the highest
+        shard:master hash, only shards of a leaving master move and a joining master takes an even share
+        @param name: master name
+        @param masters: names of all live masters
+        @return: list of shards owned by the master
         """
-        grabs a range up to current time() from 'all' gid set
+        if not masters:
+            return []
+        return [shard for shard in xrange(0, self.shards)
+                if max(masters, key=lambda m: Balancer._hash('{0}:{1}'.format(shard, m))) == name]
+
+    def heartbeat_master(self, name, at_time, ttl):
+        """
+        refreshes master heartbeat, drops masters which missed theirs
+        @return: names of live masters
+        """
+        pipe = self.rc.pipeline()
+        pipe.zadd(S1.master_set(), name, at_time)
+        pipe.zremrangebyscore(S1.master_set(), '-inf', at_time - ttl)
+        pipe.zrange(S1.master_set(), 0, -1)
+        return pipe.execute()[2]
+
+    def lease_shards(self, name, acquire, release, lease_s):
+        """
+        acquires or renews shard leases, a master writes to shard gid set only with the fencing token of its lease
+        @param name: master name
+        @param acquire: shards to acquire or renew
+        @param release: shards to give up
+        @param lease_s: lease time, a lease not renewed in time can be taken by another master
+        @return: dict of shard --> fencing token of shards held by the master
+        """
+        shards = list(acquire) + list(release)
+        if not shards:
+            return dict()
+        keys = []
+        for shard in shards:
+            keys.extend([S1.shard_lease_key(shard), S1.shard_fence_key(shard)])
+        args = [name, int(lease_s * 1000)] + [1] * len(acquire) + [0] * len(release)
+        tokens = self.lease_script(keys=keys, args=args)
+        return {shard: token for shard, token in zip(shards, tokens) if token}
+
+    def remove_master(self, name):
+        self.rc.zrem(S1.master_set(), name)
+        self.rc.hdel(S1.poller_key_fmt(name), 'shards')
+
+    def set_master_shards(self, name, shards):
+        self.rc.hset(S1.poller_key_fmt(name), 'shards', ','.join(str(shard) for shard in shards))
+
+    def get_masters(self):
+        return self.rc.zrange(S1.master_set(), 0, -1)
+
+    def scan_gids(self):
+        """ iterates over all scheduled gids """
+        for key in self.shard_keys():
+            for gid, _ in self.rc.zscan_iter(key):
+                yield gid
+
+    def get_next_poll_set(self, up_to_epoch, shard=0):
+        """
+        grabs a range up to current time() from shard gid set
         @return: batch of gids to process or None if cursor reset is required
         """
-        return self.rc.zrangebyscore(S1.gid_set('all'), 0, up_to_epoch, start=0, num=200, withscores=False)
+        return self.rc.zrangebyscore(self.shard_key(shard), 0, up_to_epoch, start=0, num=200, withscores=False)
 
-    def set_poller_stats(self, name, hour, day):
-        self.rc.hset(S1.poller_key_fmt(name), 'hour', hour)
-        self.rc.hset(S1.poller_key_fmt(name), 'day', day)
+    def fence_keys(self, shard):
+        return [S1.shard_lease_key(shard), S1.shard_fence_key(shard), self.shard_key(shard)]
 
-    def get_poller_stats(self):
-        pollers = [{'name': k,
-                    'hour': self.rc.hget(S1.poller_key_fmt(k), 'hour'),
-                    'day': self.rc.hget(S1.poller_key_fmt(k), 'day')}
-                   for k in self.rc.smembers(S1.poller_set())]
+    def claim_next_poll_set(self, shard, up_to_epoch, lease_until, num=200, owner='', token=0):
+        """
+        atomically grabs a range up to up_to_epoch from shard gid set and leases it until lease_until
+        @param shard: shard number
+        @param up_to_epoch: due time limit
+        @param lease_until: epoch the claimed gids become due again unless re-scheduled with add_gid_set()
+        @param num: max number of gids to claim
+        @param owner: master name, claims only if it holds the shard lease with the token, see lease_shards()
+        @param token: fencing token of the shard lease
+        @return: batch of claimed (gid, scheduled epoch) tuples, None if the shard lease is lost
+        """
+        due = self.claim_script(keys=self.fence_keys(shard), args=[owner, token, up_to_epoch, lease_until, num])
+        if due is None:
+            return None
+        return [(gid, float(score)) for gid, score in zip(due[0::2], due[1::2])]
 
-        return pollers
+    def count_due(self, shard, up_to_epoch):
+        return self.rc.zcount(self.shard_key(shard), '-inf', up_to_epoch)
 
-    def get_poller_stats_ex(self):
+    def spread_due(self, shard, up_to_epoch, start_epoch, window_s, owner='', token=0):
+        """
+        spreads gids of the shard due up to up_to_epoch evenly over [start_epoch, start_epoch + window_s),
+        gids marked with set_priority_bulk() are left due
+        @return: number of re-scheduled gids, None if the shard lease is lost
+        """
+        return self.spread_script(keys=self.fence_keys(shard) + [S1.shard_priority_key(shard)],
+                                  args=[owner, token, up_to_epoch, start_epoch, window_s])
+
+    def set_priority_bulk(self, gid_flags):
+        """
+        marks gids of higher priority plans in their shards with a single SADD and SREM per shard
+        @param gid_flags: dict of gid --> True for a higher priority plan
+        """
+        shard_args = dict()
+        for gid, flag in gid_flags.iteritems():
+            shard_args.setdefault((S1.shard_priority_key(self.shard_of(gid)), flag), []).append(gid)
+        if not shard_args:
+            return
+
+        pipe = self.rc.pipeline(transaction=False)
+        for (key, flag), gids in shard_args.iteritems():
+            if flag:
+                pipe.sadd(key, *gids)
+            else:
+                pipe.srem(key, *gids)
+        pipe.execute()
+
+    def dispatch_gids(self, channel, message, claimed, at_time, queued_ttl_s, chunk):
+        """
+        pushes claimed gids to the work list skipping gids which still wait in a work list
+        @param claimed: list of (gid, scheduled epoch) tuples
+        @param queued_ttl_s: gid queued for longer is considered lost and is pushed again
+        @param chunk: max number of gids in one message
+        @return: (pushed, skipped) gid counts
+        """
+        if not claimed:
+            return 0, 0
+        args = [at_time, at_time - queued_ttl_s, chunk, Pubsub._format_message(message, [''])]
+        for gid, scheduled in claimed:
+            args.extend([gid, int(scheduled)])
+        pushed, skipped = self.dispatch_script(keys=[S1.queued_key(), channel, S1.queued_count_key(channel)], args=args)
+        return pushed, skipped
+
+    def dequeue_gids(self, gids, channel=None):
+        """
+        marks the gids taken off a work list
+        @param channel: work list the gids were taken off
+        """
+        if not gids:
+            return
+        pipe = self.rc.pipeline(transaction=False)
+        pipe.zrem(S1.queued_key(), *gids)
+        if channel:
+            pipe.decr(S1.queued_count_key(channel), len(gids))
+        pipe.execute()
+
+    def queued_depth(self, channel, chunk):
+        """
+        @param chunk: max number of gids in one work list message
+        @return: number of gids waiting in the work list
+        """
+        pipe = self.rc.pipeline(transaction=False)
+        pipe.llen(channel)
+        pipe.get(S1.queued_count_key(channel))
+        messages, count = pipe.execute()
+        # the count drifts when a worker dies holding a message, it is bounded by the messages still queued
+        return min(max(int(count or 0), messages), messages * chunk)
+
+    def get_poller_stats(self, at_time):
+        """
+        @return: list of poller info dicts, hour and day are rolling dispatch counts
+        """
+        names = list(self.rc.smembers(S1.poller_set()))
+        rolling = self.stats.get_rolling(names, at_time) if self.stats else dict()
+        pipe = self.rc.pipeline(transaction=False)
+        for name in names:
+            pipe.hget(S1.poller_key_fmt(name), 'shards')
+        shards = pipe.execute()
+
+        return [{'name': name,
+                 'hour': rolling.get(name, (0, 0))[0],
+                 'day': rolling.get(name, (0, 0))[1],
+                 'shards': shards[n]}
+                for n, name in enumerate(names)]
+
+    def get_poller_stats_ex(self, minutes=15):
+        """
+        @param minutes: telemetry window length
+        """
+        at_time = time.time()
+        masters = self.get_masters()
+        pipe = self.rc.pipeline(transaction=False)
+        for key in self.shard_keys():
+            pipe.zcard(key)
+        for key in self.shard_keys():
+            pipe.zcount(key, '-inf', at_time)
+        for channel in [S1.poller_channel_name('all')] + [S1.poller_work_channel(m) for m in masters]:
+            pipe.llen(channel)
+        counts = pipe.execute()
+        pollers = self.get_poller_stats(at_time)
 
         return dict(
-            all_count=self.rc.zcard(S1.gid_set('all')),
-            pollers=self.get_poller_stats(),
-            poller_names=list(self.rc.smembers(S1.poller_set())),
+            all_count=sum(counts[:self.shards]),
+            shard_counts=counts[:self.shards],
+            overdue_count=sum(counts[self.shards:2 * self.shards]),
+            pollers=pollers,
+            poller_names=[p['name'] for p in pollers],
+            masters=masters,
             register_set_len=self.rc.scard(S1.register_set()),
-            poll_list_len=self.rc.llen(S1.poller_channel_name('all'))
+            priority_list_len=self.rc.llen(S1.poller_priority_channel()),
+            poll_list_len=sum(counts[2 * self.shards:]),
+            telemetry=self.stats.get_telemetry(masters, at_time, minutes) if self.stats else dict()
         )
 
     def register_gid(self, gid):
         # add to balance list
         self.rc.sadd(S1.register_set(), gid)
-        # notify poller(s)
-        self.pubsub.broadcast_command_now(S1.poller_channel_name('all'), S1.msg_register())
+        # notify poller(s) through priority lane, enqueue time is used to track lane latency
+        self.pubsub.broadcast_command(S1.poller_priority_channel(), S1.msg_register(), '{0:.3f}'.format(time.time()))
 
     def get_next_registered(self):
         return self.rc.spop(S1.register_set())
 
     def add_gid_set(self, gid, at_epoch):
-        self.rc.zadd(S1.gid_set('all'), gid, at_epoch)
\ No newline at end of file
+        self.rc.zadd(self.gid_set_key(gid), gid, at_epoch)
+
+    def add_gid_set_bulk(self, gid_epochs):
+        """
+        schedules multiple gids with a single ZADD per shard
+        @type gid_epochs: dict
+        """
+        if not gid_epochs:
+            return
+        shard_args = dict()
+        for gid, at_epoch in gid_epochs.iteritems():
+            shard_args.setdefault(self.gid_set_key(gid), []).extend([gid, at_epoch])
+
+        pipe = self.rc.pipeline(transaction=False)
+        for key, args in shard_args.iteritems():
+            pipe.zadd(key, *args)
+        pipe.execute()
+
+    def get_gid_set_score(self, gid):
+        return self.rc.zscore(self.gid_set_key(gid), gid)
+
+    def remove_gid_set(self, gid, rc=None):
+        """
+        @param rc: Redis client or pipeline to issue the commands to
+        """
+        rc = rc if rc else self.rc
+        rc.zrem(self.gid_set_key(gid), gid)
+        rc.srem(S1.shard_priority_key(self.shard_of(gid)), gid)
+        rc.hdel(S1.retry_key(), gid)
+
+    def retry_gids(self, gids, at_time, base_s, max_s):
+        """
+        re-schedules failed gids with exponential jittered backoff, the lease of the gids is extended to the retry epoch
+        @param base_s: first retry delay
+        @param max_s: max retry delay
+        @return: dict of gid --> retry epoch
+        """
+        if not gids:
+            return dict()
+        pipe = self.rc.pipeline(transaction=False)
+        for gid in gids:
+            pipe.hincrby(S1.retry_key(), gid, 1)
+        attempts = pipe.execute()
+
+        retry_at = {gid: at_time + random.uniform(0.5, 1.0) * min(max_s, base_s * 2 ** min(n - 1, 20))
+                    for gid, n in zip(gids, attempts)}
+        self.add_gid_set_bulk(retry_at)
+        return retry_at
+
+    def clear_retries(self, gids):
+        """ resets backoff of successfully polled gids """
+        if gids:
+            self.rc.hdel(S1.retry_key(), *gids)
@@ -0,0 +1,113 @@
+from logging import Logger
+
+from redis import Redis
+
+from core.schema import S1
+
+
+class CircuitBreaker(object):
+    """
+    Upstream circuit breaker shared by all processes through Redis.
+    Trips open when the error rate over a window crosses the threshold, all calls are denied while open.
+    Once open period expires, a single probe call is let through to decide whether to close or open again.
+    """
+    CLOSED = 1
+    PROBE = 2
+    DENIED = 0
+
+    # KEYS: open key, half-open key, probe key; ARGV: probe token, probe ttl
+    ALLOW_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 1
+end
+if redis.call('SET', KEYS[3], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 2
+end
+return 0
+"""
+
+    def __init__(self, logger, rc, name, window_s=60, min_calls=20, error_rate=0.5, open_s=60, probe_s=30):
+        """
+        @type logger: Logger
+        @type rc: Redis
+        @param name: upstream name
+        @param window_s: error rate window
+        @param min_calls: min number of calls in window to trip
+        @param error_rate: error rate to trip
+        @param open_s: time to deny calls after trip
+        @param probe_s: probe result must be recorded within this time, another probe is let through otherwise
+        """
+        self.logger = logger
+        self.rc = rc
+        self.name = name
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_s = open_s
+        self.probe_s = probe_s
+        self.allow_script = self.rc.register_script(CircuitBreaker.ALLOW_SCRIPT)
+
+    def load_config(self, cfg):
+        self.window_s = cfg['breaker_window_s'] if 'breaker_window_s' in cfg else self.window_s
+        self.min_calls = cfg['breaker_min_calls'] if 'breaker_min_calls' in cfg else self.min_calls
+        self.error_rate = cfg['breaker_error_rate'] if 'breaker_error_rate' in cfg else self.error_rate
+        self.open_s = cfg['breaker_open_s'] if 'breaker_open_s' in cfg else self.open_s
+        self.probe_s = cfg['breaker_probe_s'] if 'breaker_probe_s' in cfg else self.probe_s
+
+    def window_key(self, at_time):
+        return S1.breaker_key(self.name, 'w.{0}'.format(int(at_time) / self.window_s))
+
+    def allow(self):
+        """
+        @return: CLOSED if call is allowed, PROBE if call is allowed as the probe, DENIED otherwise
+        """
+        return self.allow_script(keys=[S1.breaker_key(self.name, 'open'),
+                                       S1.breaker_key(self.name, 'half'),
+                                       S1.breaker_key(self.name, 'probe')],
+                                 args=[self.name, self.probe_s])
+
+    def record(self, at_time, ok, failed):
+        """
+        records number of successful and failed calls, trips the breaker on high error rate
+        @return: True if tripped
+        """
+        key = self.window_key(at_time)
+        pipe = self.rc.pipeline(transaction=False)
+        pipe.hincrby(key, 'ok', ok)
+        pipe.hincrby(key, 'failed', failed)
+        pipe.expire(key, self.window_s * 2)
+        ok, failed, _ = pipe.execute()
+
+        calls = ok + failed
+        if calls < self.min_calls or failed < calls * self.error_rate:
+            return False
+
+        self.logger.warning('Circuit [{0}] open, [{1}] failed of [{2}] calls'.format(self.name, failed, calls))
+        self.trip(at_time)
+        return True
+
+    def record_probe(self, at_time, ok):
+        """
+        closes the breaker on probe success, opens it again on failure
+        """
+        if not ok:
+            self.logger.warning('Circuit [{0}] probe failed'.format(self.name))
+            self.trip(at_time)
+            return
+
+        self.logger.warning('Circuit [{0}] closed'.format(self.name))
+        self.rc.delete(S1.breaker_key(self.name, 'half'), S1.breaker_key(self.name, 'probe'), self.window_key(at_time))
+
+    def trip(self, at_time):
+        pipe = self.rc.pipeline(transaction=True)
+        pipe.setex(S1.breaker_key(self.name, 'open'), 1, self.open_s)
+        pipe.set(S1.breaker_key(self.name, 'half'), 1)
+        pipe.delete(S1.breaker_key(self.name, 'probe'), self.window_key(at_time))
+        pipe.execute()
+
+    def is_open(self):
+        """ True while all calls are denied, probe period excluded """
+        return bool(self.rc.exists(S1.breaker_key(self.name, 'open')))
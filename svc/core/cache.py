@@ -1,19 +1,80 @@
-import json
+import marshal
+import sys
 import time
+from array import array
+from collections import Counter, OrderedDict
+from core.codec import Codec
 from core.schema import S1
+from providers.google_rss import Activity, GoogleRSS
 from utils import config
 from redis import Redis
 from logging import Logger
 
 
+class ActivitiesLRU(object):
+    """
+    Bounded in-process copy of cached activities, least recently used gids are evicted first
+    items are kept marshalled, every read decodes its own copy as publishers modify items
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # gid --> (etag, marshalled meta, list of (updated stamp, marshalled item) latest first, size)
+        self.entries = OrderedDict()
+
+    def get(self, gid, etag):
+        """
+        @return: entry of the gid if it is of the etag, None otherwise
+        """
+        entry = self.entries.pop(gid, None)
+        if entry and entry[0] == etag:
+            self.entries[gid] = entry
+            self.hits += 1
+            return entry
+        if entry:
+            self.size -= entry[3]
+        self.misses += 1
+        return None
+
+    def put(self, gid, etag, meta, items):
+        size = len(meta) + sum(len(item) for _, item in items)
+        if size > self.max_bytes:
+            return None
+        entry = (etag, meta, items, size)
+        self.entries[gid] = entry
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted[3]
+        return entry
+
+
 class Cache(object):
-    def __init__(self, logger, redis):
+    # number of one-minute buckets in the daily activity map
+    ACTIVITY_MAP_SLOTS = 1440
+    # weight of the latest interval in the moving average of intervals between data changes
+    CHANGE_INTERVAL_ALPHA = 0.3
+
+    def __init__(self, logger, redis, codec=Codec.ZLIB_MARSHAL):
         """
         @type logger: Logger
         @type redis: Redis
+        @param codec: Codec version activities documents are stored with, any version is read
         """
         self.logger = logger
         self.rc = redis
+        self.codec = codec
+        # in-process copy of activities, see enable_lru()
+        self.lru = None
+
+    def enable_lru(self, max_bytes):
+        """
+        keeps recently read activities in process, each read validates the copy by the stored etag
+        @param max_bytes: max size of marshalled activities kept
+        """
+        self.lru = ActivitiesLRU(max_bytes)
 
     def reset_cache(self, gid):
         self.set_poll_stamp(gid, 0)
@@ -33,29 +94,279 @@ class Cache(object):
 
     def cache_activities_doc(self, gid, activities_doc):
         """ stores activities document (google's) into local database (redis)
+        items are stored one by one indexed by updated timestamp, only new or changed items are written,
+        cached items updated within the time range of the document but missing from it were deleted upstream and are removed
         @param gid: source user id
         @param activities_doc: source data dict
+        @return: number of items written or removed
         """
-        self.rc.hset(S1.cache_key(gid), S1.cache_items_key(), json.dumps(activities_doc, encoding='utf-8'))
+        items = activities_doc.get('items', [])
+        meta = {k: v for k, v in activities_doc.iteritems() if k != 'items'}
+        etags, removed = [], []
+        if items:
+            stamps = [GoogleRSS.get_item_updated_stamp(item) for item in items]
+            pipe = self.rc.pipeline(transaction=False)
+            pipe.hmget(S1.cache_item_etag_key(gid), [item['id'] for item in items])
+            pipe.zrangebyscore(S1.cache_item_index_key(gid), min(stamps), max(stamps))
+            etags, in_range = pipe.execute()
+            ids = set(item['id'] for item in items)
+            removed = [item_id for item_id in in_range if item_id not in ids]
+        changed = [item for item, etag in zip(items, etags) if etag != Cache.get_item_etag(item)]
 
-    def hget_int(self, key, sub_key):
-        try:
-            return int(self.rc.hget(key, sub_key))
-        except:
-            return 0
+        pipe = self.rc.pipeline()
+        # validates in-process copies, see enable_lru()
+        pipe.hset(S1.cache_key(gid), S1.etag_key(), activities_doc.get('etag', ''))
+        pipe.hset(S1.cache_key(gid), S1.cache_meta_key(), Codec.encode(meta, self.codec))
+        # legacy whole document
+        pipe.hdel(S1.cache_key(gid), S1.cache_items_key())
+        if changed:
+            pipe.hmset(S1.cache_item_hash_key(gid), {item['id']: Codec.encode(item, self.codec) for item in changed})
+            pipe.hmset(S1.cache_item_etag_key(gid), {item['id']: Cache.get_item_etag(item) for item in changed})
+            for item in changed:
+                pipe.zadd(S1.cache_item_index_key(gid), item['id'], GoogleRSS.get_item_updated_stamp(item))
+        if removed:
+            pipe.zrem(S1.cache_item_index_key(gid), *removed)
+            pipe.hdel(S1.cache_item_hash_key(gid), *removed)
+            pipe.hdel(S1.cache_item_etag_key(gid), *removed)
+        pipe.zcard(S1.cache_item_index_key(gid))
+        if pipe.execute()[-1] > config.DEFAULT_MAX_RESULTS_CACHE:
+            self.trim_items(gid, config.DEFAULT_MAX_RESULTS_CACHE)
+        return len(changed) + len(removed)
+
+    @staticmethod
+    def get_item_etag(item):
+        return item.get('etag') or item.get('updated', '')
+
+    def trim_items(self, gid, keep):
+        """
+        drops all but keep most recently updated items of the gid
+        """
+        ids = self.rc.zrange(S1.cache_item_index_key(gid), 0, -keep - 1)
+        if not ids:
+            return
+        pipe = self.rc.pipeline()
+        pipe.zrem(S1.cache_item_index_key(gid), *ids)
+        pipe.hdel(S1.cache_item_hash_key(gid), *ids)
+        pipe.hdel(S1.cache_item_etag_key(gid), *ids)
+        pipe.execute()
+
+    def clear_items(self, gid, rc=None):
+        (rc or self.rc).delete(S1.cache_item_hash_key(gid), S1.cache_item_etag_key(gid), S1.cache_item_index_key(gid))
+
+    def _get_items(self, gid, ids):
+        if not ids:
+            return []
+        return [Activity(item) for item in (Codec.decode(value) for value in self.rc.hmget(S1.cache_item_hash_key(gid), ids)) if item]
+
+    def get_activity_map(self, gid):
+        """
+        @return: per-minute activity histogram of the gid, array of ACTIVITY_MAP_SLOTS counters
+        """
+        return Cache.unpack_activity_map(self.rc.get(S1.cache_activity_map_key(gid)))
 
     def get_num_minute_updates(self, gid, stamp, spread_minutes):
-        keys = self.rc.hkeys(S1.cache_key(gid))
-        return sum([self.hget_int(S1.cache_key(gid), k) for k in keys if self._is_key_in_stamp(k, stamp, spread_minutes)])
+        """
+        @return: number of updates recorded for the time of day of the stamp +/- spread_minutes
+        """
+        return Cache.activity_map_window(self.get_activity_map(gid), Cache.stamp_minute(stamp), spread_minutes)
 
     def incr_num_minute_updates(self, gid, stamp):
-        # get the minute of the day
-        minute = (stamp / 60) % 1440
-        self.rc.hincrby(S1.cache_key(gid), S1.updated_minute_fmt(minute))
+        self.incr_num_minute_updates_bulk(gid, [stamp])
+
+    def incr_num_minute_updates_bulk(self, gid, stamps):
+        """
+        increments activity map counters for each of the stamps in a single command
+        @type stamps: list
+        """
+        if stamps:
+            self.incr_activity_map(gid, Counter(Cache.stamp_minute(stamp) for stamp in stamps))
+
+    def incr_activity_map(self, gid, counts, rc=None):
+        """
+        increments activity map counters in a single BITFIELD command
+        @param counts: dict of minute of the day --> increment
+        @param rc: optional pipeline to queue the command to
+        @type counts: dict
+        """
+        # counters are unsigned 16 bit ints saturating at 65535
+        cmd = ['BITFIELD', S1.cache_activity_map_key(gid), 'OVERFLOW', 'SAT']
+        for minute, count in counts.iteritems():
+            cmd.extend(['INCRBY', 'u16', '#{0}'.format(minute), count])
+
+        return (rc or self.rc).execute_command(*cmd)
+
+    def get_poll_history(self, gid):
+        """
+        reads everything the poll scheduler needs for the gid in one round trip
+        @return: (activity map, last change epoch, average change interval in seconds)
+        """
+        return self.get_poll_history_bulk([gid])[0]
+
+    def get_poll_history_bulk(self, gids):
+        """
+        pipelined get_poll_history() for a list of gids
+        @return: list of (activity map, last change epoch, average change interval in seconds)
+        """
+        pipe = self.rc.pipeline(transaction=False)
+        for gid in gids:
+            pipe.get(S1.cache_activity_map_key(gid))
+            pipe.hmget(S1.cache_key(gid), S1.changed_key(), S1.change_interval_key())
+        result = pipe.execute()
+        return [(Cache.unpack_activity_map(raw_map), float(change[0] or 0), float(change[1] or 0))
+                for raw_map, change in zip(result[0::2], result[1::2])]
+
+    def set_changed(self, gid, stamp):
+        """
+        records a data change (new etag) of the gid, maintains moving average of the interval between changes
+        """
+        changed, interval = self.rc.hmget(S1.cache_key(gid), S1.changed_key(), S1.change_interval_key())
+        if changed:
+            last_interval = max(0.0, stamp - float(changed))
+            interval = last_interval if not interval else float(interval) + Cache.CHANGE_INTERVAL_ALPHA * (last_interval - float(interval))
+
+        self.rc.hmset(S1.cache_key(gid), {S1.changed_key(): stamp, S1.change_interval_key(): interval or 0})
+
+    @staticmethod
+    def stamp_minute(stamp):
+        """ minute of the day of the epoch stamp """
+        return int(stamp) / 60 % Cache.ACTIVITY_MAP_SLOTS
+
+    @staticmethod
+    def unpack_activity_map(raw):
+        """
+        unpacks raw activity map string (big-endian u16 BITFIELD layout) into array of counters
+        @type raw: str
+        @rtype: array
+        """
+        raw = raw or ''
+        activity_map = array('H', raw[:len(raw) & ~1])
+        if sys.byteorder == 'little':
+            activity_map.byteswap()
+
+        # BITFIELD will only allocate the string up to the highest counter written
+        if len(activity_map) < Cache.ACTIVITY_MAP_SLOTS:
+            activity_map.extend([0] * (Cache.ACTIVITY_MAP_SLOTS - len(activity_map)))
+
+        return activity_map
+
+    @staticmethod
+    def pack_activity_map(activity_map):
+        """
+        packs array of counters into raw activity map string
+        @type activity_map: array
+        """
+        packed = array('H', activity_map)
+        if sys.byteorder == 'little':
+            packed.byteswap()
+        return packed.tostring()
+
+    @staticmethod
+    def activity_map_window(activity_map, minute, spread_minutes):
+        """
+        sums activity map counters in [minute - spread_minutes, minute + spread_minutes], wraps around midnight
+        @type activity_map: array
+        """
+        slots = Cache.ACTIVITY_MAP_SLOTS
+        if 2 * spread_minutes + 1 >= slots:
+            return sum(activity_map)
+
+        lo = minute - spread_minutes
+        hi = minute + spread_minutes + 1
+        if lo < 0:
+            return sum(activity_map[lo + slots:]) + sum(activity_map[:hi])
+        elif hi > slots:
+            return sum(activity_map[lo:]) + sum(activity_map[:hi - slots])
+
+        return sum(activity_map[lo:hi])
+
+    def _get_lru_entry(self, gid):
+        """
+        @return: in-process entry of the gid, loaded if stale, None if the gid has no per-item cache
+        """
+        etag = self.rc.hget(S1.cache_key(gid), S1.etag_key())
+        if not etag:
+            return None
+        entry = self.lru.get(gid, etag)
+        if entry:
+            return entry
 
-    def get_activities(self, gid):
-        str_value = self.rc.hget(S1.cache_key(gid), S1.cache_items_key())
-        return json.loads(str_value) if str_value else None
+        pipe = self.rc.pipeline(transaction=False)
+        pipe.hget(S1.cache_key(gid), S1.cache_meta_key())
+        pipe.zrevrange(S1.cache_item_index_key(gid), 0, -1, withscores=True)
+        pipe.hgetall(S1.cache_item_hash_key(gid))
+        meta, index, values = pipe.execute()
+        if not meta:
+            return None
+        meta = marshal.dumps(Codec.decode(meta), 2)
+        items = [(updated, marshal.dumps(Codec.decode(values[item_id]), 2)) for item_id, updated in index if item_id in values]
+        # entry too large to be kept is still served once
+        return self.lru.put(gid, etag, meta, items) or (etag, meta, items, 0)
+
+    def get_activities_since(self, gid, timestamp):
+        """
+        @return: (activities document without items, items updated after the timestamp ordered by published timestamp),
+        meta is None if not cached
+        """
+        entry = self._get_lru_entry(gid) if self.lru else None
+        if not entry:
+            return self.get_activities_meta(gid), self.get_updated_since(gid, timestamp)
+
+        items = [Activity(marshal.loads(item)) for updated, item in entry[2] if updated > timestamp]
+        items.sort(key=GoogleRSS.get_item_published_stamp)
+        return marshal.loads(entry[1]), items
+
+    def get_activities_meta(self, gid):
+        """
+        @return: activities document without items, None if not cached
+        """
+        meta, legacy = self.rc.hmget(S1.cache_key(gid), S1.cache_meta_key(), S1.cache_items_key())
+        if meta:
+            return Codec.decode(meta)
+        doc = Codec.decode(legacy)
+        if doc:
+            doc.pop('items', None)
+        return doc
+
+    def get_items(self, gid, num=config.DEFAULT_MAX_RESULTS):
+        """
+        @return: num most recently updated items, latest first
+        """
+        ids = self.rc.zrevrange(S1.cache_item_index_key(gid), 0, num - 1)
+        if ids:
+            return self._get_items(gid, ids)
+        doc = Codec.decode(self.rc.hget(S1.cache_key(gid), S1.cache_items_key()))
+        return doc.get('items', [])[:num] if doc else []
+
+    def get_updated_since(self, gid, timestamp):
+        """
+        @return: items updated after the timestamp ordered by published timestamp
+        """
+        pipe = self.rc.pipeline(transaction=False)
+        pipe.exists(S1.cache_item_index_key(gid))
+        pipe.zrangebyscore(S1.cache_item_index_key(gid), '({0}'.format(timestamp), '+inf')
+        indexed, ids = pipe.execute()
+        if not indexed:
+            doc = Codec.decode(self.rc.hget(S1.cache_key(gid), S1.cache_items_key()))
+            return GoogleRSS.get_updated_since(doc, timestamp) if doc else []
+        items = self._get_items(gid, ids)
+        items.sort(key=GoogleRSS.get_item_published_stamp)
+        return items
+
+    def get_activities(self, gid, num=config.DEFAULT_MAX_RESULTS):
+        """
+        @return: activities document with num most recently updated items, None if not cached
+        """
+        entry = self._get_lru_entry(gid) if self.lru else None
+        if entry:
+            meta = marshal.loads(entry[1])
+            meta['items'] = [Activity(marshal.loads(item)) for _, item in entry[2][:num]]
+            return meta
+
+        meta = self.get_activities_meta(gid)
+        if meta is None:
+            return None
+        meta['items'] = self.get_items(gid, num)
+        return meta
 
     def is_cache(self, gid, option):
         #check last requested timestamp
@@ -113,12 +424,3 @@ class Cache(object):
         if not value:
             return default
         return value
-
-    @staticmethod
-    def _is_key_in_stamp(key, stamp, spread_minutes):
-        try:
-            minute = int(S1.get_minute_fmt_minute(key))
-            stamp_minute = stamp / 60 % 1440
-            return (stamp_minute - spread_minutes) <= minute <= (stamp_minute + spread_minutes)
-        except:
-            return False
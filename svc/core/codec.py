@@ -0,0 +1,57 @@
+import json
+import marshal
+import zlib
+
+
+class Codec(object):
+    """
+    Versioned encodings of cached documents, an encoded value starts with its codec version byte,
+    legacy values without a header are plain JSON text
+    """
+    JSON = 0
+    ZLIB_JSON = 1
+    ZLIB_MARSHAL = 2
+
+    # zlib level, decode speed is the same for all levels
+    LEVEL = 6
+
+    # version --> (encode, decode), headers are added and stripped by encode() and decode()
+    CODECS = {
+        JSON: (lambda doc: json.dumps(doc, encoding='utf-8'),
+               lambda raw: json.loads(raw)),
+        ZLIB_JSON: (lambda doc: zlib.compress(json.dumps(doc, encoding='utf-8'), Codec.LEVEL),
+                    lambda raw: json.loads(zlib.decompress(raw))),
+        # marshal format of python 2.7, version 2 of marshal
+        ZLIB_MARSHAL: (lambda doc: zlib.compress(marshal.dumps(doc, 2), Codec.LEVEL),
+                       lambda raw: marshal.loads(zlib.decompress(raw))),
+    }
+
+    @staticmethod
+    def version_of(value):
+        """
+        @return: codec version of the encoded value
+        """
+        if value and ord(value[0]) in Codec.CODECS:
+            return ord(value[0])
+        return Codec.JSON
+
+    @staticmethod
+    def encode(doc, version=ZLIB_MARSHAL):
+        """
+        @param version: codec version, plain JSON is written without a header
+        """
+        if version == Codec.JSON:
+            return Codec.CODECS[Codec.JSON][0](doc)
+        return chr(version) + Codec.CODECS[version][0](doc)
+
+    @staticmethod
+    def decode(value):
+        """
+        @return: decoded document, None for empty value
+        """
+        if not value:
+            return None
+        version = Codec.version_of(value)
+        if version == Codec.JSON:
+            return Codec.CODECS[Codec.JSON][1](value)
+        return Codec.CODECS[version][1](value[1:])
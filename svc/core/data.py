@@ -1,9 +1,10 @@
 import json
 import time
+import uuid
 
 import redis
 
-from core import balancer, cache, provider_data
+from core import balancer, cache, provider_data, quota, stats
 from core.buffer import Buffer
 from core.data_api import DataApi
 from core.data_base import DataBase
@@ -11,16 +12,22 @@ from core.filter import FilterData
 from providers.google_rss import GoogleRSS
 import pubsub
 from schema import S1
+from utils import config
 
 
 # noinspection PyBroadException
 class Data(DataBase):
+    # unanswered service queries are dropped by pollers and their replies expire after this
+    QUERY_REPLY_TTL_S = 60
+
     def __init__(self, logger, redis_host, redis_port, redis_db):
         DataBase.__init__(self, logger, redis_host, redis_port, redis_db)
 
         self.pubsub = pubsub.Pubsub(logger, redis.Redis(host=redis_host, port=redis_port, db=redis_db))
-        self.balancer = balancer.Balancer(logger, self.rc, self.pubsub)
+        self.stats = stats.PollerStats(logger, self.rc)
+        self.balancer = balancer.Balancer(logger, self.rc, self.pubsub, stats=self.stats)
         self.cache = cache.Cache(logger, self.rc)
+        self.quota = quota.Quota(logger, self.rc)
         self.provider = {
             'facebook': provider_data.ProviderData(self.rc, 'facebook'),
             'twitter': provider_data.ProviderData(self.rc, 'twitter'),
@@ -39,37 +46,56 @@ class Data(DataBase):
         self.buffer = Buffer(logger, self.rc, self.pubsub)
 
     def begin_validate_gid(self, gid):
-        self.begin_service_query(gid, S1.msg_validate())
+        """
+        @return: ticket to get the validation result with get_validate_gid()
+        """
+        return self.begin_service_query(gid, S1.msg_validate())
 
-    def get_validate_gid(self, gid):
-        r = self.end_service_query(gid, S1.msg_validate())
-        # first result only
-        return r[0] if r else None
+    def get_validate_gid(self, ticket, timeout_s=0):
+        return self.end_service_query(ticket, S1.msg_validate(), timeout_s)
 
     def begin_service_query(self, gid, query):
-        self.list_push(S1.query_list_in(query), gid)
-        self.pubsub.broadcast_command(S1.poller_channel_name('all'), query, S1.query_list_in(query), S1.query_list_out(query))
-
-    def end_service_query(self, gid, query):
-        # get all in list
-        results = self.rc.lrange(S1.query_list_out(query), 0, -1)
-        if not results:
-            return None
-
-        received = []
-        # check all results for the specified gid
-        mask = '{0}:'.format(gid)
-        for result in results:
-            if result.startswith(mask):
-                self.rc.lrem(S1.query_list_out(query), result)
-
-                # filter out empty results
-                received.append(result[len(mask):])
+        """
+        queues the query with a reply ticket and deadline, see reply_service_query()
+        @return: ticket
+        """
+        ticket = uuid.uuid4().hex
+        self.list_push(S1.query_list_in(query), '{0}:{1:.0f}:{2}'.format(ticket, time.time() + Data.QUERY_REPLY_TTL_S, gid))
+        # interactive queries go through poller priority lane
+        self.pubsub.broadcast_command(S1.poller_priority_channel(), query, S1.query_list_in(query), '{0:.3f}'.format(time.time()))
+        return ticket
 
-        return [r for r in received if r] if len(received) else None
+    def get_service_query(self, in_list_name, at_time):
+        """
+        @return: (ticket, gid) of the next live query, None if no queries
+        """
+        request = self.rc.lpop(in_list_name)
+        while request:
+            ticket, deadline, gid = request.split(':', 2)
+            if float(deadline) > at_time:
+                return ticket, gid
+            self.logger.warning('Dropping expired query {0} for {1}'.format(in_list_name, gid))
+            request = self.rc.lpop(in_list_name)
+        return None
+
+    def reply_service_query(self, ticket, query, result):
+        pipe = self.rc.pipeline()
+        pipe.rpush(S1.query_reply_key(query, ticket), result)
+        pipe.expire(S1.query_reply_key(query, ticket), Data.QUERY_REPLY_TTL_S)
+        pipe.execute()
+
+    def end_service_query(self, ticket, query, timeout_s=0):
+        """
+        @param timeout_s: seconds to block for the reply, 0 to return right away
+        @return: query result, None if not replied yet
+        """
+        if not timeout_s:
+            return self.rc.lpop(S1.query_reply_key(query, ticket))
+        reply = self.rc.blpop(S1.query_reply_key(query, ticket), timeout_s)
+        return reply[1] if reply else None
 
     def is_valid_gid(self, gid):
-        return self.rc.zscore(S1.gid_set('all'), gid) or self.rc.exists(S1.gid_key(gid))
+        return self.balancer.get_gid_set_score(gid) or self.rc.exists(S1.gid_key(gid))
 
     def register_gid(self, gid):
         """
@@ -78,22 +104,32 @@ class Data(DataBase):
         @param gid: google user id
         """
         self.logger.info('Registering GID: {0}'.format(gid))
-        # add to gid set with zero score
-        self.balancer.add_gid_set(gid, 0.0)
+        # add to gid set leased for the priority lane poll
+        self.balancer.add_gid_set(gid, time.time() + balancer.Balancer.PRIORITY_LEASE_S)
         # reset cache
         self.cache.reset_cache(gid)
         # poke the pollers
         self.balancer.register_gid(gid)
 
     def remove_from_poller(self, gid):
-        # remove from master set
-        self.rc.zrem(S1.gid_set('all'), gid)
+        self.remove_from_poller_bulk([gid])
 
-        # clear cache
-        self.rc.delete(S1.cache_key(gid))
-        self.del_destination_param(gid, 'cache', gid, S1.updated_key())
-        self.del_destination_param(gid, 'cache', gid, S1.etag_key())
-        self.purge_temp_accounts(gid)
+    def remove_from_poller_bulk(self, gids):
+        pipe = self.rc.pipeline(transaction=False)
+        for gid in gids:
+            # remove from master set
+            self.balancer.remove_gid_set(gid, rc=pipe)
+
+            # clear cache
+            pipe.delete(S1.cache_key(gid), S1.cache_activity_map_key(gid))
+            self.cache.clear_items(gid, rc=pipe)
+            pipe.hdel(S1.destination_option_key_fmt('cache'),
+                      S1.destination_pair_fmt(gid, gid, S1.updated_key()),
+                      S1.destination_pair_fmt(gid, gid, S1.etag_key()))
+        pipe.execute()
+
+        for gid in gids:
+            self.purge_temp_accounts(gid)
 
     def forget_source(self, master_gid, gid):
         """
@@ -195,6 +231,33 @@ class Data(DataBase):
 
         return True
 
+    def check_orphans(self, gids, at_time):
+        """
+        Bulk check_orphan() in one round trip, orphaned gids are removed from pollers
+        @type gids: list
+        @return: set of orphaned gids
+        """
+        pipe = self.rc.pipeline(transaction=False)
+        for gid in gids:
+            pipe.hget(S1.cache_key(gid), S1.cache_requested_key())
+            pipe.hget(S1.destination_key_fmt(S1.destinations_key()), gid)
+        values = pipe.execute()
+
+        orphans = set()
+        for gid, requested_str, destinations in zip(gids, values[0::2], values[1::2]):
+            # not requested for too long and not bound to any destinations
+            if at_time and not (requested_str and at_time - float(requested_str) >= config.DEFAULT_ORPHANED_TIMEOUT):
+                continue
+            if destinations:
+                continue
+            orphans.add(gid)
+
+        if orphans:
+            self.logger.warning('Orphaned GIDs: {0}, removed from pollers...'.format(list(orphans)))
+            self.remove_from_poller_bulk(list(orphans))
+
+        return orphans
+
     def flush_updates(self, gid):
         """ flushes any updates stuck in the update queue """
         destinations = self.get_destinations(gid)
@@ -548,6 +611,26 @@ class Data(DataBase):
     def get_limits(self, gid):
         return self.rc.hget(S1.gid_key(gid), S1.LIMITS_KEY)
 
+    def get_source_limits_bulk(self, gids):
+        """
+        plans are set on accounts, a source gid goes by its own plan and the plans of the accounts it is linked to
+        @return: list of plan tags of each of the gids, own plan tag first, None for free plan
+        """
+        pipe = self.rc.pipeline(transaction=False)
+        for gid in gids:
+            pipe.hget(S1.gid_key(gid), S1.LIMITS_KEY)
+            pipe.hget(S1.destination_key_fmt('parents'), gid)
+        values = pipe.execute()
+        own = values[0::2]
+        parents = [p.split(',') if p else [] for p in values[1::2]]
+        if not any(parents):
+            return [[tag] for tag in own]
+
+        for parent in (parent for p in parents for parent in p):
+            pipe.hget(S1.gid_key(parent), S1.LIMITS_KEY)
+        parent_tags = iter(pipe.execute())
+        return [[tag] + [next(parent_tags) for _ in p] for tag, p in zip(own, parents)]
+
     def set_limits(self, gid, limit_tag):
         if limit_tag:
             self.rc.hset(S1.gid_key(gid), S1.LIMITS_KEY, limit_tag)
@@ -33,6 +33,24 @@ class Pubsub(object):
         self.logger.debug('DTA NOW --> {0} <-- [{1}]'.format(channel, data))
         self.rc.lpush(channel, data)
 
+    def broadcast_data_list(self, channel, data_list):
+        """ send a list of data items via single Redis list push """
+        if not data_list:
+            return
+        self.logger.debug('DTA --> {0} <-- [{1}] items'.format(channel, len(data_list)))
+        self.rc.rpush(channel, *data_list)
+
+    def pop_data_list(self, channel, count):
+        """ pops up to count data items from the channel in one round trip """
+        pipe = self.rc.pipeline()
+        pipe.lrange(channel, 0, count - 1)
+        pipe.ltrim(channel, count, -1)
+        return pipe.execute()[0]
+
+    def channel_len(self, channel):
+        """ number of items waiting in the channel """
+        return self.rc.llen(channel)
+
     def broadcast_command(self, channel, message, *args):
         """ send a command via Redis list push """
         msg = Pubsub._format_message(message, args)
@@ -69,27 +87,32 @@ class Pubsub(object):
                     self.on_timeout()
                     continue
 
-                # else try callback option
-                if item[1].startswith(Pubsub.MESSAGE_PREFIX):
-
-                    params = item[1][Pubsub.MESSAGE_PREFIX_LEN:].split('/')
-                    cb = params.pop(0)
-                    if callback and cb in callback:
-                        # normal callback
-                        callback[cb](item[0], *params)
-                    elif cb == Pubsub.EXIT_MESSAGE:
-                        self.logger.warning('Exit message received!')
-                        # exit message detected
-                        self.on_exit(item[0])
-                else:
-                    # raw data processor callback
-                    self.on_raw(item[0], item[1])
+                self.dispatch(item[0], item[1], callback)
 
             except Exception as e:
                 self.logger.error('Exception in listener {0}, {1}'.format(e, traceback.format_exc()))
 
         self.logger.info('Listener exit')
 
+    def dispatch(self, channel, raw, callback):
+        """
+        routes a message received from the channel to its callback
+        callback: dict where key is a callback name, and value is a callback func
+        """
+        if raw.startswith(Pubsub.MESSAGE_PREFIX):
+            params = raw[Pubsub.MESSAGE_PREFIX_LEN:].split('/')
+            cb = params.pop(0)
+            if callback and cb in callback:
+                # normal callback
+                callback[cb](channel, *params)
+            elif cb == Pubsub.EXIT_MESSAGE:
+                self.logger.warning('Exit message received!')
+                # exit message detected
+                self.on_exit(channel)
+        else:
+            # raw data processor callback
+            self.on_raw(channel, raw)
+
     def terminate(self):
         self.is_running = False
 
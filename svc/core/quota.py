@@ -0,0 +1,140 @@
+import time
+from logging import Logger
+
+from redis import Redis
+
+from core.schema import S1
+from utils import config
+
+
+class Quota(object):
+    """
+    Upstream API call budget shared by all processes through Redis.
+    Each API and credential pair has a token bucket limiting calls per second and a daily call counter.
+    """
+    # api --> calls per second, burst size, calls per day (0 for no daily limit),
+    # seconds past UTC midnight the daily budget resets at
+    LIMITS = {
+        'plus': {'rate': config.DEFAULT_PLUS_QUOTA_RATE, 'burst': config.DEFAULT_PLUS_QUOTA_BURST,
+                 'daily': config.DEFAULT_PLUS_QUOTA_DAILY, 'reset_s': config.DEFAULT_QUOTA_RESET_S},
+        'picasa': {'rate': config.DEFAULT_PICASA_QUOTA_RATE, 'burst': config.DEFAULT_PICASA_QUOTA_BURST,
+                   'daily': 0, 'reset_s': config.DEFAULT_QUOTA_RESET_S},
+    }
+    # poll intervals are stretched once daily usage runs ahead of this share of the pro-rata budget
+    PACE_LOW_WATER = 0.8
+    MAX_STRETCH = 8.0
+
+    # KEYS: bucket key, daily counter key, quota set; ARGV: now, rate, burst, daily limit, cost, quota set member
+    # returns allowed flag, tokens left, calls today
+    TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local daily = tonumber(ARGV[4])
+local cost = tonumber(ARGV[5])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or burst
+local at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local used = tonumber(redis.call('GET', KEYS[2]) or '0')
+local allowed = 0
+if tokens >= cost and (daily <= 0 or used + cost <= daily) then
+    tokens = tokens - cost
+    used = redis.call('INCRBY', KEYS[2], cost)
+    redis.call('EXPIRE', KEYS[2], 172800)
+    allowed = 1
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'at', ARGV[1])
+redis.call('EXPIRE', KEYS[1], 3600)
+redis.call('SADD', KEYS[3], ARGV[6])
+return {allowed, tostring(tokens), used}
+"""
+
+    def __init__(self, logger, rc):
+        """
+        @type logger: Logger
+        @type rc: Redis
+        """
+        self.logger = logger
+        self.rc = rc
+        self.limits = {api: dict(limits) for api, limits in Quota.LIMITS.iteritems()}
+        self.take_script = self.rc.register_script(Quota.TAKE_SCRIPT)
+
+    def load_config(self, cfg):
+        """
+        @param cfg: dict of api --> dict of rate, burst, daily limit and reset_s overrides
+        """
+        for api, limits in cfg.iteritems():
+            self.limits.setdefault(api, dict(Quota.LIMITS['plus'])).update(limits)
+
+    @staticmethod
+    def day(at_time, reset_s=0):
+        """
+        @param reset_s: seconds past UTC midnight the daily budget resets at
+        @return: quota day number
+        """
+        return int(at_time - reset_s) / 86400
+
+    def take(self, api, credential, at_time, cost=1):
+        """
+        @return: (allowed, seconds to wait for the bucket to refill, 0 if daily budget is exhausted)
+        """
+        limits = self.limits[api]
+        allowed, tokens, used = self.take_script(keys=[S1.quota_key(api, credential),
+                                                       S1.quota_daily_key(api, credential, Quota.day(at_time, limits['reset_s'])),
+                                                       S1.quota_set()],
+                                                 args=[at_time, limits['rate'], limits['burst'], limits['daily'], cost,
+                                                       '{0}:{1}'.format(api, credential)])
+        if allowed:
+            return True, 0
+        if limits['daily'] and used + cost > limits['daily']:
+            return False, 0
+        return False, (cost - float(tokens)) / limits['rate']
+
+    def acquire(self, api, credential, timeout_s=1.0, cost=1):
+        """
+        waits up to timeout_s for the bucket to refill
+        @return: True if the call fits the budget
+        """
+        deadline = time.time() + timeout_s
+        while True:
+            at_time = time.time()
+            allowed, wait_s = self.take(api, credential, at_time, cost)
+            if allowed:
+                return True
+            if not wait_s or at_time + wait_s > deadline:
+                self.logger.warning('Quota exhausted for [{0}:{1}]'.format(api, credential))
+                return False
+            time.sleep(wait_s)
+
+    def get_reset_s(self, api):
+        return self.limits.get(api, dict()).get('reset_s', config.DEFAULT_QUOTA_RESET_S)
+
+    def get_usage(self, at_time):
+        """
+        @return: dict of 'api:credential' --> calls today, daily limit, calls per second limit
+        """
+        names = sorted(self.rc.smembers(S1.quota_set()))
+        pipe = self.rc.pipeline(transaction=False)
+        for name in names:
+            api, credential = name.split(':', 1)
+            pipe.get(S1.quota_daily_key(api, credential, Quota.day(at_time, self.get_reset_s(api))))
+        used = pipe.execute()
+
+        usage = dict()
+        for name, calls in zip(names, used):
+            limits = self.limits.get(name.split(':', 1)[0], dict())
+            usage[name] = dict(today=int(calls or 0), daily=limits.get('daily', 0), rate=limits.get('rate', 0))
+        return usage
+
+    def get_stretch(self, api, at_time):
+        """
+        @return: poll interval factor, > 1.0 when the api daily usage runs ahead of its pro-rata budget
+        """
+        usage = [u for name, u in self.get_usage(at_time).iteritems() if name.split(':', 1)[0] == api and u['daily']]
+        if not usage:
+            return 1.0
+        # early in the day pace is judged against the first hour
+        day_share = max((at_time - self.get_reset_s(api)) % 86400, 3600) / 86400.0
+        pace = sum(u['today'] for u in usage) / (sum(u['daily'] for u in usage) * day_share)
+        return min(Quota.MAX_STRETCH, max(1.0, pace / Quota.PACE_LOW_WATER))
@@ -16,6 +16,10 @@ class S1(object):
     def gid_set(name):
         return 'poller:{0}:gid.set'.format(name)
 
+    @staticmethod
+    def gid_shard_set(shard):
+        return S1.gid_set('all.{0}'.format(shard))
+
     @staticmethod
     def gid_key(gid):
         return 'gid:{0}'.format(gid)
@@ -35,10 +39,68 @@ class S1(object):
     def poller_set():
         return 'poller:all:poller.set'
 
+    @staticmethod
+    def master_set():
+        return 'poller:all:master.set'
+
+    @staticmethod
+    def poller_priority_channel():
+        return 'poller:priority'
+
+    @staticmethod
+    def retry_key():
+        return 'poller:all:retry.hash'
+
+    @staticmethod
+    def shard_lease_key(shard):
+        return 'poller:shard.{0}:lease'.format(shard)
+
+    @staticmethod
+    def shard_fence_key(shard):
+        return 'poller:shard.{0}:fence'.format(shard)
+
+    @staticmethod
+    def shard_priority_key(shard):
+        """ gids of higher priority plans in the shard """
+        return 'poller:shard.{0}:priority.set'.format(shard)
+
+    @staticmethod
+    def queued_key():
+        return 'poller:all:queued.zset'
+
+    @staticmethod
+    def queued_count_key(channel):
+        """ number of gids waiting in the work list """
+        return '{0}:queued'.format(channel)
+
+    @staticmethod
+    def quota_set():
+        return 'quota:all'
+
+    @staticmethod
+    def quota_key(api, credential):
+        return 'quota:{0}:{1}'.format(api, credential)
+
+    @staticmethod
+    def quota_daily_key(api, credential, day):
+        return 'quota:{0}:{1}:d.{2}'.format(api, credential, day)
+
+    @staticmethod
+    def breaker_key(name, part):
+        return 'breaker:{0}:{1}'.format(name, part)
+
     @staticmethod
     def poller_key_fmt(name):
         return 'poller.info:{0}'.format(name)
 
+    @staticmethod
+    def stats_minute_key(name, minute):
+        return 'stats:{0}:m:{1}'.format(name, minute)
+
+    @staticmethod
+    def stats_hour_key(name, hour):
+        return 'stats:{0}:h:{1}'.format(name, hour)
+
     @staticmethod
     def orphaned_timeout_key():
         return 'timeout.orphan'
@@ -59,6 +121,22 @@ class S1(object):
     def cache_key(gid):
         return 'cache:plus:{0}'.format(gid)
 
+    @staticmethod
+    def cache_activity_map_key(gid):
+        return 'cache:map:{0}'.format(gid)
+
+    @staticmethod
+    def cache_item_hash_key(gid):
+        return 'cache:items:{0}'.format(gid)
+
+    @staticmethod
+    def cache_item_etag_key(gid):
+        return 'cache:etags:{0}'.format(gid)
+
+    @staticmethod
+    def cache_item_index_key(gid):
+        return 'cache:updated:{0}'.format(gid)
+
     @staticmethod
     def cache_url_key():
         return 'cache:url:all'
@@ -67,6 +145,10 @@ class S1(object):
     def cache_items_key():
         return 'items'
 
+    @staticmethod
+    def cache_meta_key():
+        return 'meta'
+
     @staticmethod
     def updated_key():
         return 'updated'
@@ -83,6 +165,14 @@ class S1(object):
     def polled_key():
         return 'polled'
 
+    @staticmethod
+    def changed_key():
+        return 'changed'
+
+    @staticmethod
+    def change_interval_key():
+        return 'change.interval'
+
     @staticmethod
     def cache_requested_key():
         return 'requested'
@@ -148,6 +238,14 @@ class S1(object):
     def poller_channel_name(name):
         return 'poller:{0}'.format(name)
 
+    @staticmethod
+    def poller_work_channel(master):
+        return 'poller:{0}:work'.format(master)
+
+    @staticmethod
+    def poller_out_channel(master):
+        return 'poller:{0}:out'.format(master)
+
     @staticmethod
     def publisher_channel_name(name):
         return 'publisher:{0}'.format(name)
@@ -177,8 +275,8 @@ class S1(object):
         return 'qry.{0}.in'.format(query)
 
     @staticmethod
-    def query_list_out(query):
-        return 'qry.{0}.out'.format(query)
+    def query_reply_key(query, ticket):
+        return 'qry.{0}.out:{1}'.format(query, ticket)
 
     @staticmethod
     def updated_hour_fmt(hour):
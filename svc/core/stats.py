@@ -0,0 +1,172 @@
+from bisect import bisect_left
+from logging import Logger
+
+from redis import Redis
+
+from core.schema import S1
+
+
+class PollerStats(object):
+    """
+    Rolling poller telemetry kept in per-minute and per-hour Redis hashes which expire on their own
+    """
+    # poll lag (actual poll time - scheduled time) histogram bucket upper bounds, seconds
+    LAG_BUCKETS = [1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600]
+    # fetch latency histogram bucket upper bounds, seconds
+    FETCH_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30]
+    # poll outcomes
+    OUTCOMES = ['ok', 'retry', 'fail', 'quota', 'empty']
+
+    MINUTE_TTL = 2 * 3600
+    HOUR_TTL = 26 * 3600
+
+    def __init__(self, logger, rc):
+        """
+        @type logger: Logger
+        @type rc: Redis
+        """
+        self.logger = logger
+        self.rc = rc
+
+    @staticmethod
+    def bucket_field(kind, buckets, value):
+        return '{0}:{1}'.format(kind, bisect_left(buckets, value))
+
+    def record(self, name, at_time, counters, gauges=None):
+        """
+        increments counters and sets gauges in current minute and hour buckets of the poller
+        @param name: poller name
+        @type counters: dict
+        @param gauges: dict of sampled values, minute buckets only, last sample wins
+        """
+        minute_key = S1.stats_minute_key(name, int(at_time) / 60)
+        hour_key = S1.stats_hour_key(name, int(at_time) / 3600)
+        pipe = self.rc.pipeline(transaction=False)
+        for field, value in counters.iteritems():
+            if value:
+                pipe.hincrby(minute_key, field, value)
+                pipe.hincrby(hour_key, field, value)
+        if gauges:
+            pipe.hmset(minute_key, gauges)
+        pipe.expire(minute_key, PollerStats.MINUTE_TTL)
+        pipe.expire(hour_key, PollerStats.HOUR_TTL)
+        pipe.execute()
+
+    def record_dispatch(self, name, at_time, count, depth, deduped=0, throttled=0):
+        """
+        @param count: number of gids dispatched
+        @param depth: sample of number of gids queued in the work list
+        @param deduped: number of claimed gids skipped as already queued
+        @param throttled: number of dispatch rounds skipped for queued gids taking up the whole budget
+        """
+        self.record(name, at_time, {'dispatched': count, 'deduped': deduped, 'throttled': throttled}, gauges={'depth': depth})
+
+    def record_polls(self, name, at_time, polls):
+        """
+        @param polls: list of (outcome, lag seconds or None, fetch seconds or None) tuples
+        """
+        counters = dict()
+        for outcome, lag_s, fetch_s in polls:
+            counters[outcome] = counters.get(outcome, 0) + 1
+            if lag_s is not None:
+                field = PollerStats.bucket_field('lag', PollerStats.LAG_BUCKETS, lag_s)
+                counters[field] = counters.get(field, 0) + 1
+            if fetch_s is not None:
+                field = PollerStats.bucket_field('fetch', PollerStats.FETCH_BUCKETS, fetch_s)
+                counters[field] = counters.get(field, 0) + 1
+        self.record(name, at_time, counters)
+
+    def get_rolling(self, names, at_time):
+        """
+        @return: dict of poller name --> (dispatched last 60 min, dispatched last 24 hours)
+        """
+        minute = int(at_time) / 60
+        hour = int(at_time) / 3600
+        pipe = self.rc.pipeline(transaction=False)
+        for name in names:
+            for m in xrange(minute - 59, minute + 1):
+                pipe.hget(S1.stats_minute_key(name, m), 'dispatched')
+            for h in xrange(hour - 23, hour + 1):
+                pipe.hget(S1.stats_hour_key(name, h), 'dispatched')
+        values = [int(v or 0) for v in pipe.execute()]
+        return {name: (sum(values[n * 84:n * 84 + 60]), sum(values[n * 84 + 60:n * 84 + 84]))
+                for n, name in enumerate(names)}
+
+    def get_telemetry(self, names, at_time, minutes=15):
+        """
+        @param names: poller names
+        @param minutes: rolling window length
+        @return: dict of telemetry for each poller and 'all' pollers
+        """
+        minute = int(at_time) / 60
+        window = range(minute - minutes + 1, minute + 1)
+        pipe = self.rc.pipeline(transaction=False)
+        for name in names:
+            for m in window:
+                pipe.hgetall(S1.stats_minute_key(name, m))
+        buckets = pipe.execute()
+
+        telemetry = dict()
+        total = dict()
+        depth_all = [0] * minutes
+        for n, name in enumerate(names):
+            counters = dict()
+            depth = []
+            for i, bucket in enumerate(buckets[n * minutes:(n + 1) * minutes]):
+                sample = int(bucket.pop('depth', 0) or 0)
+                depth.append(sample)
+                depth_all[i] += sample
+                for field, value in bucket.iteritems():
+                    counters[field] = counters.get(field, 0) + int(value)
+                    total[field] = total.get(field, 0) + int(value)
+            telemetry[name] = PollerStats.summarize(counters, depth, minutes)
+
+        telemetry['all'] = PollerStats.summarize(total, depth_all, minutes)
+        return telemetry
+
+    @staticmethod
+    def histogram(counters, kind, buckets):
+        """
+        @return: list of [bucket upper bound, count], None is the overflow bucket bound
+        """
+        bounds = buckets + [None]
+        return [[bounds[n], counters.get('{0}:{1}'.format(kind, n), 0)] for n in xrange(0, len(bounds))]
+
+    @staticmethod
+    def percentile(histogram, p):
+        """
+        @return: upper bound of the bucket the p-th percentile falls into, None if above the last bucket
+        """
+        total = sum(count for _, count in histogram)
+        if not total:
+            return 0
+        running = 0
+        for bound, count in histogram:
+            running += count
+            if running >= p * total:
+                return bound
+        return None
+
+    @staticmethod
+    def summarize(counters, depth, minutes):
+        polls = sum(counters.get(outcome, 0) for outcome in PollerStats.OUTCOMES)
+        lag = PollerStats.histogram(counters, 'lag', PollerStats.LAG_BUCKETS)
+        fetch = PollerStats.histogram(counters, 'fetch', PollerStats.FETCH_BUCKETS)
+        return dict(
+            minutes=minutes,
+            dispatched=counters.get('dispatched', 0),
+            deduped=counters.get('deduped', 0),
+            throttled=counters.get('throttled', 0),
+            polls=polls,
+            polls_per_min=polls / float(minutes),
+            rates={outcome: counters.get(outcome, 0) / float(polls) if polls else 0 for outcome in PollerStats.OUTCOMES},
+            lag=lag,
+            lag_p50=PollerStats.percentile(lag, 0.5),
+            lag_p90=PollerStats.percentile(lag, 0.9),
+            lag_p99=PollerStats.percentile(lag, 0.99),
+            fetch=fetch,
+            fetch_p50=PollerStats.percentile(fetch, 0.5),
+            fetch_p90=PollerStats.percentile(fetch, 0.9),
+            fetch_p99=PollerStats.percentile(fetch, 0.99),
+            depth=depth
+        )
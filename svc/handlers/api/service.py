@@ -1,3 +1,5 @@
+import time
+
 import tornado
 from tornado.gen import Return
 from tornado.web import HTTPError
@@ -15,6 +17,7 @@ class ServiceApiHandler(BaseApiHandler):
             raise HTTPError(401)
         # always render stats
         stats = self.data.balancer.get_poller_stats_ex()
+        stats['quota'] = self.data.quota.get_usage(time.time())
         # sync
         raise Return(stats)
 
@@ -45,14 +45,14 @@ class FeedHandler(tornado.web.RequestHandler):
 
                 # do a validation before registering
                 # validate the GID
-                self.data.begin_validate_gid(gid)
+                ticket = self.data.begin_validate_gid(gid)
                 valid_gid = None
 
                 # wait for data update from Google
-                for n in range(0, 5):
-                    # wait for up to 10 seconds
-                    yield gen.Task(IOLoop.instance().add_timeout, time.time() + 2)
-                    valid_gid = self.data.get_validate_gid(gid)
+                for n in range(0, 20):
+                    # wait for up to 10 seconds, reply check does not block the IOLoop
+                    yield gen.Task(IOLoop.instance().add_timeout, time.time() + 0.5)
+                    valid_gid = self.data.get_validate_gid(ticket)
                     if valid_gid:
                         break
 
@@ -88,5 +88,5 @@ class FeedHandler(tornado.web.RequestHandler):
             raise tornado.web.HTTPError(400, reason='No data available for {0}'.format(gid))
 
     def process_activities(self, gid, option, activities_doc):
-        items = GoogleRSS.gen_items(activities_doc, option, self.data.cache)
+        items = GoogleRSS.gen_items(activities_doc['items'], option, self.data.cache)
         self.render('feed.xml', version=config.version, gid=gid, pubDate=GoogleRSS.format_timestamp_rss(time.time()), items=items)
@@ -1,6 +1,6 @@
 import os
 import socket
-import time
+import tempfile
 import traceback
 from httplib import BadStatusLine
 
@@ -10,25 +10,38 @@ from googleapiclient import discovery, errors
 from oauth2client.file import Storage
 from oauth2client.service_account import ServiceAccountCredentials
 
+from core.quota import Quota
+from providers.google_rss import GoogleRSS
+
 
 class GoogleFetchRetry(Exception):
     pass
 
 
+class GoogleFetchQuota(GoogleFetchRetry):
+    """ our own API budget is exhausted, Google was not called """
+    pass
+
+
 class GoogleFetch(object):
-    def __init__(self, logger, config_path):
+    # get_activities() result when the document did not change since the etag passed in
+    NOT_MODIFIED = 'not-modified'
+    # API discovery document cached in config path
+    DISCOVERY_DOC = 'plus.discovery.json'
+
+    def __init__(self, logger, config_path, quota=None):
+        """
+        @type quota: Quota
+        """
         self.logger = logger
         self.config_path = config_path
+        self.quota = quota
         self.service = None
         self.http = None
-        self.auth_time = time.time()
+        # token refresh requests go through own connection
+        self.refresh_http = httplib2.Http()
 
-        # Authenticate and construct service.
-        # Prepare credentials, and authorize HTTP object with them.
-        try:
-            os.unlink(os.path.join(config_path, 'plus.dat'))
-        except:
-            pass
+        # Prepare credentials, access token is kept in plus.dat between restarts
         storage = Storage(os.path.join(config_path, 'plus.dat'))
 
         self.logger.warning('GoogleFetch: Initializing credentials')
@@ -37,16 +50,56 @@ class GoogleFetch(object):
             scopes='https://www.googleapis.com/auth/plus.me')
 
         self.credentials.set_store(storage)
+        # API calls are budgeted per service account
+        self.credential = self.credentials.service_account_email
+
+    def get_discovery_doc(self):
+        """
+        @return: plus v1 discovery document from config path, downloaded and cached on first use
+        """
+        path = os.path.join(self.config_path, GoogleFetch.DISCOVERY_DOC)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except IOError:
+            pass
+
+        self.logger.warning('GoogleFetch: Downloading discovery document')
+        response, content = self.refresh_http.request(discovery.DISCOVERY_URI.format(api='plus', apiVersion='v1'))
+        if response.status != 200:
+            raise errors.HttpError(response, content)
+
+        # other workers may be writing the same document
+        fd, tmp_path = tempfile.mkstemp(dir=self.config_path)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.rename(tmp_path, path)
+        return content
 
     def authorize(self):
-        if self.service is None or time.time() - self.auth_time > 300:
+        """
+        Constructs the service once, authorized HTTP keeps connections alive and refreshes
+        expired access token on its own, expiry is also checked ahead of each request
+        """
+        if self.service is None:
             self.logger.info('Authorizing credentials')
             self.http = self.credentials.authorize(http=httplib2.Http())
-            # Construct a service object via the discovery service.
-            self.service = discovery.build('plus', 'v1', http=self.http)
-            self.auth_time = time.time()
+            # Construct a service object from the discovery document.
+            self.service = discovery.build_from_document(self.get_discovery_doc(), http=self.http)
+
+        if self.credentials.access_token_expired:
+            self.logger.info('Refreshing access token')
+            self.credentials.refresh(self.refresh_http)
+
+    def check_quota(self):
+        """
+        waits for the plus API budget, retry is requested when the budget is exhausted
+        """
+        if self.quota and not self.quota.acquire('plus', self.credential):
+            raise GoogleFetchQuota()
 
     def get_plus_user_info(self, user_name):
+        self.check_quota()
         try:
             if self.credentials is None or self.credentials.invalid:
                 raise tornado.web.HTTPError(403, 'Invalid Credentials')
@@ -74,18 +127,31 @@ class GoogleFetch(object):
 
         return person_doc
 
-    def get_activities(self, user_id, max_results):
+    def get_activities(self, user_id, max_results, etag=None):
+        """
+        @param etag: etag of the last received document, makes the request conditional
+        @return: activities document, NOT_MODIFIED if the document etag matches, None on error
+        """
+        self.check_quota()
         try:
             if self.credentials is None or self.credentials.invalid:
                 raise tornado.web.HTTPError(403, 'Invalid Credentials')
             self.authorize()
 
             # query data from google
-            request = self.service.activities().list(userId=user_id, collection='public', maxResults=max_results)
+            request = self.service.activities().list(userId=user_id, collection='public', maxResults=max_results,
+                                                     fields=GoogleRSS.fields_projection())
+            if etag:
+                request.headers['If-None-Match'] = etag
             activities_doc = request.execute()
 
         except errors.HttpError as e:
+            if e.resp.status == 304:
+                return GoogleFetch.NOT_MODIFIED
             self.logger.warning('HttpError: {0}'.format(e.resp))
+            # Google side failure, counts against the circuit breaker
+            if e.resp.status >= 500:
+                raise GoogleFetchRetry()
             return None
 
         except BadStatusLine as e:
@@ -5,8 +5,9 @@ from logging import Logger
 from core import Data
 from core.schema import S1
 from providers.bitly_short import BitlyShorten
-from providers.google_fetch import GoogleFetch, GoogleFetchRetry
+from providers.google_fetch import GoogleFetch, GoogleFetchQuota, GoogleFetchRetry
 from providers.google_rss import GoogleRSS
+from utils import config
 
 
 class GooglePollAgent(object):
@@ -17,8 +18,11 @@ class GooglePollAgent(object):
         """
         self.logger = logger
         self.data = data
-        self.google_fetch = GoogleFetch(logger, config_path)
+        self.google_fetch = GoogleFetch(logger, config_path, quota=data.quota)
         self.shortener = BitlyShorten(logger, config_path)
+        # outcome ('ok', 'retry' or 'fail') and fetch latency of the last poll() for telemetry
+        self.last_outcome = None
+        self.last_fetch_s = None
 
     def validate_user_name(self, user_name):
         # retry 1 time
@@ -53,21 +57,35 @@ class GooglePollAgent(object):
         @rtype : bool
         @return : True on success, False on system error
         """
+        self.last_outcome = 'fail'
+        self.last_fetch_s = None
         try:
             self.logger.info('Poll request for {0}...'.format(gid))
 
             # fetch data
             activities_doc = self.fetch(gid)
-            if activities_doc:
+            if activities_doc == GoogleFetch.NOT_MODIFIED:
+                self.logger.debug('Not modified {0}'.format(gid))
+                # polled all the same, as an unchanged document in process_activities_doc()
+                self.data.cache.set_poll_stamp(gid, time.time())
+                self.last_outcome = 'ok'
+            elif activities_doc:
                 # process the dataset
                 self.process_activities_doc(gid, activities_doc, False)
+                self.last_outcome = 'ok'
             else:
                 self.logger.warning('Nothing to process for {0}'.format(gid))
+                self.last_outcome = 'empty'
 
             return True
 
+        except GoogleFetchQuota:
+            self.logger.warning('Quota exhausted for {0}'.format(gid))
+            self.last_outcome = 'quota'
+
         except GoogleFetchRetry:
             self.logger.warning('RetryError for {0}'.format(gid))
+            self.last_outcome = 'retry'
 
         except Exception as e:
             msg = 'Exception while fetching data for {0}, [{1}], {2}'
@@ -77,8 +95,20 @@ class GooglePollAgent(object):
 
     def fetch(self, gid):
         #fetch activities from google
-        max_results = self.data.cache.get_gid_max_results(gid)
-        activities_doc = self.google_fetch.get_activities(gid, max_results)
+        max_results = int(self.data.cache.get_gid_max_results(gid))
+        # conditional fetch unless poll stamp was reset, the document must be processed then
+        etag = self.data.get_destination_param(gid, 'cache', gid, S1.etag_key()) if self.data.cache.get_poll_stamp(gid) else None
+        started = time.time()
+        try:
+            activities_doc = self.google_fetch.get_activities(gid, max_results, etag)
+            # all fetched items are new, grow the page and refetch to catch up with the burst
+            while activities_doc and activities_doc != GoogleFetch.NOT_MODIFIED and self.is_overflow(gid, activities_doc, max_results):
+                max_results = min(config.DEFAULT_MAX_RESULTS_MAX, max_results * 2)
+                self.logger.info('Burst for [{0}], max_results [{1}]'.format(gid, max_results))
+                self.data.cache.set_gid_max_results(gid, max_results)
+                activities_doc = self.google_fetch.get_activities(gid, max_results)
+        finally:
+            self.last_fetch_s = time.time() - started
         # validate received data
         if not activities_doc:
             self.logger.warning('Nothing received for [{0}]'.format(gid))
@@ -86,6 +116,27 @@ class GooglePollAgent(object):
 
         return activities_doc
 
+    def is_overflow(self, gid, activities_doc, max_results):
+        """
+        @return: True if the page is full of items updated since the last poll, older updates may be missed
+        """
+        items = activities_doc.get('items', [])
+        if max_results >= config.DEFAULT_MAX_RESULTS_MAX or len(items) < max_results:
+            return False
+        last_updated = self.data.get_destination_update(gid, 'cache', gid)
+        return last_updated and len(GoogleRSS.get_updated_since(activities_doc, last_updated)) == len(items)
+
+    def fit_max_results(self, gid, num_new):
+        """
+        shrinks max results towards the recent posting rate, bursts are handled in fetch()
+        @param num_new: number of items updated since the last poll
+        """
+        max_results = int(self.data.cache.get_gid_max_results(gid))
+        target = min(config.DEFAULT_MAX_RESULTS_MAX, max(config.DEFAULT_MAX_RESULTS_MIN, 2 * num_new + 2))
+        fit = max(target, int(max_results * 0.75)) if target < max_results else target
+        if fit != max_results:
+            self.data.cache.set_gid_max_results(gid, fit)
+
     def process_activities_doc(self, gid, activities_doc, force=False):
         # validate received data
         updated = GoogleRSS.get_update_timestamp(activities_doc)
@@ -113,11 +164,12 @@ class GooglePollAgent(object):
             self.logger.debug('Same data for {0}, last_updated={1}'.format(gid, last_updated))
             return
 
-        # save etag
+        # save etag, page etag changes with max results as well, items tell if the data changed
         self.data.set_destination_param(gid, 'cache', gid, S1.etag_key(), etag)
 
-        # set cache destination updated
-        self.data.set_destination_update(gid, 'cache', gid, updated)
+        # derive timestamps, types, urls and etc. once for all readers
+        for item in activities_doc.get('items', []):
+            GoogleRSS.normalize(item)
 
         # shorten reshares urls
         items = GoogleRSS.get_updated_since(activities_doc, last_updated)
@@ -129,8 +181,20 @@ class GooglePollAgent(object):
                 u = self.shortener.get_short_url(url)
                 self.data.cache.cache_short_url(url, u)
 
-        # store the dataset
-        self.data.cache.cache_activities_doc(gid, activities_doc)
+        # adapt next fetch size to the posting rate, older items stay in cache
+        if last_updated:
+            self.fit_max_results(gid, len(items))
+
+        # store new and changed items
+        if not self.data.cache.cache_activities_doc(gid, activities_doc) and not force:
+            self.logger.debug('No changed items for {0}, last_updated={1}'.format(gid, last_updated))
+            return
+
+        # data change history drives poll scheduling
+        self.data.cache.set_changed(gid, time.time())
+
+        # set cache destination updated
+        self.data.set_destination_update(gid, 'cache', gid, updated)
 
         # notify publishers
         self.data.flush_updates(gid)
@@ -139,9 +203,8 @@ class GooglePollAgent(object):
         # new user ?
         if not last_updated:
             self.logger.warning('Building new user activity map for {0}'.format(gid))
-            self._build_user_activity_map(gid, activities_doc)
             # fake an update now as user is likely online when this code is executed
-            self.data.cache.incr_num_minute_updates(gid, time.time())
+            self._build_user_activity_map(gid, activities_doc, extra_stamps=[time.time()])
         elif last_updated < updated:
             # increment update count for this minute
             self.logger.debug('Updating user activity map for {0}, data updated={1}'.format(gid, updated))
@@ -149,12 +212,13 @@ class GooglePollAgent(object):
         else:
             self.logger.debug('No activity map updates for {0}, data updated={1}'.format(gid, updated))
 
-    def _build_user_activity_map(self, gid, activities_doc, last_updated=0):
+    def _build_user_activity_map(self, gid, activities_doc, last_updated=0, extra_stamps=None):
         """
         Creates user daily activity map from activities doc
         @type activities_doc: dict
         """
-        for item in activities_doc.get('items', []):
-            updated = GoogleRSS.get_item_updated_stamp(item)
-            if updated > last_updated:
-                self.data.cache.incr_num_minute_updates(gid, updated)
\ No newline at end of file
+        stamps = [updated for updated in (GoogleRSS.get_item_updated_stamp(item) for item in activities_doc.get('items', []))
+                  if updated > last_updated]
+        if extra_stamps:
+            stamps.extend(extra_stamps)
+        self.data.cache.incr_num_minute_updates_bulk(gid, stamps)
@@ -7,7 +7,122 @@ from types import UnicodeType
 from dateutil.parser import parse
 
 
+class Activity(dict):
+    """
+    Activity item read from cache, fields derived by GoogleRSS.normalize() at poll time are exposed as properties
+    """
+    __slots__ = ()
+
+    @property
+    def item_id(self):
+        return self['id']
+
+    @property
+    def updated(self):
+        return GoogleRSS.get_item_updated_stamp(self)
+
+    @property
+    def published(self):
+        return GoogleRSS.get_item_published_stamp(self)
+
+    @property
+    def object_type(self):
+        return GoogleRSS.get_object_type(self)
+
+    @property
+    def long_urls(self):
+        return GoogleRSS.get_long_urls(self)
+
+    @property
+    def tags(self):
+        return GoogleRSS.get_tags(self)
+
+    @property
+    def full_image_url(self):
+        return GoogleRSS.get_full_image_url(self)
+
+
 class GoogleRSS(object):
+    # activity feed fields read by the accessors below, keep in sync when accessing a new field
+    # (name, sub-fields) pairs are requested as partial response, see fields_projection()
+    ACTIVITY_FIELDS = [
+        'etag',
+        'updated',
+        ('items', [
+            'id', 'etag', 'url', 'title', 'verb', 'updated', 'published', 'annotation', 'location',
+            ('access', ['description']),
+            ('actor', ['displayName']),
+            ('provider', ['title']),
+            ('object', [
+                'content', 'url',
+                ('actor', ['displayName']),
+                ('replies', ['totalItems']),
+                ('plusoners', ['totalItems']),
+                ('resharers', ['totalItems']),
+                ('attachments', [
+                    'id', 'objectType', 'url', 'displayName',
+                    ('embed', ['url']),
+                    ('image', ['url']),
+                    ('fullImage', ['url', 'width', 'height']),
+                    ('thumbnails', [('image', ['url'])]),
+                ]),
+            ]),
+        ]),
+    ]
+
+    @staticmethod
+    def fields_projection(fields=None):
+        """
+        @return: Google API partial response 'fields' parameter for the field list, ACTIVITY_FIELDS by default
+        """
+        return ','.join(f if isinstance(f, basestring) else '{0}({1})'.format(f[0], GoogleRSS.fields_projection(f[1]))
+                        for f in (GoogleRSS.ACTIVITY_FIELDS if fields is None else fields))
+
+    # item key of the fields derived by normalize()
+    NORMALIZED = '_n'
+    NOT_NORMALIZED = object()
+
+    @staticmethod
+    def normalize(item):
+        """
+        derives timestamps, object type, urls, tags and image ids of the item once, stored with the item in cache
+        description setters drop the fields derived from description
+        @return: item
+        """
+        item.pop(GoogleRSS.NORMALIZED, None)
+        derive = {
+            'updated': GoogleRSS.get_item_updated_stamp,
+            'published': GoogleRSS.get_item_published_stamp,
+            'type': GoogleRSS.get_object_type,
+            'urls': GoogleRSS.get_long_urls,
+            'full_image': GoogleRSS.get_full_image_url,
+            'description': GoogleRSS.get_description_raw,
+            'tags': GoogleRSS.get_tags,
+        }
+        normalized = dict()
+        for field, accessor in derive.iteritems():
+            # malformed item, the accessor will fail at read time as before
+            try:
+                normalized[field] = accessor(item)
+            except Exception:
+                pass
+        if normalized.get('type') in ['photo', 'album']:
+            try:
+                image_ids = dict()
+                GoogleRSS.populate_image_ids(item, image_ids)
+                normalized['image'] = image_ids
+            except Exception:
+                pass
+        item[GoogleRSS.NORMALIZED] = normalized
+        return item
+
+    @staticmethod
+    def _normalized(item, field):
+        """
+        @return: normalized field of the item, NOT_NORMALIZED if not available
+        """
+        normalized = item.get(GoogleRSS.NORMALIZED)
+        return normalized.get(field, GoogleRSS.NOT_NORMALIZED) if normalized else GoogleRSS.NOT_NORMALIZED
 
     @staticmethod
     def result(item, kind, url, title, full_image=''):
@@ -20,7 +135,7 @@ class GoogleRSS(object):
             'fullImage': full_image,
             'embed': GoogleRSS.get_item_embed_url(item),
             'guid': item['id'],
-            'pubDate': GoogleRSS.format_timestamp_rss(GoogleRSS.get_timestamp(item['updated'])),
+            'pubDate': GoogleRSS.format_timestamp_rss(GoogleRSS.get_item_updated_stamp(item)),
             'likes': GoogleRSS.get_likes(item),
             'location': GoogleRSS.get_location(item)
         }
@@ -35,6 +150,9 @@ class GoogleRSS(object):
 
     @staticmethod
     def get_object_type(item):
+        object_type = GoogleRSS._normalized(item, 'type')
+        if object_type is not GoogleRSS.NOT_NORMALIZED:
+            return object_type
         try:
             if 'attachments' in item['object']:
                 if 'objectType' in item['object']['attachments'][0]:
@@ -92,9 +210,20 @@ class GoogleRSS(object):
     @staticmethod
     def set_description_raw(item, description):
         item['object']['content'] = description
+        GoogleRSS._drop_text_fields(item)
+
+    @staticmethod
+    def _drop_text_fields(item):
+        normalized = item.get(GoogleRSS.NORMALIZED)
+        if normalized:
+            normalized.pop('description', None)
+            normalized.pop('tags', None)
 
     @staticmethod
     def get_description_raw(item):
+        description = GoogleRSS._normalized(item, 'description')
+        if description is not GoogleRSS.NOT_NORMALIZED:
+            return description
         # strip invalid chars from description (Google bug?)
         if 'content' in item['object'] and item['object']['content']:
             return re.sub(ur'[\u0000-\u0009\ufeff-\uffff]', u'', item['object']['content'])
@@ -103,6 +232,7 @@ class GoogleRSS(object):
     @staticmethod
     def set_annotation_raw(item, annotation):
         item['annotation'] = annotation
+        GoogleRSS._drop_text_fields(item)
 
     @staticmethod
     def get_annotation_raw(item):
@@ -156,6 +286,9 @@ class GoogleRSS(object):
 
     @staticmethod
     def get_tags(item):
+        tags = GoogleRSS._normalized(item, 'tags')
+        if tags is not GoogleRSS.NOT_NORMALIZED:
+            return tags
         description = GoogleRSS.get_description_raw(item)
         annotation = GoogleRSS.get_annotation_raw(item)
         return re.findall(ur'#(\w+)', ' '.join((description, annotation)), re.UNICODE)
@@ -167,6 +300,9 @@ class GoogleRSS(object):
 
     @staticmethod
     def get_full_image_url(item):
+        full_image = GoogleRSS._normalized(item, 'full_image')
+        if full_image is not GoogleRSS.NOT_NORMALIZED:
+            return full_image
         if not 'attachments' in item['object']:
             return None
 
@@ -200,6 +336,10 @@ class GoogleRSS(object):
 
     @staticmethod
     def populate_image_ids(item, result):
+        image_ids = GoogleRSS._normalized(item, 'image')
+        if image_ids is not GoogleRSS.NOT_NORMALIZED:
+            result.update(image_ids)
+            return
         result['id'] = item['object']['attachments'][0]['id']
         re_album = re.compile('.*/photos/(?P<user_id>\d+)/albums/(?P<album_id>\d+)(/(?P<photo_id>\d+))?')
         m = re_album.match(item['object']['attachments'][0]['url'])
@@ -241,7 +381,7 @@ class GoogleRSS(object):
         return GoogleRSS.result(item, 'album', url, title, full_image=full_image)
 
     @staticmethod
-    def gen_items(activities_doc, option, cache):
+    def gen_items(items, option, cache):
         optionmap = {
             'text': ['text'],
             'photo': ['photo'],
@@ -249,7 +389,7 @@ class GoogleRSS(object):
             'links-': ['link', 'album'],
             'text-': ['text']
         }
-        for item in activities_doc['items']:
+        for item in items:
             result = GoogleRSS.process_item(item)
             # shorten urls reshares, urls must be cached locally already, see google_poll.py
             if GoogleRSS.get_item_is_share(item):
@@ -299,6 +439,9 @@ class GoogleRSS(object):
 
     @staticmethod
     def get_item_updated_stamp(item):
+        updated = GoogleRSS._normalized(item, 'updated')
+        if updated is not GoogleRSS.NOT_NORMALIZED:
+            return updated
         if 'updated' in item:
             return GoogleRSS.get_timestamp(item['updated'])
         return 0
@@ -311,6 +454,9 @@ class GoogleRSS(object):
 
     @staticmethod
     def get_item_published_stamp(item):
+        published = GoogleRSS._normalized(item, 'published')
+        if published is not GoogleRSS.NOT_NORMALIZED:
+            return published
         if 'published' in item:
             return GoogleRSS.get_timestamp(item['published'])
         return ''
@@ -337,13 +483,41 @@ class GoogleRSS(object):
 
     @staticmethod
     def get_updated_since(activities_doc, timestamp):
-        items = [item for item in activities_doc.get('items', []) if 'updated' in item and GoogleRSS.get_timestamp(item['updated']) > timestamp]
-        # sort by updated
-        items.sort(key=lambda item: GoogleRSS.get_timestamp(item['published']))
+        items = [item for item in activities_doc.get('items', []) if 'updated' in item and GoogleRSS.get_item_updated_stamp(item) > timestamp]
+        # sort by published
+        items.sort(key=GoogleRSS.get_item_published_stamp)
         return items
 
+    # RFC 3339 UTC layout of Google API timestamps, e.g. 2016-03-01T10:00:00.000Z
+    RE_TIMESTAMP = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d*)?Z$')
+    EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+    # parsed timestamps memo, cleared when full
+    TIMESTAMP_MEMO_SIZE = 4096
+    timestamp_memo = dict()
+
     @staticmethod
     def get_timestamp(iso_str):
+        """
+        @return: epoch seconds, fractions are dropped
+        """
+        stamp = GoogleRSS.timestamp_memo.get(iso_str)
+        if stamp is not None:
+            return stamp
+
+        m = GoogleRSS.RE_TIMESTAMP.match(iso_str)
+        if m:
+            year, month, day, hour, minute, second = (int(g) for g in m.groups()[:6])
+            stamp = (datetime.date(year, month, day).toordinal() - GoogleRSS.EPOCH_ORDINAL) * 86400 + hour * 3600 + minute * 60 + second
+        else:
+            stamp = GoogleRSS.get_timestamp_slow(iso_str)
+
+        if len(GoogleRSS.timestamp_memo) >= GoogleRSS.TIMESTAMP_MEMO_SIZE:
+            GoogleRSS.timestamp_memo.clear()
+        GoogleRSS.timestamp_memo[iso_str] = stamp
+        return stamp
+
+    @staticmethod
+    def get_timestamp_slow(iso_str):
         return calendar.timegm(parse(iso_str).timetuple())
 
     @staticmethod
@@ -370,6 +544,9 @@ class GoogleRSS(object):
 
     @staticmethod
     def get_long_urls(item):
+        urls = GoogleRSS._normalized(item, 'urls')
+        if urls is not GoogleRSS.NOT_NORMALIZED:
+            return urls
         return [GoogleRSS.get_unicode_string(item['url']), GoogleRSS.get_unicode_string(item['object']['url'])]
 
     @staticmethod
@@ -11,21 +11,28 @@ from googleapiclient import errors
 from oauth2client.file import Storage
 from oauth2client.service_account import ServiceAccountCredentials
 
+from core.quota import Quota
 from providers.google_fetch import GoogleFetchRetry
 from providers.google_rss import GoogleRSS
 
 
 class Picasa(object):
-    def __init__(self, logger, config_path):
+    def __init__(self, logger, config_path, quota=None):
         """
 
         @type logger: Logger
+        @type quota: Quota
         """
         self.logger = logger
         self.config_path = config_path
+        self.quota = quota
         self.service = None
         self.http = None
         self.auth_time = time.time()
+        # bare keep-alive connections reused across album requests, redirector links are not followed
+        self.album_http = httplib2.Http()
+        self.redirect_http = httplib2.Http()
+        self.redirect_http.follow_redirects = False
 
         # Authenticate and construct service.
         # Prepare credentials, and authorize HTTP object with them.
@@ -74,10 +81,8 @@ class Picasa(object):
             # check if it is redirector
             if 'redirector.googlevideo.com' in max_media['url']:
                 self.logger.info('Expanding google redirector link')
-                http = httplib2.Http()
                 try:
-                    http.follow_redirects = False
-                    response, content = http.request(max_media['url'])
+                    response, content = self.redirect_http.request(max_media['url'])
                     self.logger.debug('Response: {0}'.format(response))
                     if response['status'] == '302':
                         max_media['url'] = response['location']
@@ -119,12 +124,15 @@ class Picasa(object):
         return album
 
     def get_album(self, user_id, album_id):
+        # album requests are not authorized, budget is shared by all publishers
+        if self.quota and not self.quota.acquire('picasa', 'bare'):
+            return None
         try:
             # if self.credentials is None or self.credentials.invalid:
             #    raise tornado.web.HTTPError(403, 'Invalid Credentials')
             # self.authorize()
             # authorisation is not working, trying bare
-            http = httplib2.Http()
+            http = self.album_http
 
             # query data from picasa
             query = 'https://picasaweb.google.com/data/feed/api/user/{user_id}/albumid/{album_id}?alt=json'
@@ -46,7 +46,7 @@ class PublisherBase(PublisherInterface):
         self.data = data
 
         # picasa data puller
-        self.picasa = picasa or Picasa(log, config_path)
+        self.picasa = picasa or Picasa(log, config_path, quota=data.quota)
         # used to retrieve full-size image url from picasas data
         self.re_img = re.compile('(/[^/]+\.jpg)$')
 
@@ -90,23 +90,21 @@ class PublisherBase(PublisherInterface):
 
     def publish(self, gid):
 
-        # 1. extract activities from cache
-        activities_doc = self.data.cache.get_activities(gid)
-        if not activities_doc:
+        # 1. extract activities document meta-data and items updated in last 72 hours from cache
+        review_depth = int(time.time()) - 72 * 3600
+        activities_meta, items = self.data.cache.get_activities_since(gid, review_depth)
+        if not activities_meta:
             self.log.warning('Warning: No activities for Google Plus user [{0}]'.format(gid))
             return
 
         # 2. get gid update timestamp
-        updated = GoogleRSS.get_update_timestamp(activities_doc)
+        updated = GoogleRSS.get_update_timestamp(activities_meta)
         if not updated:
             self.log.warning('Warning: Noting to publish, no updates in feed for Google Plus user [{0}]'.format(gid))
-            self.log.debug(json.dumps(activities_doc))
+            self.log.debug(json.dumps(activities_meta))
             return
 
-        # 3. see if have any new items, that has been updated in last 72 hours
-        review_depth = int(time.time()) - 72 * 3600
-        items = GoogleRSS.get_updated_since(activities_doc, review_depth)
-
+        # 3. see if have any new items
         if not items:
             self.log.warning('Noting to publish, no items in feed for {0}->{1}'.format(gid, self.name))
             return
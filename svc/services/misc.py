@@ -59,7 +59,8 @@ class MiscWorker(ServiceBase):
         callback = {
             'mail.send': self._on_email,
         }
-        self.listener([S1.MAILER_CHANNEL_NAME], callback)
+        # own channel goes first for the exit message
+        self.listener([S1.poller_channel_name(self.name), S1.MAILER_CHANNEL_NAME], callback)
 
     def _on_email(self, channel, gid, template, args_json=None):
         try:
@@ -82,6 +83,8 @@ class MiscService(ServiceBase):
         super(MiscService, self).__init__(logger, name, data, providers, config_path)
 
         self.kwargs = None
+        # worker pool scaling period
+        self.period_s = 10
 
         self.channel_handler = {
             MiscService.MISC_SERVICE_CHANNEL: self.on_my_name
@@ -117,13 +120,15 @@ class MiscService(ServiceBase):
         pass
 
     def on_timeout(self):
-        pass
+        self.autoscale(time.time(), self.channel_len(S1.MAILER_CHANNEL_NAME))
 
     def run(self, *args, **kwargs):
         self.kwargs = kwargs
         cfg = config.load_config(kwargs['config_path'], 'misc.json')
         self.workers_min = cfg['workers_min'] if 'workers_min' in cfg else self.workers_min
         self.workers_max = cfg['workers_max'] if 'workers_max' in cfg else self.workers_max
+        self.period_s = cfg['period_s'] if 'period_s' in cfg else self.period_s
+        self.scaler.load_config(cfg)
 
         self.logger.info('Misc Service v[{0}], name=[{1}], starting...'.format(config.version, self.name))
 
@@ -135,10 +140,11 @@ class MiscService(ServiceBase):
             self.start_worker()
 
         # start listening
-        self.listener([MiscService.MISC_SERVICE_CHANNEL], None)
+        self.listener([MiscService.MISC_SERVICE_CHANNEL], None, timeout=self.period_s)
         self.logger.warning('Misc Service listener exit!')
 
         # force kill any remaining workers
+        self.workers.update(self.retiring)
         while self.workers:
             p = self.workers.popitem()
             self.logger.warning('Terminating remaining worker {0}!'.format(p[0]))
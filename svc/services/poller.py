@@ -1,8 +1,11 @@
 from multiprocessing import Process
+import math
 import time
 import traceback
 from logging import Logger
 
+from core.breaker import CircuitBreaker
+from core.cache import Cache
 from core.schema import S1
 from services import poller_worker
 from services.service_base import ServiceBase
@@ -10,6 +13,162 @@ from utils import config
 from core import Data
 
 
+class PollSchedule(object):
+    """
+    Predicts when the next post of a gid is due from its daily activity map and data change history
+    """
+    def __init__(self, default_s=600, quiet_s=1800, min_s=300, max_s=7200, burst_s=120, burst_window_s=1800, spread_minutes=90):
+        # poll period for gids without change history
+        self.default_s = default_s
+        # added to default_s when gid without change history has no activity at this time of day
+        self.quiet_s = quiet_s
+        # poll period bounds
+        self.min_s = min_s
+        self.max_s = max_s
+        # fast poll period for burst_window_s seconds after a change
+        self.burst_s = burst_s
+        self.burst_window_s = burst_window_s
+        # activity map window is time of day +/- spread_minutes
+        self.spread_minutes = spread_minutes
+
+    def time_of_day_factor(self, activity_map, at_time):
+        """
+        @return: < 1.0 if the gid is busier than average at this time of day, > 1.0 if it is quieter
+        """
+        total = sum(activity_map)
+        if not total:
+            return 1.0
+
+        window = Cache.activity_map_window(activity_map, Cache.stamp_minute(at_time), self.spread_minutes)
+        expected = total * (2.0 * self.spread_minutes + 1) / Cache.ACTIVITY_MAP_SLOTS
+        return min(4.0, max(0.5, (expected + 1.0) / (window + 1.0)))
+
+    def next_poll_in(self, at_time, activity_map, changed, change_interval):
+        """
+        @param at_time: epoch now
+        @param activity_map: gid daily activity map
+        @param changed: epoch of the last data change, 0 if unknown
+        @param change_interval: average interval between data changes, 0 if unknown
+        @return: seconds to the next poll
+        """
+        # no change history, legacy behaviour
+        if not (changed and change_interval):
+            if Cache.activity_map_window(activity_map, Cache.stamp_minute(at_time), self.spread_minutes):
+                return self.default_s
+            return self.default_s + self.quiet_s
+
+        since_change = at_time - changed
+        # fast poll burst, more posts are likely to follow
+        if since_change < self.burst_window_s:
+            return self.burst_s
+
+        due_in = change_interval - since_change
+        if due_in > 0:
+            # next post is expected in due_in seconds
+            delay = due_in
+        else:
+            # overdue, the rhythm is slowing down -- half the time elapsed since the last post
+            delay = since_change / 2.0
+
+        delay *= self.time_of_day_factor(activity_map, at_time)
+        return min(self.max_s, max(self.min_s, delay))
+
+
+class PlanPolicy(object):
+    """
+    Polling policy of plan tags from 'poll' sections of limits.json, plan tags of gids are cached for cache_s
+    """
+    # min_s and max_s bound the poll interval, higher priority plans are dispatched first,
+    # share is the max fraction of dispatch budget a plan takes while other plans' gids wait
+    DEFAULT = dict(min_s=0, max_s=0, priority=0, share=1.0)
+
+    def __init__(self, cache_s=600):
+        self.cache_s = cache_s
+        # plan tag --> policy, free plan tag is ''
+        self.policy = dict()
+        # gid --> (plan tag, cached epoch)
+        self.tags = dict()
+
+    def load_config(self, cfg):
+        """
+        @param cfg: limits.json, plan name or tag --> plan dict
+        """
+        self.policy = dict()
+        for name, plan in cfg.iteritems():
+            if 'poll' in plan:
+                policy = dict(PlanPolicy.DEFAULT)
+                policy.update(plan['poll'])
+                self.policy[plan['tag'] if 'tag' in plan else name] = policy
+
+    def get(self, tag):
+        return self.policy.get(tag or '', PlanPolicy.DEFAULT)
+
+    def get_tags(self, data, gids, at_time):
+        """
+        @type data: Data
+        @return: dict of gid --> best plan tag of the gid and its parent accounts, cached tags are re-read after cache_s
+        """
+        if not self.policy:
+            return dict()
+        if len(self.tags) > 100000:
+            self.tags = {gid: cached for gid, cached in self.tags.iteritems() if cached[1] > at_time - self.cache_s}
+        missing = [gid for gid in gids if gid not in self.tags or self.tags[gid][1] < at_time - self.cache_s]
+        if missing:
+            for gid, tags in zip(missing, data.get_source_limits_bulk(missing)):
+                self.tags[gid] = (self.best(tags), at_time)
+        return {gid: self.tags[gid][0] for gid in gids}
+
+    def best(self, tags):
+        """
+        @return: plan tag of the highest priority, shortest min poll interval breaks ties
+        """
+        return max((tag or '' for tag in tags), key=lambda tag: (self.get(tag)['priority'], -self.get(tag)['min_s']))
+
+    def clamp(self, tag, interval):
+        policy = self.get(tag)
+        if policy['max_s']:
+            interval = min(policy['max_s'], interval)
+        return max(policy['min_s'], interval)
+
+    def is_selective(self):
+        """
+        @return: True if select() may prefer gids further down the claim over the oldest ones
+        """
+        policies = self.policy.values() + [PlanPolicy.DEFAULT]
+        return len(set(policy['priority'] for policy in policies)) > 1 or any(policy['share'] < 1.0 for policy in policies)
+
+    def is_priority(self, tag):
+        """
+        @return: True if the plan priority is above the lowest one, backlog smoothing leaves such gids due
+        """
+        return self.get(tag)['priority'] > min(policy['priority'] for policy in self.policy.values() + [PlanPolicy.DEFAULT])
+
+    def select(self, claimed, tags, budget):
+        """
+        Picks gids to dispatch from the claimed due gids, higher priority plans first
+        @param claimed: list of (gid, scheduled epoch) tuples in due order
+        @param tags: dict of gid --> plan tag
+        @return: (selected, deferred) lists of (gid, scheduled epoch) tuples
+        """
+        ordered = sorted(claimed, key=lambda c: -self.get(tags.get(c[0])).get('priority', 0))
+        if len(ordered) <= budget:
+            return ordered, []
+
+        selected = []
+        over = []
+        used = dict()
+        for gid, scheduled in ordered:
+            tag = tags.get(gid) or ''
+            if len(selected) < budget and used.get(tag, 0) < math.ceil(self.get(tag)['share'] * budget):
+                used[tag] = used.get(tag, 0) + 1
+                selected.append((gid, scheduled))
+            else:
+                over.append((gid, scheduled))
+        # budget left by plans without waiting gids goes to over-share gids
+        fill = budget - len(selected)
+        return selected + over[:fill], over[fill:]
+
+
 class Poller(ServiceBase):
 
     def __init__(self, logger, name, data, providers, config_path, dummy=False):
@@ -22,8 +181,6 @@ class Poller(ServiceBase):
         self.kwargs = None
         # default poller driver period
         self.period_s = 2
-        # how many gids are allowed to expire in period_s before new worker is launched
-        self.gid_set_threshold = 100
         # number of worker processes
         self.workers_min = 3
         # max number of worker process
@@ -32,21 +189,55 @@ class Poller(ServiceBase):
         self.gid_poll_s = 600
         # default no poll period, 30 min
         self.gid_no_poll_s = 1800
+        self.schedule = PollSchedule(default_s=self.gid_poll_s, quiet_s=self.gid_no_poll_s)
+        # shared with workers, see PollerWorker
+        self.breaker = CircuitBreaker(logger, data.rc, 'google')
+        # number of gids packed into one worker update message
+        self.dispatch_chunk = 10
+        # max number of polled gids re-scheduled in one go
+        self.reschedule_chunk = 50
+        # number of gids each worker polls concurrently
+        self.worker_concurrency = 1
+        # polls per second a single poll thread does, sizes the floor of dispatch budget
+        self.worker_poll_rate = 1.0
+        # dispatch budget over the measured poll rate, lets throughput grow when workers are faster than estimated
+        self.rate_headroom = 1.5
+        # min window to spread overdue backlog over
+        self.catchup_s = 600
+        # poll interval factor, grows when Google API daily budget runs low
+        self.stretch = 1.0
+        # per plan intervals and dispatch priority
+        self.plans = PlanPolicy()
+        # due gids claimed per dispatch budget slot, the surplus lets higher priority plans go first
+        self.plan_overscan = 2
+        # master is considered dead and its shards are re-assigned after missing heartbeats for this long
+        self.master_ttl_s = 30
+        # shard lease time, renewed every period, must be well above period_s
+        self.lease_s = 10
+        # gid schedule shards leased by this master
+        self.shards = []
+        # shard --> fencing token of the shard lease
+        self.tokens = dict()
+        self.scheduled_at = 0
+        # polled gids per second, moving average
+        self.rate = 0.0
+        self.rate_at = time.time()
+        self.rate_count = 0
+        # this master's workers poll from the work list and report back to the out list
+        self.work_channel = S1.poller_work_channel(self.name)
+        self.out_channel = S1.poller_out_channel(self.name)
 
         self.started_at = time.time()
-        self.stats = {
-            'hour': (self.started_at, 0),
-            'day': (self.started_at, 0),
-        }
 
         self.channel_handler = {
-            S1.poller_channel_name('all-out'): self.on_all_out,
+            self.out_channel: self.on_all_out,
             S1.poller_channel_name(self.name): self.on_my_name
         }
 
     def get_worker(self, sub_name):
         kwargs = self.kwargs
         kwargs['name'] = sub_name
+        kwargs['master'] = self.name
         return Process(target=poller_worker.run_poller_worker, name=sub_name, kwargs=self.kwargs)
 
     def on_terminate(self, *args, **kwargs):
@@ -74,25 +265,56 @@ class Poller(ServiceBase):
         except Exception as e:
             self.logger.error('ERROR: Exception in on_raw: {0}, \r\n{1}'.format(e, traceback.format_exc()))
 
+        # listener timeout never fires while polled gids keep coming in
+        if time.time() - self.scheduled_at > self.period_s:
+            self.schedule_next_batch(allow_worker_start=True)
+
     def on_all_out(self, gid):
         """
-        Reschedules the gid for next poll based on gid activity, other factors may be added later
+        Drains polled gids from the all-out list and re-schedules them in one group
         @param gid: assuming raw data is gid
         """
+        gids = [gid]
+        gids.extend(self.pop_data_list(self.out_channel, self.reschedule_chunk - 1))
+        self.reschedule(list(set(gids)))
+
+    def reschedule(self, gids):
+        """
+        Reschedules the gids for next poll based on gid activity and data change history
+        @type gids: list
+        """
         at_time = time.time()
         # default poll period for each gid is 10 * 60 sec
-        next_time = at_time + self.gid_poll_s
+        next_times = {gid: at_time + self.gid_poll_s * self.stretch for gid in gids}
+        tags = dict()
         try:
-            # get num results in this 3-hour period
-            if not self.data.cache.get_num_minute_updates(gid, int(at_time), 90):
-                # no updates this time of day --> add 45 minutes to next poll epoch
-                next_time += self.gid_no_poll_s
+            tags = self.plans.get_tags(self.data, gids, at_time)
+            for gid, history in zip(gids, self.data.cache.get_poll_history_bulk(gids)):
+                activity_map, changed, change_interval = history
+                next_in = self.schedule.next_poll_in(at_time, activity_map, changed, change_interval)
+                # plan bounds win over the stretch, free plan is stretched first
+                next_times[gid] = at_time + self.plans.clamp(tags.get(gid), next_in * self.stretch)
         except Exception as e:
             msg = 'Exception while processing stats [{0}], [{1}], {2}'
-            self.logger.error(msg.format(gid, e, traceback.format_exc()))
+            self.logger.error(msg.format(len(gids), e, traceback.format_exc()))
 
-        # store just polled gid in sorted gid set
-        self.data.balancer.add_gid_set(gid, next_time)
+        # store just polled gids in sorted gid set
+        self.data.balancer.add_gid_set_bulk(next_times)
+        if tags:
+            self.data.balancer.set_priority_bulk({gid: self.plans.is_priority(tags.get(gid)) for gid in gids})
+        self.data.balancer.clear_retries(gids)
+        self.rate_count += len(gids)
+
+    def update_rate(self, at_time):
+        """
+        @return: polled gids per second, moving average
+        """
+        elapsed = at_time - self.rate_at
+        if elapsed >= self.period_s:
+            self.rate += 0.3 * (self.rate_count / elapsed - self.rate)
+            self.rate_at = at_time
+            self.rate_count = 0
+        return self.rate
 
     def on_my_name(self, raw):
         self.schedule_next_batch(allow_worker_start=False)
@@ -100,56 +322,168 @@ class Poller(ServiceBase):
     def on_timeout(self):
         self.schedule_next_batch(allow_worker_start=True)
 
+    def rebalance(self, at_time):
+        """
+        Refreshes this master's heartbeat and shard leases, rendezvous hashing across all live masters picks
+        the preferred owner of each shard, a shard moves once its current owner releases it or the lease lapses
+        """
+        masters = self.data.balancer.heartbeat_master(self.name, at_time, self.master_ttl_s)
+        preferred = self.data.balancer.assign_shards(self.name, masters)
+        self.tokens = self.data.balancer.lease_shards(self.name, preferred,
+                                                      [shard for shard in self.shards if shard not in preferred], self.lease_s)
+        shards = sorted(self.tokens.keys())
+        if shards != self.shards:
+            self.logger.warning('[{0}] Shards re-assigned, masters {1}, shards {2}'.format(self.name, masters, shards))
+            self.shards = shards
+            self.data.balancer.set_master_shards(self.name, shards)
+
+    def drop_shard(self, shard):
+        """
+        Stops scheduling the shard after a fenced write was rejected, another master holds the lease
+        """
+        self.logger.warning('[{0}] Lease of shard [{1}] lost'.format(self.name, shard))
+        self.tokens.pop(shard, None)
+        if shard in self.shards:
+            self.shards.remove(shard)
+            self.data.balancer.set_master_shards(self.name, self.shards)
+
     def schedule_next_batch(self, allow_worker_start=False):
         try:
             self.logger.info('[{0}] wake up!'.format(self.name))
-            # get the gid set until all processed
-            while True:
-                at_time = time.time()
-                gid_set = self.data.balancer.get_next_poll_set(at_time + self.period_s / 2.0)
-                gid_set_len = len(gid_set)
-                if not gid_set_len:
-                    self.logger.warning('[{0}] Empty gid_set...'.format(self.name))
-                    return
-                elif allow_worker_start and gid_set_len > self.gid_set_threshold:
-                    self.logger.warning('Gid set count [{0}] above threshold, starting worker...'.format(gid_set_len))
-                    self.start_worker()
-
-                self.logger.info('[{0}] Invoking poll for [{1}] items...'.format(self.name, gid_set_len))
-
-                # clean orphaned gids
-                update_set = [gid for gid in gid_set if not self.data.check_orphan(gid, at_time)]
-
-                # post each gid to poller
-                for gid in update_set:
-                    # move next poll time for the gid to avoid duplicate polling
-                    self.data.balancer.add_gid_set(gid, at_time + self.gid_poll_s)
-                    # post to pollers
-                    self.broadcast_command(S1.poller_channel_name('all'), S1.msg_update(), gid)
-
-                # update stats
-                self.update_stats(at_time, len(update_set))
+            self.scheduled_at = time.time()
+            self.rebalance(self.scheduled_at)
+            self.update_stretch(self.scheduled_at)
+            lag_s = 0.0
+            rate = self.update_rate(self.scheduled_at)
+            # nothing is dispatched while Google keeps failing, workers let a probe through once circuit half-opens
+            if self.breaker.is_open():
+                self.logger.warning('[{0}] Circuit open, polling paused'.format(self.name))
+            elif self.shards:
+                queued = self.data.balancer.queued_depth(self.work_channel, self.dispatch_chunk)
+                # the budget is the backpressure, nothing is dispatched while the queued gids take it up
+                budget = self.dispatch_budget(rate, queued)
+                if not budget:
+                    self.logger.warning('[{0}] Work list at [{1}] gids, dispatch throttled'.format(self.name, queued))
+                    self.update_stats(self.scheduled_at, 0, throttled=1)
+                else:
+                    for shard in list(self.shards):
+                        lag_s = max(lag_s, self.schedule_shard(shard, int(math.ceil(budget / float(len(self.shards))))))
+
+            # grow or shrink worker pool
+            if allow_worker_start:
+                # scaler thresholds are queued gids per poll thread
+                depth = self.data.balancer.queued_depth(self.work_channel, self.dispatch_chunk) / float(self.worker_concurrency)
+                self.autoscale(self.scheduled_at, depth, lag_s, rate / self.worker_concurrency)
 
         except Exception as e:
             self.logger.warning('Exception in poller driver: {0}'.format(e))
             self.logger.exception(traceback.format_exc())
             self.data.unregister_poller(self.name)
 
-    def update_stats(self, at_time, count):
-        s = self.stats['hour']
-        self.stats['hour'] = (s[0], s[1] + count)
-        s = self.stats['day']
-        self.stats['day'] = (s[0], s[1] + count)
+    def update_stretch(self, at_time):
+        stretch = self.data.quota.get_stretch('plus', at_time)
+        if stretch != self.stretch:
+            self.logger.warning('[{0}] Google API budget pace, poll interval stretch [{1:.2f}]'.format(self.name, stretch))
+            self.stretch = stretch
+
+    def dispatch_budget(self, rate, queued):
+        """
+        @param rate: measured polls per second
+        @param queued: number of gids waiting in the work list
+        @return: number of gids to dispatch in one period, the measured rate with headroom or the max worker pool
+        estimate whichever is higher, less the gids still queued
+        """
+        return max(0, int(max(self.capacity(), rate * self.rate_headroom) * self.period_s) - queued)
 
-        # set in DB
-        self.data.balancer.set_poller_stats(self.name, hour=self.stats['hour'][1], day=self.stats['day'][1])
+    def capacity(self):
+        """
+        @return: polls per second the max worker pool is able to do
+        """
+        return self.workers_max * self.worker_concurrency * self.worker_poll_rate
 
-        # clean stats if lapsed
-        if at_time - self.stats['hour'][0] > 3600:
-            # reset counters
-            self.stats['hour'] = (at_time, 0)
-            if at_time - self.stats['day'][0] > 86400:
-                self.stats['day'] = (at_time, 0)
+    def smooth_shard(self, shard, at_time, budget):
+        """
+        Spreads overdue backlog of the shard evenly over the time the max worker pool takes to poll it,
+        catch-up window at most, when the dispatch budget does not absorb it, e.g. after a long outage or Redis reload
+        @param budget: max number of gids dispatched from the shard per period
+        """
+        overdue = self.data.balancer.count_due(shard, at_time)
+        shard_capacity = self.capacity() / max(len(self.shards), 1)
+        if overdue <= max(budget, 1) * min(self.catchup_s, overdue / shard_capacity) / self.period_s:
+            return
+        window_s = min(self.catchup_s, overdue / shard_capacity)
+        # higher priority plans stay due ahead of the spread backlog, claims reach them first
+        spread = self.data.balancer.spread_due(shard, at_time, at_time, window_s, owner=self.name, token=self.tokens.get(shard, 0))
+        if spread is None:
+            self.drop_shard(shard)
+        else:
+            self.logger.warning('[{0}] Spread [{1}] of [{2}] overdue gids in shard [{3}] over [{4:.0f}]s'.format(
+                self.name, spread, overdue, shard, window_s))
+
+    def schedule_shard(self, shard, budget):
+        """
+        Dispatches due gids of the shard
+        @param budget: max number of gids to dispatch
+        @return: max lag of the dispatched gids behind their schedule, seconds
+        """
+        lag_s = 0.0
+        self.smooth_shard(shard, time.time(), budget)
+        # claiming past the budget is only worth it when plans are dispatched out of due order
+        overscan = self.plan_overscan if self.plans.is_selective() else 1
+        # get the gid set until all processed or out of budget
+        while budget > 0:
+            at_time = time.time()
+            # claimed gids are leased for the poll period, on_all_out() will re-schedule them
+            claimed = self.data.balancer.claim_next_poll_set(shard, at_time + self.period_s / 2.0, at_time + self.gid_poll_s,
+                                                            num=min(200, budget * overscan),
+                                                            owner=self.name, token=self.tokens.get(shard, 0))
+            if claimed is None:
+                self.drop_shard(shard)
+                return lag_s
+            gid_set_len = len(claimed)
+            if not gid_set_len:
+                self.logger.info('[{0}] Empty gid_set in shard [{1}]...'.format(self.name, shard))
+                return lag_s
+
+            # clean orphaned gids
+            orphans = self.data.check_orphans([gid for gid, _ in claimed], at_time)
+            update_set = [(gid, scheduled) for gid, scheduled in claimed if gid not in orphans]
+
+            # higher priority plans go first, gids over the budget are put back behind the gids already due
+            # so that the next claim reaches higher priority gids past this window
+            update_set, deferred = self.plans.select(update_set, self.plans.get_tags(self.data, [gid for gid, _ in update_set], at_time),
+                                                     budget)
+            budget -= len(update_set) + len(orphans)
+            if deferred:
+                self.data.balancer.add_gid_set_bulk({gid: at_time for gid, _ in deferred})
+                budget = 0
+
+            # newly registered gids are scheduled at 0
+            lag_s = max([lag_s] + [at_time - scheduled for _, scheduled in update_set if scheduled > 0])
+
+            self.logger.info('[{0}] Invoking poll for [{1}] items...'.format(self.name, len(update_set)))
+
+            # post gids to pollers in chunks, all chunks in one push, gids still waiting in a work list are skipped
+            # scheduled epochs travel with the gids so workers can report the actual poll lag
+            pushed, skipped = self.data.balancer.dispatch_gids(self.work_channel, S1.msg_update(), update_set, at_time,
+                                                               self.gid_poll_s, self.dispatch_chunk)
+            if skipped:
+                self.logger.warning('[{0}] Skipped [{1}] gids already queued'.format(self.name, skipped))
+
+            # update stats
+            self.update_stats(at_time, pushed, deduped=skipped)
+
+        return lag_s
+
+    def update_stats(self, at_time, count, deduped=0, throttled=0):
+        """
+        Records dispatched gid count and sample of gids queued in the work list in poller telemetry
+        """
+        try:
+            depth = self.data.balancer.queued_depth(self.work_channel, self.dispatch_chunk)
+            self.data.stats.record_dispatch(self.name, at_time, count, depth, deduped=deduped, throttled=throttled)
+        except Exception as e:
+            self.logger.error('Exception while recording stats: {0}'.format(e))
 
     def run(self, *args, **kwargs):
         self.kwargs = kwargs
@@ -158,6 +492,28 @@ class Poller(ServiceBase):
         self.period_s = cfg['period_s'] if 'period_s' in cfg else self.period_s
         self.workers_min = cfg['workers_min'] if 'workers_min' in cfg else self.workers_min
         self.workers_max = cfg['workers_max'] if 'workers_max' in cfg else self.workers_max
+        self.gid_no_poll_s = cfg['gid_no_poll_s'] if 'gid_no_poll_s' in cfg else self.gid_no_poll_s
+        self.dispatch_chunk = cfg['dispatch_chunk'] if 'dispatch_chunk' in cfg else self.dispatch_chunk
+        self.reschedule_chunk = cfg['reschedule_chunk'] if 'reschedule_chunk' in cfg else self.reschedule_chunk
+        self.master_ttl_s = cfg['master_ttl_s'] if 'master_ttl_s' in cfg else self.master_ttl_s
+        self.lease_s = cfg['lease_s'] if 'lease_s' in cfg else self.lease_s
+        self.worker_concurrency = cfg['worker_concurrency'] if 'worker_concurrency' in cfg else self.worker_concurrency
+        self.worker_poll_rate = cfg['worker_poll_rate'] if 'worker_poll_rate' in cfg else self.worker_poll_rate
+        self.rate_headroom = cfg['rate_headroom'] if 'rate_headroom' in cfg else self.rate_headroom
+        self.catchup_s = cfg['catchup_s'] if 'catchup_s' in cfg else self.catchup_s
+        self.plan_overscan = cfg['plan_overscan'] if 'plan_overscan' in cfg else self.plan_overscan
+        self.scaler.load_config(cfg)
+        self.data.quota.load_config(cfg['quota'] if 'quota' in cfg else dict())
+        try:
+            self.plans.load_config(config.load_config(kwargs['config_path'], 'limits.json'))
+        except IOError:
+            self.logger.warning('No limits.json, all plans polled alike')
+        self.schedule = PollSchedule(default_s=self.gid_poll_s,
+                                     quiet_s=self.gid_no_poll_s,
+                                     min_s=cfg['poll_min_s'] if 'poll_min_s' in cfg else self.schedule.min_s,
+                                     max_s=cfg['poll_max_s'] if 'poll_max_s' in cfg else self.schedule.max_s,
+                                     burst_s=cfg['poll_burst_s'] if 'poll_burst_s' in cfg else self.schedule.burst_s,
+                                     burst_window_s=cfg['poll_burst_window_s'] if 'poll_burst_window_s' in cfg else self.schedule.burst_window_s)
 
         self.logger.info('Poller v[{0}], name=[{1}], poll delay=[{2}]s, period=[{3}]s starting...'.format(config.version, self.name, self.gid_poll_s, self.period_s))
 
@@ -174,13 +530,16 @@ class Poller(ServiceBase):
         # drop message to self to do immediate poll round
         self.broadcast_data(S1.poller_channel_name(self.name), '#')
         # start listening
-        self.listener([S1.poller_channel_name('all-out'), S1.poller_channel_name(self.name)], None, timeout=self.period_s)
+        self.listener([self.out_channel, S1.poller_channel_name(self.name)], None, timeout=self.period_s)
         self.logger.warning('Poller master listener exit!')
 
-        # un-register self
+        # un-register self, other masters will pick up the shards without waiting for the leases to lapse
         self.data.unregister_poller(self.name)
+        self.data.balancer.remove_master(self.name)
+        self.data.balancer.lease_shards(self.name, [], self.shards, self.lease_s)
 
         # force kill any remaining workers
+        self.workers.update(self.retiring)
         while self.workers:
             p = self.workers.popitem()
             self.logger.warning('Terminating remaining poller {0}!'.format(p[0]))
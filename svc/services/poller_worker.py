@@ -1,8 +1,11 @@
-from datetime import time
+import Queue
 import random
+import threading
+import time
 import traceback
 
 from core import data
+from core.breaker import CircuitBreaker
 from core.schema import S1
 from providers.google_poll import GooglePollAgent
 from services.service_base import ServiceBase
@@ -10,9 +13,35 @@ from utils import config
 
 
 class PollerWorker(ServiceBase):
-    def __init__(self, logger, name, data, provider_names, config_path):
+    # poll outcomes telling how Google does, quota denials and empty responses are left out of the circuit breaker
+    BREAKER_OUTCOMES = ('ok', 'retry', 'fail')
+
+    def __init__(self, logger, name, data, provider_names, config_path, master=None):
         super(PollerWorker, self).__init__(logger, name, data, provider_names, config_path)
         self.google_poll = GooglePollAgent(logger, data, config_path)
+        # gids are dispatched by the poller master to its work list and reported back to its out list
+        self.work_channel = S1.poller_work_channel(master) if master else S1.poller_channel_name('all')
+        self.out_channel = S1.poller_out_channel(master) if master else S1.poller_channel_name('all-out')
+        # telemetry is aggregated per poller master
+        self.stats_name = master if master else name
+        # number of gids polled concurrently, 1 polls in the listener thread
+        self.concurrency = 1
+        self.pool = []
+        self.pool_queue = None
+        # gids being polled by the pool, a gid is never polled twice at the same time
+        self.in_flight = set()
+        self.lock = threading.Lock()
+        # failed gids are retried with backoff, polling pauses while Google keeps failing
+        self.retry_base_s = 30
+        self.retry_max_s = 600
+        self.breaker = CircuitBreaker(logger, data.rc, 'google')
+        # interactive requests in priority lane are expected to be served within this time
+        self.priority_target_s = 2
+        self.callback = {
+            S1.msg_update(): self._on_update,
+            S1.msg_validate(): self._on_validate,
+            S1.msg_register(): self._on_register,
+        }
 
     def on_terminate(self, *args, **kwargs):
         self.logger.warning('[{0}] Poller is force-terminating...'.format(self.name))
@@ -22,7 +51,11 @@ class PollerWorker(ServiceBase):
         self.logger.warning('[{0}] Poller is terminating nicely...'.format(self.name))
         self.terminate()
 
-    def _on_update(self, channel, items):
+    def _on_update(self, channel, items, scheduled=None):
+        """
+        @param items: comma separated gids
+        @param scheduled: comma separated scheduled epochs of the gids, optional
+        """
         if not items:
             self.logger.warning('[{0}] Empty items skipped...'.format(self.name))
             return
@@ -33,44 +66,216 @@ class PollerWorker(ServiceBase):
             self.logger.warning('[{0}] Empty gid_set skipped...'.format(self.name))
             return
 
+        scheduled = dict(zip(gid_set, [int(s) for s in scheduled.split(',')])) if scheduled else dict()
+        # taken off the work list, master may queue the gids again
+        self.data.balancer.dequeue_gids(gid_set, channel)
+        if self.pool:
+            self.submit(gid_set, scheduled)
+        else:
+            self.poll_chunk(gid_set, scheduled)
+
+    def poll_chunk(self, gid_set, scheduled, priority=False):
+        """
+        Polls the gids in listener thread, priority lane is served between routine polls
+        """
+        results = []
         for gid in gid_set:
+            if not priority:
+                self.drain_priority()
+            results.append(self.poll(self.google_poll, gid, scheduled.get(gid)))
+        self.complete(gid_set, results, scheduled)
 
-            if self.dummy:
+    def drain_priority(self):
+        """
+        Serves interactive requests waiting in priority lane ahead of routine polls
+        """
+        for raw in self.pop_data_list(S1.poller_priority_channel(), 10):
+            self.dispatch(S1.poller_priority_channel(), raw, self.callback)
+
+    def check_latency(self, enqueued):
+        """
+        @param enqueued: epoch the request was pushed to priority lane
+        """
+        wait_s = time.time() - float(enqueued) if enqueued else 0
+        if wait_s > self.priority_target_s:
+            self.logger.warning('[{0}] Priority request waited [{1:.1f}]s'.format(self.name, wait_s))
+
+    def poll(self, agent, gid, scheduled):
+        """
+        @type agent: GooglePollAgent
+        @param scheduled: epoch the gid was scheduled at, 0 or None if unknown
+        @return: (polled, (outcome, lag seconds, fetch seconds)) tuple, (False, None) if circuit is open,
+        None if not polled
+        """
+        if self.dummy:
             # sleep random to imitate web-service call
-                self.logger.info('Poller is dummy, not posting [{0}]'.format(gid))
-                time.sleep(random.randint(1000, 1500) / 1000.0)
-            else:
-                #### POLL GOOGLE for data, reschedule for expedited retry if poll fails
-                if not self.google_poll.poll(gid):
-                    self.logger.warning('Retrying for {0} ...'.format(gid))
-                    self.data.pubsub.broadcast_command(S1.poller_channel_name('all'), S1.msg_update(), gid)
-                else:
-                    # the gid will be picked up by poller master and decorated for the next poll
-                    self.data.pubsub.broadcast_data(S1.poller_channel_name('all-out'), gid)
-
-    def _on_validate(self, channel, in_list_name, out_list_name):
-        for user_name in self.data.get_next_in_list(in_list_name):
+            self.logger.info('Poller is dummy, not posting [{0}]'.format(gid))
+            time.sleep(random.randint(1000, 1500) / 1000.0)
+            return None
+
+        circuit = self.breaker.allow()
+        if circuit == CircuitBreaker.DENIED:
+            self.logger.info('Circuit open, retrying for {0} ...'.format(gid))
+            return False, None
+
+        # newly registered gids are scheduled at 0
+        lag_s = time.time() - scheduled if scheduled else None
+        #### POLL GOOGLE for data, reschedule for retry if poll fails
+        polled = agent.poll(gid)
+        if not polled:
+            self.logger.warning('Retrying for {0} ...'.format(gid))
+        # probe which did not get an answer from Google decides nothing, the next one goes after probe_s
+        if circuit == CircuitBreaker.PROBE and agent.last_outcome in PollerWorker.BREAKER_OUTCOMES:
+            self.breaker.record_probe(time.time(), agent.last_outcome == 'ok')
+        return polled, (agent.last_outcome, lag_s, agent.last_fetch_s)
+
+    def complete(self, gid_set, results, scheduled):
+        """
+        Reports a polled chunk: failed gids are re-scheduled with backoff, polled gids go to the out list
+        @param results: poll() result for each gid in gid_set
+        """
+        polled = [gid for gid, result in zip(gid_set, results) if result and result[0]]
+        failed = [gid for gid, result in zip(gid_set, results) if result and not result[0]]
+        polls = [result[1] for result in results if result and result[1]]
+
+        at_time = time.time()
+        self.data.balancer.retry_gids(failed, at_time, self.retry_base_s, self.retry_max_s)
+
+        # the gids will be picked up by poller master and decorated for the next poll
+        self.data.pubsub.broadcast_data_list(self.out_channel, polled)
+
+        if polls:
+            judged = [p for p in polls if p[0] in PollerWorker.BREAKER_OUTCOMES]
+            errors = len([p for p in judged if p[0] != 'ok'])
+            if judged:
+                self.breaker.record(at_time, len(judged) - errors, errors)
+            try:
+                self.data.stats.record_polls(self.stats_name, at_time, polls)
+            except Exception as e:
+                self.logger.error('[{0}] Exception while recording stats: {1}'.format(self.name, e))
+
+    def start_pool(self):
+        """
+        Starts poll threads, each thread has its own poll agent as HTTP connections are not thread safe
+        """
+        # bounded queue blocks the listener while all threads are busy, the rest stays in the work list
+        self.pool_queue = Queue.Queue(maxsize=self.concurrency)
+        for n in xrange(0, self.concurrency):
+            t = threading.Thread(target=self.run_pool_thread, name='{0}.{1:02}T'.format(self.name, n),
+                                 args=(GooglePollAgent(self.logger, self.data, self.config_path),))
+            t.daemon = True
+            t.start()
+            self.pool.append(t)
+        self.logger.info('[{0}] Started [{1}] poll threads'.format(self.name, self.concurrency))
+
+    def stop_pool(self):
+        """
+        Lets poll threads finish the queued gids and exit
+        """
+        for _ in self.pool:
+            self.pool_queue.put(None)
+        while self.pool:
+            self.pool.pop().join()
+
+    def submit(self, gid_set, scheduled):
+        """
+        Queues the chunk to the poll threads, the chunk is reported by the thread polling its last gid
+        """
+        with self.lock:
+            gids = [gid for gid in set(gid_set) if gid not in self.in_flight]
+            self.in_flight.update(gids)
+        if len(gids) < len(gid_set):
+            self.logger.warning('[{0}] Skipped [{1}] gids in flight'.format(self.name, len(gid_set) - len(gids)))
+        if not gids:
+            return
+
+        chunk = dict(gids=gids, scheduled=scheduled, results=[None] * len(gids), pending=len(gids))
+        for n in xrange(0, len(gids)):
+            # priority lane is served while all poll threads are busy
+            while True:
+                try:
+                    self.pool_queue.put((chunk, n), timeout=0.5)
+                    break
+                except Queue.Full:
+                    self.drain_priority()
+
+    def run_pool_thread(self, agent):
+        """
+        @type agent: GooglePollAgent
+        """
+        while True:
+            task = self.pool_queue.get()
+            if not task:
+                return
+
+            chunk, n = task
+            gid = chunk['gids'][n]
+            try:
+                result = self.poll(agent, gid, chunk['scheduled'].get(gid))
+            except Exception as e:
+                self.logger.error('[{0}] Exception while polling {1}: {2}'.format(self.name, gid, e))
+                result = False, ('fail', None, None)
+
+            with self.lock:
+                chunk['results'][n] = result
+                chunk['pending'] -= 1
+                done = not chunk['pending']
+                self.in_flight.discard(gid)
+
+            if done:
+                try:
+                    self.complete(chunk['gids'], chunk['results'], chunk['scheduled'])
+                except Exception as e:
+                    self.logger.error('[{0}] Exception while completing chunk: {1}, {2}'.format(self.name, e, traceback.format_exc()))
+
+    def _on_validate(self, channel, in_list_name, enqueued=None):
+        self.check_latency(enqueued)
+        query = self.data.get_service_query(in_list_name, time.time())
+        if query:
+            ticket, user_name = query
             self.logger.info('Validating Google User ID {0}'.format(user_name))
             valid_name = self.google_poll.validate_user_name(user_name)
-            self.data.list_push(out_list_name, '{0}:{1}'.format(user_name, valid_name))
+            self.data.reply_service_query(ticket, S1.msg_validate(), valid_name)
 
-    def _on_register(self, channel):
+    def _on_register(self, channel, enqueued=None):
+        """
+        Polls all registered gids right away, never queued behind routine polls
+        """
+        self.check_latency(enqueued)
+        gids = []
         gid = self.data.balancer.get_next_registered()
         while gid:
             self.logger.info('Registring GID: {0}'.format(gid))
-            self.data.pubsub.broadcast_command(S1.poller_channel_name(self.name), S1.msg_update(), gid)
+            gids.append(gid)
             gid = self.data.balancer.get_next_registered()
 
+        if gids:
+            self.poll_chunk(gids, {gid: float(enqueued) for gid in gids} if enqueued else dict(), priority=True)
+
     def run(self, *args, **kwargs):
         """
         Goes into infinite blocking listener() loop
         """
-        callback = {
-            S1.msg_update(): self._on_update,
-            S1.msg_validate(): self._on_validate,
-            S1.msg_register(): self._on_register,
-        }
-        self.listener([S1.poller_channel_name('all'), S1.poller_channel_name(self.name)], callback)
+        # own channel goes first, exit message must get through a busy work list
+        channels = [S1.poller_channel_name(self.name), S1.poller_priority_channel(), S1.poller_channel_name('all')]
+        if self.work_channel not in channels:
+            channels.append(self.work_channel)
+
+        cfg = config.load_config(self.config_path, 'poller.json')
+        self.concurrency = cfg['worker_concurrency'] if 'worker_concurrency' in cfg else self.concurrency
+        self.priority_target_s = cfg['priority_target_s'] if 'priority_target_s' in cfg else self.priority_target_s
+        self.retry_base_s = cfg['retry_base_s'] if 'retry_base_s' in cfg else self.retry_base_s
+        self.retry_max_s = cfg['retry_max_s'] if 'retry_max_s' in cfg else self.retry_max_s
+        self.breaker.load_config(cfg)
+        self.data.quota.load_config(cfg['quota'] if 'quota' in cfg else dict())
+        if self.concurrency > 1:
+            self.start_pool()
+
+        self.listener(channels, self.callback)
+
+        # finish queued gids before exit
+        if self.pool:
+            self.stop_pool()
 
 
 def run_poller_worker(*args, **kwargs):
@@ -78,7 +283,7 @@ def run_poller_worker(*args, **kwargs):
     logger = config.get_logger(kwargs['log_path'], kwargs['name'])
     try:
         db = data.Data(logger, kwargs['redis_host'], kwargs['redis_port'], kwargs['redis_db'])
-        p = PollerWorker(logger, kwargs['name'], db, None, kwargs['config_path'])
+        p = PollerWorker(logger, kwargs['name'], db, None, kwargs['config_path'], master=kwargs.get('master'))
         logger.info('Starting poller worker: {0}'.format(kwargs['name']))
         p.run(args, kwargs)
     except Exception as e:
@@ -9,6 +9,7 @@ from providers.px500 import Px500Publisher
 from providers.tumblr import TumblrPublisher
 from providers.twitter import TwitterPublisher
 from services.service_base import ServiceBase
+from utils import config
 
 
 class PublisherProviders(object):
@@ -41,6 +42,8 @@ class Publisher(ServiceBase):
         @type provider_names: list
         """
         super(Publisher, self).__init__(logger, name, data, provider_names, config_path, dummy)
+        # providers of the process publish the same gids in bursts
+        data.cache.enable_lru(config.DEFAULT_PUBLISHER_LRU_BYTES)
 
         self.providers = {S1.publisher_channel_name(p): PublisherProviders.create(p, logger, data, config_path)
                           for p in provider_names}
@@ -1,9 +1,74 @@
 import atexit
 import signal
+from collections import OrderedDict
 from core.pubsub import Pubsub
 from core.schema import S1
 
 
+class WorkerScaler(object):
+    """
+    Sizes worker pool from work queue depth, processing lag and throughput.
+    Scale up is fast with a short cooldown, scale down requires the pool to be idle for a longer period.
+    """
+    def __init__(self, up_depth=20, down_depth=2, up_lag_s=60, up_drain_s=30, up_cooldown_s=30, down_cooldown_s=300):
+        # queued items per worker to scale up
+        self.up_depth = up_depth
+        # queued items per worker to consider scale down
+        self.down_depth = down_depth
+        # processing lag to scale up
+        self.up_lag_s = up_lag_s
+        # time to drain the queue at current throughput to scale up
+        self.up_drain_s = up_drain_s
+        # min time between scale ups, and min idle time before scale down
+        self.up_cooldown_s = up_cooldown_s
+        self.down_cooldown_s = down_cooldown_s
+
+        self.scaled_at = 0
+        self.idle_since = None
+
+    def load_config(self, cfg):
+        self.up_depth = cfg['scale_up_depth'] if 'scale_up_depth' in cfg else self.up_depth
+        self.down_depth = cfg['scale_down_depth'] if 'scale_down_depth' in cfg else self.down_depth
+        self.up_lag_s = cfg['scale_up_lag_s'] if 'scale_up_lag_s' in cfg else self.up_lag_s
+        self.up_drain_s = cfg['scale_up_drain_s'] if 'scale_up_drain_s' in cfg else self.up_drain_s
+        self.up_cooldown_s = cfg['scale_up_cooldown_s'] if 'scale_up_cooldown_s' in cfg else self.up_cooldown_s
+        self.down_cooldown_s = cfg['scale_down_cooldown_s'] if 'scale_down_cooldown_s' in cfg else self.down_cooldown_s
+
+    def decide(self, at_time, workers, depth, lag_s=0.0, rate=0.0):
+        """
+        @param at_time: epoch now
+        @param workers: current number of workers
+        @param depth: work queue length
+        @param lag_s: processing lag, time the oldest item waited past its due time
+        @param rate: pool throughput, items per second, 0 if unknown
+        @return: 1 to start a worker, -1 to retire a worker, 0 to keep the pool
+        """
+        workers = max(workers, 1)
+        drain_s = depth / rate if rate else 0.0
+
+        if depth > self.up_depth * workers or lag_s > self.up_lag_s or drain_s > self.up_drain_s:
+            self.idle_since = None
+            if at_time - self.scaled_at < self.up_cooldown_s:
+                return 0
+            self.scaled_at = at_time
+            return 1
+
+        if depth > self.down_depth * workers or lag_s > self.up_lag_s / 2.0:
+            # hysteresis band, keep the pool
+            self.idle_since = None
+            return 0
+
+        # pool must stay idle for the whole cooldown before retiring a worker
+        if self.idle_since is None:
+            self.idle_since = at_time
+        if at_time - max(self.idle_since, self.scaled_at) < self.down_cooldown_s:
+            return 0
+
+        self.scaled_at = at_time
+        self.idle_since = None
+        return -1
+
+
 class ServiceBase(Pubsub):
     def __init__(self, logger, name, data, provider_names, config_path, dummy=False):
         """
@@ -23,11 +88,16 @@ class ServiceBase(Pubsub):
         self.dummy = dummy
         self.provider_names = provider_names
         self.config_path = config_path
-        self.workers = dict()
+        # in start order
+        self.workers = OrderedDict()
+        # workers sent the exit message, still finishing their work
+        self.retiring = dict()
+        self.worker_seq = 0
         # number of worker processes
         self.workers_min = 1
         # max number of worker process
         self.workers_max = 1
+        self.scaler = WorkerScaler()
 
     def run(self, *args, **kwargs):
         pass
@@ -46,7 +116,8 @@ class ServiceBase(Pubsub):
             self.logger.warning('Max workers reached [{0}]'.format(len(self.workers)))
             return False
 
-        sub_name = '{0}.{1:03}P'.format(self.name, len(self.workers))
+        sub_name = '{0}.{1:03}P'.format(self.name, self.worker_seq)
+        self.worker_seq += 1
         self.data.register_poller(sub_name)
         self.logger.info('Starting worker: {0}'.format(sub_name))
         p = self.get_worker(sub_name)
@@ -69,3 +140,41 @@ class ServiceBase(Pubsub):
         p = self.workers.popitem()
         self._stop_worker(p)
         return True
+
+    def retire_worker(self):
+        """
+        Sends exit message to the most recent worker without waiting for it, see reap_workers()
+        """
+        if len(self.workers) <= self.workers_min:
+            return False
+
+        name = next(reversed(self.workers))
+        self.logger.info('Retiring worker: {0}...'.format(name))
+        self.retiring[name] = self.workers.pop(name)
+        self.data.unregister_poller(name)
+        self.send_exit(S1.poller_channel_name(name))
+        return True
+
+    def reap_workers(self):
+        """
+        Joins retired workers which finished their work
+        """
+        for name, p in self.retiring.items():
+            if not p.is_alive():
+                p.join()
+                del self.retiring[name]
+                self.logger.info('Worker retired: {0}'.format(name))
+
+    def autoscale(self, at_time, depth, lag_s=0.0, rate=0.0):
+        """
+        Starts or retires one worker as decided by the scaler
+        """
+        self.reap_workers()
+        decision = self.scaler.decide(at_time, len(self.workers), depth, lag_s, rate)
+        if decision > 0 and len(self.workers) < self.workers_max:
+            self.logger.warning('Scale up, depth [{0}], lag [{1:.1f}]s, rate [{2:.2f}]/s'.format(depth, lag_s, rate))
+            return self.start_worker()
+        elif decision < 0 and len(self.workers) > self.workers_min:
+            self.logger.warning('Scale down, depth [{0}], lag [{1:.1f}]s, rate [{2:.2f}]/s'.format(depth, lag_s, rate))
+            return self.retire_worker()
+        return False
@@ -0,0 +1,41 @@
+"""
+Cached activities codec benchmark on the svc/data activities documents
+run from svc: python -m tests.bench_codec [data path] [rounds]
+"""
+import glob
+import json
+import os
+import sys
+import timeit
+
+from core.codec import Codec
+
+
+def bench(docs, rounds):
+    print '{0:<14}{1:>12}{2:>8}{3:>14}{4:>14}'.format('codec', 'bytes', 'ratio', 'encode ms', 'decode ms')
+    raw = sum(len(Codec.encode(doc, Codec.JSON)) for doc in docs)
+    for name, version in sorted([(n, v) for n, v in vars(Codec).iteritems() if n.isupper() and isinstance(v, int) and v in Codec.CODECS],
+                                key=lambda x: x[1]):
+        values = [Codec.encode(doc, version) for doc in docs]
+        assert [Codec.decode(value) for value in values] == docs
+        size = sum(len(value) for value in values)
+        encode_s = timeit.timeit(lambda: [Codec.encode(doc, version) for doc in docs], number=rounds)
+        decode_s = timeit.timeit(lambda: [Codec.decode(value) for value in values], number=rounds)
+        print '{0:<14}{1:>12}{2:>8.2f}{3:>14.3f}{4:>14.3f}'.format(name, size, size / float(raw),
+                                                                  1000.0 * encode_s / rounds / len(docs),
+                                                                  1000.0 * decode_s / rounds / len(docs))
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '..', 'data')
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    documents = []
+    for file_name in sorted(glob.glob(os.path.join(path, '*.json'))):
+        try:
+            doc = json.load(open(file_name))
+        except ValueError:
+            continue
+        if isinstance(doc, dict) and doc.get('kind') == 'plus#activityFeed':
+            documents.append(doc)
+    print '{0} documents, {1} rounds, per document:'.format(len(documents), rounds)
+    bench(documents, rounds)
@@ -0,0 +1,60 @@
+"""
+Activities timestamp parser benchmark on the svc/data activities documents
+run from svc: python -m tests.bench_timestamp [data path] [rounds]
+"""
+import glob
+import json
+import os
+import sys
+import timeit
+
+from providers.google_rss import GoogleRSS
+
+
+def collect(doc, stamps):
+    """ gathers updated and published timestamps of the document """
+    if isinstance(doc, dict):
+        for key, value in doc.iteritems():
+            if key in ('updated', 'published') and isinstance(value, basestring):
+                stamps.append(value)
+            else:
+                collect(value, stamps)
+    elif isinstance(doc, list):
+        for value in doc:
+            collect(value, stamps)
+
+
+def bench(stamps, rounds):
+    assert [GoogleRSS.get_timestamp(s) for s in stamps] == [GoogleRSS.get_timestamp_slow(s) for s in stamps]
+
+    def fast_cold():
+        GoogleRSS.timestamp_memo.clear()
+        for s in stamps:
+            GoogleRSS.get_timestamp(s)
+
+    def fast_memo():
+        for s in stamps:
+            GoogleRSS.get_timestamp(s)
+
+    def slow():
+        for s in stamps:
+            GoogleRSS.get_timestamp_slow(s)
+
+    print '{0:<12}{1:>14}{2:>10}'.format('parser', 'us/timestamp', 'speedup')
+    base = timeit.timeit(slow, number=rounds)
+    for name, run in [('dateutil', slow), ('fast', fast_cold), ('fast+memo', fast_memo)]:
+        elapsed = timeit.timeit(run, number=rounds)
+        print '{0:<12}{1:>14.2f}{2:>10.1f}'.format(name, 1e6 * elapsed / rounds / len(stamps), base / elapsed)
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '..', 'data')
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    timestamps = []
+    for file_name in sorted(glob.glob(os.path.join(path, '*.json'))):
+        try:
+            collect(json.load(open(file_name)), timestamps)
+        except ValueError:
+            continue
+    print '{0} timestamps, {1} rounds:'.format(len(timestamps), rounds)
+    bench(timestamps, rounds)
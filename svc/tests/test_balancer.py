@@ -0,0 +1,110 @@
+import unittest
+import logging
+from mock import MagicMock
+from core.balancer import Balancer
+
+
+class TestBalancer(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        self.logger = logging.getLogger(__name__)
+        self.logger.level = logging.NOTSET
+        self.balancer = Balancer(self.logger, MagicMock(), MagicMock(), shards=16)
+
+    def test_single_shard_is_legacy_set(self):
+        balancer = Balancer(self.logger, MagicMock(), MagicMock(), shards=1)
+        self.assertEquals(balancer.gid_set_key('100179705036605636374'), 'poller:all:gid.set')
+
+    def test_shard_of(self):
+        gids = [str(100179705036605636374 + n) for n in range(0, 1000)]
+        shards = [self.balancer.shard_of(gid) for gid in gids]
+        self.assertEquals(shards, [self.balancer.shard_of(gid) for gid in gids])
+        self.assertEquals(set(shards), set(range(0, 16)))
+        self.assertEquals(self.balancer.gid_set_key(gids[0]), 'poller:all.{0}:gid.set'.format(shards[0]))
+
+    def test_assign_shards(self):
+        masters = ['poller-a', 'poller-b', 'poller-c']
+        owned = {m: self.balancer.assign_shards(m, masters) for m in masters}
+        # every shard has exactly one owner
+        self.assertEquals(sorted(sum(owned.values(), [])), range(0, 16))
+
+        # only shards of the leaving master move
+        remaining = ['poller-a', 'poller-c']
+        for m in remaining:
+            self.assertTrue(set(owned[m]).issubset(self.balancer.assign_shards(m, remaining)))
+
+    def test_assign_shards_no_masters(self):
+        self.assertEquals(self.balancer.assign_shards('poller-a', []), [])
+
+    def test_lease_shards(self):
+        self.balancer.lease_script = MagicMock(return_value=[5, 0, 0])
+        self.assertEquals(self.balancer.lease_shards('poller-a', [1, 2], [3], 10), {1: 5})
+        self.balancer.lease_script.assert_called_once_with(
+            keys=['poller:shard.1:lease', 'poller:shard.1:fence', 'poller:shard.2:lease', 'poller:shard.2:fence',
+                  'poller:shard.3:lease', 'poller:shard.3:fence'],
+            args=['poller-a', 10000, 1, 1, 0])
+
+    def test_claim_fenced(self):
+        self.balancer.claim_script = MagicMock(return_value=None)
+        self.assertIsNone(self.balancer.claim_next_poll_set(1, 100, 200, owner='poller-a', token=5))
+        self.balancer.claim_script.assert_called_once_with(
+            keys=['poller:shard.1:lease', 'poller:shard.1:fence', 'poller:all.1:gid.set'], args=['poller-a', 5, 100, 200, 200])
+        self.balancer.claim_script = MagicMock(return_value=['1', '90', '2', '95.5'])
+        self.assertEquals(self.balancer.claim_next_poll_set(1, 100, 200), [('1', 90.0), ('2', 95.5)])
+
+    def test_spread_due(self):
+        self.balancer.spread_script = MagicMock(return_value=5)
+        self.balancer.spread_due(1, 1000, 1000, 600, owner='poller-a', token=5)
+        self.balancer.spread_script.assert_called_once_with(
+            keys=['poller:shard.1:lease', 'poller:shard.1:fence', 'poller:all.1:gid.set', 'poller:shard.1:priority.set'],
+            args=['poller-a', 5, 1000, 1000, 600])
+
+    def test_set_priority_bulk(self):
+        pipe = self.balancer.rc.pipeline.return_value
+        gids = [str(100179705036605636374 + n) for n in range(0, 3)]
+        self.balancer.set_priority_bulk({gids[0]: True, gids[1]: False, gids[2]: True})
+        for gid, call in ((gids[0], pipe.sadd), (gids[1], pipe.srem), (gids[2], pipe.sadd)):
+            self.assertTrue(any(c[0][0] == 'poller:shard.{0}:priority.set'.format(self.balancer.shard_of(gid)) and gid in c[0][1:]
+                                for c in call.call_args_list))
+        pipe.execute.assert_called_once_with()
+
+    def test_dispatch_gids(self):
+        self.balancer.dispatch_script = MagicMock(return_value=[2, 1])
+        pushed, skipped = self.balancer.dispatch_gids('poller:a:work', 'update', [('1', 100.5), ('2', 0), ('3', 90)], 1000, 600, 10)
+        self.assertEquals((pushed, skipped), (2, 1))
+        self.balancer.dispatch_script.assert_called_once_with(
+            keys=['poller:all:queued.zset', 'poller:a:work', 'poller:a:work:queued'],
+            args=[1000, 400, 10, '~M~update/', '1', 100, '2', 0, '3', 90])
+
+        self.balancer.dispatch_script.reset_mock()
+        self.assertEquals(self.balancer.dispatch_gids('poller:a:work', 'update', [], 1000, 600, 10), (0, 0))
+        self.assertFalse(self.balancer.dispatch_script.called)
+
+    def test_queued_depth(self):
+        pipe = self.balancer.rc.pipeline.return_value
+        pipe.execute.return_value = [3, '25']
+        self.assertEquals(self.balancer.queued_depth('poller:a:work', 10), 25)
+        pipe.get.assert_called_once_with('poller:a:work:queued')
+        # count left behind by a dead worker
+        pipe.execute.return_value = [0, '7']
+        self.assertEquals(self.balancer.queued_depth('poller:a:work', 10), 0)
+        pipe.execute.return_value = [2, None]
+        self.assertEquals(self.balancer.queued_depth('poller:a:work', 10), 2)
+
+    def test_dequeue_gids(self):
+        pipe = self.balancer.rc.pipeline.return_value
+        self.balancer.dequeue_gids(['1', '2'], 'poller:a:work')
+        pipe.zrem.assert_called_once_with('poller:all:queued.zset', '1', '2')
+        pipe.decr.assert_called_once_with('poller:a:work:queued', 2)
+
+    def test_retry_backoff(self):
+        pipe = self.balancer.rc.pipeline.return_value
+        pipe.execute.return_value = [1, 3, 30]
+        retry_at = self.balancer.retry_gids(['1', '2', '3'], 1000, 30, 600)
+        self.assertTrue(1015 <= retry_at['1'] <= 1030)
+        self.assertTrue(1060 <= retry_at['2'] <= 1120)
+        self.assertTrue(1300 <= retry_at['3'] <= 1600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import logging
+from mock import MagicMock
+from core.breaker import CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        self.logger = logging.getLogger(__name__)
+        self.logger.level = logging.NOTSET
+        self.rc = MagicMock()
+        self.breaker = CircuitBreaker(self.logger, self.rc, 'google', window_s=60, min_calls=20, error_rate=0.5, open_s=60)
+        self.breaker.trip = MagicMock()
+
+    def record(self, ok, failed):
+        self.rc.pipeline.return_value.execute.return_value = [ok, failed, True]
+        return self.breaker.record(1000, 0, 0)
+
+    def test_no_trip_below_min_calls(self):
+        self.assertFalse(self.record(0, 19))
+        self.assertFalse(self.breaker.trip.called)
+
+    def test_no_trip_below_error_rate(self):
+        self.assertFalse(self.record(11, 10))
+
+    def test_trip(self):
+        self.assertTrue(self.record(10, 10))
+        self.breaker.trip.assert_called_once_with(1000)
+
+    def test_probe(self):
+        self.breaker.record_probe(1000, False)
+        self.breaker.trip.assert_called_once_with(1000)
+
+        self.breaker.record_probe(1000, True)
+        self.rc.delete.assert_called_once_with('breaker:google:half', 'breaker:google:probe', 'breaker:google:w.16')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import logging
+from array import array
+from mock import MagicMock
+from core.cache import Cache
+from core.codec import Codec
+from utils import config
+
+
+def make_item(n, etag='e'):
+    stamp = '2016-03-01T10:{0:02d}:00.000Z'.format(n)
+    return {'id': str(n), 'etag': etag, 'updated': stamp, 'published': stamp}
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        logger = logging.getLogger(__name__)
+        logger.level = logging.NOTSET
+        self.rc = MagicMock()
+        self.cache = Cache(logger, self.rc)
+
+    def test_unpack_activity_map_short(self):
+        # BITFIELD allocates only up to the highest counter written
+        activity_map = Cache.unpack_activity_map('\x00\x01\x01\x00')
+        self.assertEquals(len(activity_map), Cache.ACTIVITY_MAP_SLOTS)
+        self.assertEquals(activity_map[0], 1)
+        self.assertEquals(activity_map[1], 256)
+        self.assertEquals(sum(activity_map), 257)
+
+    def test_unpack_activity_map_empty(self):
+        activity_map = Cache.unpack_activity_map(None)
+        self.assertEquals(len(activity_map), Cache.ACTIVITY_MAP_SLOTS)
+        self.assertEquals(sum(activity_map), 0)
+
+    def test_pack_activity_map(self):
+        activity_map = array('H', [0] * Cache.ACTIVITY_MAP_SLOTS)
+        activity_map[3] = 7
+        activity_map[1439] = 65535
+        raw = Cache.pack_activity_map(activity_map)
+        self.assertEquals(len(raw), 2 * Cache.ACTIVITY_MAP_SLOTS)
+        self.assertEquals(raw[6:8], '\x00\x07')
+        self.assertEquals(Cache.unpack_activity_map(raw), activity_map)
+
+    def test_activity_map_window(self):
+        activity_map = array('H', [0] * Cache.ACTIVITY_MAP_SLOTS)
+        activity_map[0] = 1
+        activity_map[100] = 2
+        activity_map[1439] = 4
+        self.assertEquals(Cache.activity_map_window(activity_map, 100, 0), 2)
+        self.assertEquals(Cache.activity_map_window(activity_map, 100, 99), 2)
+        self.assertEquals(Cache.activity_map_window(activity_map, 100, 100), 3)
+        # wraps around midnight both ways
+        self.assertEquals(Cache.activity_map_window(activity_map, 5, 10), 5)
+        self.assertEquals(Cache.activity_map_window(activity_map, 1435, 10), 5)
+        self.assertEquals(Cache.activity_map_window(activity_map, 700, 720), 7)
+
+    def test_incr_num_minute_updates_bulk(self):
+        self.cache.incr_num_minute_updates_bulk('1', [60, 61, 86400 + 119, 3600])
+        args = self.rc.execute_command.call_args[0]
+        self.assertEquals(args[:4], ('BITFIELD', 'cache:map:1', 'OVERFLOW', 'SAT'))
+        ops = {args[n + 2]: args[n + 3] for n in range(4, len(args), 4)}
+        self.assertEquals(ops, {'#1': 3, '#60': 1})
+
+    def test_get_num_minute_updates(self):
+        self.rc.get.return_value = '\x00\x00\x00\x02\x00\x03'
+        self.assertEquals(self.cache.get_num_minute_updates('1', 60, 0), 2)
+        self.assertEquals(self.cache.get_num_minute_updates('1', 60, 1), 5)
+        self.rc.get.assert_called_with('cache:map:1')
+
+    def test_cache_changed_items(self):
+        pipe = self.rc.pipeline.return_value
+        pipe.execute.side_effect = [[['e', None, 'old'], ['1', '3']], [1, 1, True, True, 1, 1, 12]]
+        doc = {'etag': 'doc', 'updated': '2016-03-01T10:03:00.000Z', 'items': [make_item(1), make_item(2), make_item(3)]}
+
+        self.assertEquals(self.cache.cache_activities_doc('100', doc), 2)
+        pipe.hmget.assert_called_once_with('cache:etags:100', ['1', '2', '3'])
+        # 2016-03-01T10:01:00Z to 10:03:00Z
+        pipe.zrangebyscore.assert_called_once_with('cache:updated:100', 1456826460, 1456826580)
+        self.assertFalse(pipe.zrem.called)
+        self.assertEquals(Codec.decode(pipe.hset.call_args[0][2]), {'etag': 'doc', 'updated': '2016-03-01T10:03:00.000Z'})
+        self.assertEquals(sorted(pipe.hmset.call_args_list[0][0][1].keys()), ['2', '3'])
+        self.assertEquals(pipe.hmset.call_args_list[1][0], ('cache:etags:100', {'2': 'e', '3': 'e'}))
+        self.assertEquals(pipe.zadd.call_count, 2)
+        self.assertFalse(self.rc.zrange.called)
+
+    def test_cache_trims(self):
+        pipe = self.rc.pipeline.return_value
+        pipe.execute.side_effect = [[['e'], ['5']], [1, 1, config.DEFAULT_MAX_RESULTS_CACHE + 2], []]
+        self.rc.zrange.return_value = ['1', '2']
+        self.assertEquals(self.cache.cache_activities_doc('100', {'items': [make_item(5)]}), 0)
+        self.rc.zrange.assert_called_once_with('cache:updated:100', 0, -config.DEFAULT_MAX_RESULTS_CACHE - 1)
+        pipe.zrem.assert_called_once_with('cache:updated:100', '1', '2')
+
+    def test_cache_removes_deleted(self):
+        # item 2 was deleted upstream, item 0 is older than the page
+        pipe = self.rc.pipeline.return_value
+        pipe.execute.side_effect = [[['e', 'e'], ['1', '2', '3']], [1, 1, True, 1, 1, 1, 3]]
+        doc = {'etag': 'doc', 'items': [make_item(3), make_item(1)]}
+
+        self.assertEquals(self.cache.cache_activities_doc('100', doc), 1)
+        pipe.zrem.assert_called_once_with('cache:updated:100', '2')
+        pipe.hdel.assert_any_call('cache:items:100', '2')
+        pipe.hdel.assert_any_call('cache:etags:100', '2')
+        self.assertFalse(pipe.hmset.called)
+
+    def test_get_updated_since(self):
+        pipe = self.rc.pipeline.return_value
+        pipe.execute.return_value = [True, ['3', '2']]
+        self.rc.hmget.return_value = [Codec.encode(make_item(3)), Codec.encode(make_item(2))]
+        self.assertEquals([item['id'] for item in self.cache.get_updated_since('100', 1000)], ['2', '3'])
+        pipe.zrangebyscore.assert_called_once_with('cache:updated:100', '(1000', '+inf')
+
+    def test_get_updated_since_legacy(self):
+        pipe = self.rc.pipeline.return_value
+        pipe.execute.return_value = [False, []]
+        self.rc.hget.return_value = Codec.encode({'items': [make_item(3), make_item(2), make_item(1)]}, Codec.JSON)
+        # 2016-03-01T10:01:00Z
+        items = self.cache.get_updated_since('100', 1456826460)
+        self.assertEquals([item['id'] for item in items], ['2', '3'])
+
+    def test_get_activities(self):
+        self.rc.hmget.side_effect = [[Codec.encode({'etag': 'doc'}), None], [Codec.encode(make_item(3))]]
+        self.rc.zrevrange.return_value = ['3']
+        self.assertEquals(self.cache.get_activities('100'), {'etag': 'doc', 'items': [make_item(3)]})
+        self.rc.zrevrange.assert_called_once_with('cache:updated:100', 0, config.DEFAULT_MAX_RESULTS - 1)
+
+    def load_lru(self, etag, items):
+        self.rc.hget.return_value = etag
+        pipe = self.rc.pipeline.return_value
+        pipe.execute.return_value = [Codec.encode({'etag': etag}),
+                                     [(item['id'], 1456826400 + 60 * int(item['id'])) for item in items],
+                                     {item['id']: Codec.encode(item) for item in items}]
+        return pipe
+
+    def test_lru_hit(self):
+        self.cache.enable_lru(1 << 20)
+        pipe = self.load_lru('doc', [make_item(3), make_item(2), make_item(1)])
+        for _ in range(2):
+            # 2016-03-01T10:01:00Z
+            meta, items = self.cache.get_activities_since('100', 1456826460)
+            self.assertEquals(meta, {'etag': 'doc'})
+            self.assertEquals([item['id'] for item in items], ['2', '3'])
+        self.assertEquals(pipe.execute.call_count, 1)
+        self.assertEquals((self.cache.lru.hits, self.cache.lru.misses), (1, 1))
+
+        # copies are independent
+        items[0]['content'] = 'changed'
+        self.assertNotIn('content', self.cache.get_activities_since('100', 0)[1][0])
+
+    def test_lru_etag_changed(self):
+        self.cache.enable_lru(1 << 20)
+        self.load_lru('doc', [make_item(1)])
+        self.cache.get_activities_since('100', 0)
+        pipe = self.load_lru('doc2', [make_item(2), make_item(1)])
+        meta, items = self.cache.get_activities_since('100', 0)
+        self.assertEquals(meta, {'etag': 'doc2'})
+        self.assertEquals([item['id'] for item in items], ['1', '2'])
+        self.assertEquals(pipe.execute.call_count, 2)
+        self.assertEquals(len(self.cache.lru.entries), 1)
+
+    def test_lru_evicts(self):
+        self.cache.enable_lru(1 << 20)
+        self.load_lru('doc', [make_item(1)])
+        self.cache.get_activities_since('100', 0)
+        self.cache.lru.max_bytes = self.cache.lru.size * 2 - 1
+        self.cache.get_activities_since('200', 0)
+        self.assertEquals(self.cache.lru.entries.keys(), ['200'])
+        self.assertLessEqual(self.cache.lru.size, self.cache.lru.max_bytes)
+
+    def test_lru_no_etag(self):
+        self.cache.enable_lru(1 << 20)
+        self.rc.hget.return_value = None
+        self.rc.hmget.return_value = [None, None]
+        pipe = self.rc.pipeline.return_value
+        pipe.execute.return_value = [False, []]
+        self.assertEquals(self.cache.get_activities_since('100', 0), (None, []))
+        self.assertFalse(self.cache.lru.entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import json
+import os
+from core.codec import Codec
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self):
+        self.doc = json.load(open(os.path.join(os.path.dirname(__file__), '..', 'data', 'plus_sample.json')))
+
+    def test_round_trip(self):
+        for version in Codec.CODECS.iterkeys():
+            value = Codec.encode(self.doc, version)
+            self.assertEquals(Codec.version_of(value), version)
+            self.assertEquals(Codec.decode(value), self.doc)
+
+    def test_legacy_json(self):
+        value = json.dumps(self.doc, encoding='utf-8')
+        self.assertEquals(Codec.version_of(value), Codec.JSON)
+        self.assertEquals(Codec.decode(value), self.doc)
+        self.assertEquals(Codec.encode(self.doc, Codec.JSON), value)
+
+    def test_compressed(self):
+        self.assertLess(len(Codec.encode(self.doc)), len(Codec.encode(self.doc, Codec.JSON)) / 2)
+
+    def test_empty(self):
+        self.assertIsNone(Codec.decode(None))
+        self.assertIsNone(Codec.decode(''))
+
+
+if __name__ == '__main__':
+    unittest.main()
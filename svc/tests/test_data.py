@@ -0,0 +1,71 @@
+import unittest
+import logging
+from mock import patch, MagicMock
+from core import Data
+from utils import config
+
+
+class TestData(unittest.TestCase):
+    @patch('redis.Redis')
+    def setUp(self, rc):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        self.logger = logging.getLogger(__name__)
+        self.logger.level = logging.NOTSET
+        self.data = Data(self.logger, 'localhost', 6379, 0)
+        self.data.rc = MagicMock()
+        self.data.remove_from_poller_bulk = MagicMock()
+
+    def test_check_orphans(self):
+        at_time = 10 * config.DEFAULT_ORPHANED_TIMEOUT
+        expired = str(at_time - config.DEFAULT_ORPHANED_TIMEOUT)
+        recent = str(at_time - 1)
+        self.data.rc.pipeline.return_value.execute.return_value = [
+            expired, None,
+            expired, 'twitter',
+            recent, None,
+            None, None]
+
+        orphans = self.data.check_orphans(['1', '2', '3', '4'], at_time)
+        self.assertEquals(orphans, {'1'})
+        self.data.remove_from_poller_bulk.assert_called_once_with(['1'])
+
+    def test_check_orphans_unbound(self):
+        self.data.rc.pipeline.return_value.execute.return_value = [None, None, None, 'twitter']
+        self.assertEquals(self.data.check_orphans(['1', '2'], 0), {'1'})
+
+    def test_source_limits(self):
+        pipe = self.data.rc.pipeline.return_value
+        # child source linked to two accounts, account with own plan
+        pipe.execute.side_effect = [[None, 'a1,a2', 'M1', None], ['S2', None]]
+        self.assertEquals(self.data.get_source_limits_bulk(['child', 'a1']), [[None, 'S2', None], ['M1']])
+        pipe.hget.assert_any_call('bind:parents', 'child')
+        pipe.hget.assert_called_with('gid:a2', 'lmts')
+
+    def test_service_query(self):
+        ticket = self.data.begin_validate_gid('name')
+        request = self.data.rc.lpush.call_args[0][1]
+        self.assertTrue(request.startswith(ticket + ':'))
+        self.assertTrue(request.endswith(':name'))
+
+        # expired request is dropped
+        self.data.rc.lpop.side_effect = ['old:100:stale', request, None]
+        self.assertEquals(self.data.get_service_query('qry.validate.in', 1000), (ticket, 'name'))
+        self.data.rc.lpop.side_effect = ['old:100:stale', None]
+        self.assertIsNone(self.data.get_service_query('qry.validate.in', 1000))
+
+    def test_service_reply(self):
+        self.data.reply_service_query('t1', 'validate', '100')
+        pipe = self.data.rc.pipeline.return_value
+        pipe.rpush.assert_called_once_with('qry.validate.out:t1', '100')
+        pipe.expire.assert_called_once_with('qry.validate.out:t1', Data.QUERY_REPLY_TTL_S)
+
+        self.data.rc.lpop.return_value = '100'
+        self.assertEquals(self.data.get_validate_gid('t1'), '100')
+        self.data.rc.lpop.assert_called_with('qry.validate.out:t1')
+        self.data.rc.blpop.return_value = None
+        self.assertIsNone(self.data.get_validate_gid('t1', timeout_s=2))
+        self.data.rc.blpop.assert_called_once_with('qry.validate.out:t1', 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
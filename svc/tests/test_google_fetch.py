@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+import logging
+from mock import MagicMock, patch
+from providers.google_fetch import GoogleFetch
+
+
+class TestGoogleFetch(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        self.logger = logging.getLogger(__name__)
+        self.logger.level = logging.NOTSET
+        self.config_path = tempfile.mkdtemp()
+        with patch('providers.google_fetch.ServiceAccountCredentials'), patch('providers.google_fetch.Storage'):
+            self.fetch = GoogleFetch(self.logger, self.config_path)
+        self.fetch.refresh_http = MagicMock()
+        self.fetch.refresh_http.request.return_value = (MagicMock(status=200), '{"name": "plus"}')
+
+    def tearDown(self):
+        shutil.rmtree(self.config_path)
+
+    def test_discovery_doc_cached(self):
+        self.assertEquals(self.fetch.get_discovery_doc(), '{"name": "plus"}')
+        self.assertEquals(self.fetch.get_discovery_doc(), '{"name": "plus"}')
+        self.assertEquals(self.fetch.refresh_http.request.call_count, 1)
+        self.assertEquals(os.listdir(self.config_path), [GoogleFetch.DISCOVERY_DOC])
+
+    @patch('providers.google_fetch.discovery.build_from_document')
+    def test_service_built_once(self, build):
+        self.fetch.credentials.access_token_expired = False
+        self.fetch.authorize()
+        self.fetch.authorize()
+        self.assertEquals(build.call_count, 1)
+        self.assertFalse(self.fetch.credentials.refresh.called)
+
+        self.fetch.credentials.access_token_expired = True
+        self.fetch.authorize()
+        self.assertEquals(build.call_count, 1)
+        self.fetch.credentials.refresh.assert_called_once_with(self.fetch.refresh_http)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import logging
+from mock import MagicMock, patch
+from providers.google_fetch import GoogleFetch, GoogleFetchQuota
+from providers.google_poll import GooglePollAgent
+from providers.google_rss import GoogleRSS
+
+
+def make_doc(minutes):
+    stamp = '2016-03-01T10:{0:02d}:00.000Z'
+    return {'items': [{'id': str(m), 'updated': stamp.format(m), 'published': stamp.format(m)} for m in minutes]}
+
+
+class TestGooglePollAgent(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        self.logger = logging.getLogger(__name__)
+        self.logger.level = logging.NOTSET
+        self.data = MagicMock()
+        self.data.cache.get_gid_max_results.return_value = 20
+        self.data.get_destination_param.return_value = '"etag-1"'
+        with patch('providers.google_poll.GoogleFetch'), patch('providers.google_poll.BitlyShorten'):
+            self.agent = GooglePollAgent(self.logger, self.data, '.')
+
+    def test_not_modified(self):
+        self.data.cache.get_poll_stamp.return_value = 1000.0
+        self.agent.google_fetch.get_activities.return_value = GoogleFetch.NOT_MODIFIED
+
+        self.assertTrue(self.agent.poll('100'))
+        self.assertEquals(self.agent.last_outcome, 'ok')
+        self.agent.google_fetch.get_activities.assert_called_once_with('100', 20, '"etag-1"')
+        self.assertEquals(self.data.cache.set_poll_stamp.call_args[0][0], '100')
+        self.assertFalse(self.data.set_destination_param.called)
+        self.assertFalse(self.data.cache.set_changed.called)
+
+    def test_unconditional_after_poll_reset(self):
+        self.data.cache.get_poll_stamp.return_value = 0
+        self.agent.google_fetch.get_activities.return_value = None
+
+        self.assertTrue(self.agent.poll('100'))
+        self.assertEquals(self.agent.last_outcome, 'empty')
+        self.agent.google_fetch.get_activities.assert_called_once_with('100', 20, None)
+
+    def test_quota_outcome(self):
+        self.data.cache.get_poll_stamp.return_value = 1000.0
+        self.agent.google_fetch.get_activities.side_effect = GoogleFetchQuota()
+        self.assertFalse(self.agent.poll('100'))
+        self.assertEquals(self.agent.last_outcome, 'quota')
+
+        self.agent.google_fetch.get_activities.side_effect = None
+        self.agent.google_fetch.get_activities.return_value = None
+        self.assertTrue(self.agent.poll('100'))
+        self.assertEquals(self.agent.last_outcome, 'empty')
+
+    def test_burst_refetch(self):
+        self.data.cache.get_poll_stamp.return_value = 1000.0
+        self.data.cache.get_gid_max_results.return_value = '4'
+        # last update at 10:00, a full page of newer items
+        self.data.get_destination_update.return_value = GoogleRSS.get_timestamp('2016-03-01T10:00:00.000Z')
+        self.agent.google_fetch.get_activities.side_effect = [make_doc([4, 3, 2, 1]), make_doc(range(8, 0, -1) + [0])]
+
+        doc = self.agent.fetch('100')
+        self.assertEquals(len(doc['items']), 9)
+        self.agent.google_fetch.get_activities.assert_called_with('100', 8)
+        self.data.cache.set_gid_max_results.assert_called_once_with('100', 8)
+
+    def test_fit_max_results(self):
+        self.data.cache.get_gid_max_results.return_value = '20'
+        self.agent.fit_max_results('100', 0)
+        self.data.cache.set_gid_max_results.assert_called_with('100', 15)
+
+        self.data.cache.get_gid_max_results.return_value = '4'
+        self.agent.fit_max_results('100', 0)
+        self.data.cache.set_gid_max_results.assert_called_with('100', 3)
+
+        self.data.cache.get_gid_max_results.return_value = '3'
+        self.agent.fit_max_results('100', 5)
+        self.data.cache.set_gid_max_results.assert_called_with('100', 12)
+
+        self.data.cache.set_gid_max_results.reset_mock()
+        self.data.cache.get_gid_max_results.return_value = '12'
+        self.agent.fit_max_results('100', 5)
+        self.assertFalse(self.data.cache.set_gid_max_results.called)
+
+    def test_changed_by_items(self):
+        # page etag changed with max results, items did not
+        self.data.get_gid_shorten_urls.return_value = False
+        self.data.get_destination_update.return_value = GoogleRSS.get_timestamp('2016-03-01T10:04:00.000Z')
+        doc = dict(make_doc([4, 3, 2]), etag='"etag-2"', updated='2016-03-01T10:04:00.000Z')
+        self.data.cache.cache_activities_doc.return_value = 0
+        self.agent.process_activities_doc('100', doc)
+        self.data.set_destination_param.assert_called_once_with('100', 'cache', '100', 'etag', '"etag-2"')
+        self.assertFalse(self.data.cache.set_changed.called)
+        self.assertFalse(self.data.flush_updates.called)
+
+        doc = dict(make_doc([5, 4, 3]), etag='"etag-3"', updated='2016-03-01T10:05:00.000Z')
+        self.data.cache.cache_activities_doc.return_value = 1
+        self.agent.process_activities_doc('100', doc)
+        self.assertTrue(self.data.cache.set_changed.called)
+        self.data.flush_updates.assert_called_once_with('100')
+
+
+class TestGoogleRSSFields(unittest.TestCase):
+    def test_fields_projection(self):
+        fields = ['etag', ('items', ['id', ('object', ['url', ('image', ['url'])])])]
+        self.assertEquals(GoogleRSS.fields_projection(fields), 'etag,items(id,object(url,image(url)))')
+        self.assertTrue(GoogleRSS.fields_projection().startswith('etag,updated,items(id,etag,url,'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import copy
+import json
+import os
+from core.codec import Codec
+from providers.google_rss import Activity, GoogleRSS
+
+
+class TestGoogleRSSNormalize(unittest.TestCase):
+    def setUp(self):
+        doc = json.load(open(os.path.join(os.path.dirname(__file__), '..', 'data', 'plus_sample.json')))
+        self.items = doc['items']
+
+    def test_same_as_raw(self):
+        for raw in self.items:
+            item = Activity(Codec.decode(Codec.encode(GoogleRSS.normalize(copy.deepcopy(raw)))))
+            self.assertEquals(item.updated, GoogleRSS.get_item_updated_stamp(raw))
+            self.assertEquals(item.published, GoogleRSS.get_item_published_stamp(raw))
+            self.assertEquals(item.object_type, GoogleRSS.get_object_type(raw))
+            self.assertEquals(item.long_urls, GoogleRSS.get_long_urls(raw))
+            self.assertEquals(item.tags, GoogleRSS.get_tags(raw))
+            self.assertEquals(item.full_image_url, GoogleRSS.get_full_image_url(raw))
+            self.assertEquals(GoogleRSS.process_item(item), GoogleRSS.process_item(raw))
+            self.assertEquals(GoogleRSS.get_description(item), GoogleRSS.get_description(raw))
+
+    def test_description_setter(self):
+        item = GoogleRSS.normalize(copy.deepcopy(self.items[0]))
+        GoogleRSS.set_description_raw(item, u'stripped #tag')
+        self.assertEquals(GoogleRSS.get_description_raw(item), u'stripped #tag')
+        self.assertIn(u'tag', GoogleRSS.get_tags(item))
+        # other fields are kept
+        self.assertEquals(GoogleRSS.get_item_updated_stamp(item), item[GoogleRSS.NORMALIZED]['updated'])
+
+    def test_malformed(self):
+        item = GoogleRSS.normalize({'id': '1', 'updated': '2016-03-01T10:00:00.000Z'})
+        self.assertEquals(GoogleRSS.get_item_updated_stamp(item), 1456826400)
+        self.assertNotIn('urls', item[GoogleRSS.NORMALIZED])
+        self.assertRaises(KeyError, GoogleRSS.get_long_urls, item)
+
+
+class TestGoogleRSSTimestamp(unittest.TestCase):
+    def setUp(self):
+        GoogleRSS.timestamp_memo.clear()
+
+    def test_fast_path(self):
+        for iso_str in ['2016-03-01T10:00:00.000Z', '2016-02-29T23:59:59Z', '1999-12-31T23:59:59.999Z', '1970-01-01T00:00:00.0Z']:
+            self.assertEquals(GoogleRSS.get_timestamp(iso_str), GoogleRSS.get_timestamp_slow(iso_str))
+        self.assertEquals(GoogleRSS.get_timestamp('2016-03-01T10:00:00.000Z'), 1456826400)
+
+    def test_fallback(self):
+        for iso_str in ['2016-03-01T10:00:00+02:00', '2016-03-01 10:00:00', '2016-03-01']:
+            self.assertIsNone(GoogleRSS.RE_TIMESTAMP.match(iso_str))
+            self.assertEquals(GoogleRSS.get_timestamp(iso_str), GoogleRSS.get_timestamp_slow(iso_str))
+
+    def test_memo_bounded(self):
+        for n in xrange(0, GoogleRSS.TIMESTAMP_MEMO_SIZE + 10):
+            GoogleRSS.get_timestamp('2016-03-01T10:00:{0:02d}.{1}Z'.format(n % 60, n))
+        self.assertLessEqual(len(GoogleRSS.timestamp_memo), GoogleRSS.TIMESTAMP_MEMO_SIZE)
+        self.assertEquals(GoogleRSS.get_timestamp('2016-03-01T10:00:09.9Z'), 1456826409)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+import unittest
+import logging
+from array import array
+from mock import MagicMock
+from core.cache import Cache
+from services.poller import PlanPolicy, Poller, PollSchedule
+
+
+class TestPollSchedule(unittest.TestCase):
+    def setUp(self):
+        self.schedule = PollSchedule(default_s=600, quiet_s=1800, min_s=300, max_s=7200, burst_s=120, burst_window_s=1800)
+        self.activity_map = array('H', [0] * Cache.ACTIVITY_MAP_SLOTS)
+        # noon
+        self.at_time = 12 * 3600
+
+    def test_no_history(self):
+        self.assertEquals(self.schedule.next_poll_in(self.at_time, self.activity_map, 0, 0), 2400)
+        self.activity_map[12 * 60] = 1
+        self.assertEquals(self.schedule.next_poll_in(self.at_time, self.activity_map, 0, 0), 600)
+
+    def test_burst(self):
+        delay = self.schedule.next_poll_in(self.at_time, self.activity_map, self.at_time - 60, 86400)
+        self.assertEquals(delay, 120)
+
+    def test_expected_arrival(self):
+        # posts every ~3 hours, last one 2 hours ago
+        delay = self.schedule.next_poll_in(self.at_time, self.activity_map, self.at_time - 7200, 10800)
+        self.assertEquals(delay, 3600)
+
+    def test_bounds(self):
+        # monthly poster
+        delay = self.schedule.next_poll_in(self.at_time, self.activity_map, self.at_time - 86400, 30 * 86400)
+        self.assertEquals(delay, 7200)
+        # overdue heavy poster is still polled within bounds
+        delay = self.schedule.next_poll_in(self.at_time, self.activity_map, self.at_time - 1900, 600)
+        self.assertEquals(delay, 950)
+
+    def test_time_of_day(self):
+        # all activity at midnight, quiet at noon
+        self.activity_map[0] = 100
+        quiet = self.schedule.next_poll_in(self.at_time, self.activity_map, self.at_time - 7200, 10800)
+        busy = self.schedule.next_poll_in(0, self.activity_map, -7200, 10800)
+        self.assertEquals(quiet, 7200)
+        self.assertEquals(busy, 1800)
+
+
+class TestPlanPolicy(unittest.TestCase):
+    def setUp(self):
+        self.plans = PlanPolicy(cache_s=600)
+        self.plans.load_config({
+            'free': {'tag': '', 'source': 1, 'poll': {'min_s': 600, 'priority': 0}},
+            'micro': {'tag': 'M1'},
+            'M1': {'source': 15, 'poll': {'min_s': 180, 'max_s': 3600, 'priority': 2, 'share': 0.5}},
+            'O4': {'source': 5}
+        })
+        self.data = MagicMock()
+
+    def test_load_config(self):
+        self.assertEquals(sorted(self.plans.policy.keys()), ['', 'M1'])
+        self.assertEquals(self.plans.get('O4'), PlanPolicy.DEFAULT)
+        self.assertEquals(self.plans.get(None)['min_s'], 600)
+
+    def test_clamp(self):
+        self.assertEquals(self.plans.clamp(None, 300), 600)
+        self.assertEquals(self.plans.clamp('', 90000), 90000)
+        self.assertEquals(self.plans.clamp('M1', 60), 180)
+        self.assertEquals(self.plans.clamp('M1', 7200), 3600)
+
+    def test_tags_cached(self):
+        self.data.get_source_limits_bulk.return_value = [['M1'], [None]]
+        self.assertEquals(self.plans.get_tags(self.data, ['1', '2'], 1000), {'1': 'M1', '2': ''})
+        self.data.get_source_limits_bulk.return_value = [['']]
+        self.assertEquals(self.plans.get_tags(self.data, ['1', '2', '3'], 1500), {'1': 'M1', '2': '', '3': ''})
+        self.data.get_source_limits_bulk.assert_called_with(['3'])
+        # expired
+        self.plans.get_tags(self.data, ['1'], 1700)
+        self.data.get_source_limits_bulk.assert_called_with(['1'])
+
+    def test_child_gid_tag(self):
+        # linked source of a paying account goes by the account plan
+        self.data.get_source_limits_bulk.return_value = [[None, '', 'M1'], [None, 'O4']]
+        self.assertEquals(self.plans.get_tags(self.data, ['child', 'other'], 1000), {'child': 'M1', 'other': 'O4'})
+
+    def test_is_selective(self):
+        self.assertTrue(self.plans.is_selective())
+        self.assertFalse(PlanPolicy().is_selective())
+        self.plans.load_config({'free': {'tag': '', 'poll': {'min_s': 600}}, 'M1': {'poll': {'min_s': 180}}})
+        self.assertFalse(self.plans.is_selective())
+
+    def test_is_priority(self):
+        self.assertTrue(self.plans.is_priority('M1'))
+        self.assertFalse(self.plans.is_priority(''))
+        self.assertFalse(self.plans.is_priority('O4'))
+        self.assertFalse(PlanPolicy().is_priority('M1'))
+
+    def test_select(self):
+        claimed = [(str(n), 100.0 + n) for n in range(0, 8)]
+        tags = {'2': 'M1', '4': 'M1', '5': 'M1', '6': 'M1'}
+        # paid plan goes first up to its share, free gids fill the rest in due order
+        selected, deferred = self.plans.select(claimed, tags, 4)
+        self.assertEquals([gid for gid, _ in selected], ['2', '4', '0', '1'])
+        self.assertEquals([gid for gid, _ in deferred], ['5', '6', '3', '7'])
+
+        # no contention
+        selected, deferred = self.plans.select(claimed[:3], tags, 4)
+        self.assertEquals([gid for gid, _ in selected], ['2', '0', '1'])
+        self.assertEquals(deferred, [])
+
+        # share does not leave budget unused
+        selected, deferred = self.plans.select([c for c in claimed if c[0] in tags], tags, 4)
+        self.assertEquals(len(selected), 4)
+
+
+class TestPollerSmoothing(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        self.logger = logging.getLogger(__name__)
+        self.logger.level = logging.NOTSET
+        self.data = MagicMock()
+        self.data.check_orphans.return_value = set()
+        self.poller = Poller(self.logger, 'poller-a', self.data, None, '.')
+        self.poller.workers_max = 2
+        self.poller.worker_concurrency = 5
+        self.poller.worker_poll_rate = 1.0
+        self.poller.catchup_s = 600
+        self.poller.shards = [0, 1]
+        self.poller.tokens = {0: 3, 1: 7}
+        self.data.balancer.dispatch_gids.return_value = (0, 0)
+
+    def test_capacity(self):
+        self.assertEquals(self.poller.capacity(), 10.0)
+
+    def test_budget(self):
+        self.data.balancer.count_due.return_value = 0
+        self.data.balancer.claim_next_poll_set.side_effect = lambda shard, up_to, lease, num, owner, token: [(str(n), 100.0) for n in range(0, num)]
+        self.poller.schedule_shard(0, 30)
+        # no plan policy, nothing to claim past the budget
+        self.assertEquals(self.data.balancer.claim_next_poll_set.call_count, 1)
+        self.assertEquals(self.data.balancer.claim_next_poll_set.call_args[1]['num'], 30)
+        self.assertEquals(len(self.data.balancer.dispatch_gids.call_args[0][2]), 30)
+        self.assertFalse(self.data.balancer.add_gid_set_bulk.called)
+        self.assertFalse(self.data.balancer.spread_due.called)
+
+    def test_budget_overscan(self):
+        self.poller.plans.load_config({'free': {'tag': '', 'poll': {'priority': 0}}, 'M1': {'poll': {'priority': 2}}})
+        self.data.get_source_limits_bulk.side_effect = lambda gids: [[None]] * len(gids)
+        self.data.balancer.count_due.return_value = 0
+        self.data.balancer.claim_next_poll_set.side_effect = lambda shard, up_to, lease, num, owner, token: [(str(n), 100.0) for n in range(0, num)]
+        self.poller.schedule_shard(0, 30)
+        self.assertEquals(self.data.balancer.claim_next_poll_set.call_args[1]['num'], 60)
+        self.assertEquals(len(self.data.balancer.dispatch_gids.call_args[0][2]), 30)
+        self.assertEquals(len(self.data.balancer.add_gid_set_bulk.call_args[0][0]), 30)
+
+    def test_budget_queued(self):
+        # 20 gids per period, 15 gids wait in 2 messages
+        self.poller.channel_len = MagicMock(return_value=2)
+        self.poller.breaker = MagicMock()
+        self.poller.breaker.is_open.return_value = False
+        self.poller.rebalance = MagicMock()
+        self.poller.schedule_shard = MagicMock(return_value=0.0)
+        self.data.quota.get_stretch.return_value = 1.0
+        self.data.balancer.queued_depth.return_value = 15
+        self.poller.schedule_next_batch()
+        self.data.balancer.queued_depth.assert_called_once_with('poller:poller-a:work', self.poller.dispatch_chunk)
+        self.assertEquals([c[0][1] for c in self.poller.schedule_shard.call_args_list], [3, 3])
+
+    def test_dispatch_budget(self):
+        # max worker pool estimate is the floor
+        self.assertEquals(self.poller.dispatch_budget(0.0, 0), 20)
+        self.assertEquals(self.poller.dispatch_budget(4.0, 15), 5)
+        # workers poll faster than estimated
+        self.assertEquals(self.poller.dispatch_budget(20.0, 15), 45)
+        self.assertEquals(self.poller.dispatch_budget(20.0, 100), 0)
+
+    def test_autoscale_queued_gids(self):
+        # 3 messages hold 25 gids, 5 gids per poll thread
+        self.poller.channel_len = MagicMock(return_value=3)
+        self.poller.breaker = MagicMock()
+        self.poller.breaker.is_open.return_value = True
+        self.poller.rebalance = MagicMock()
+        self.poller.autoscale = MagicMock()
+        self.data.quota.get_stretch.return_value = 1.0
+        self.data.balancer.queued_depth.return_value = 25
+        self.poller.schedule_next_batch(allow_worker_start=True)
+        self.assertEquals(self.poller.autoscale.call_args[0][1], 5.0)
+
+    def test_stats_depth_gids(self):
+        self.poller.channel_len = MagicMock(return_value=3)
+        self.data.balancer.queued_depth.return_value = 25
+        self.poller.update_stats(1000.0, 10)
+        self.data.stats.record_dispatch.assert_called_once_with('poller-a', 1000.0, 10, 25, deduped=0, throttled=0)
+
+    def test_lost_lease(self):
+        self.data.balancer.count_due.return_value = 0
+        self.data.balancer.claim_next_poll_set.return_value = None
+        self.poller.schedule_shard(0, 30)
+        self.assertEquals(self.data.balancer.claim_next_poll_set.call_args[1]['token'], 3)
+        self.assertEquals(self.poller.shards, [1])
+        self.assertEquals(self.poller.tokens, {1: 7})
+        self.data.balancer.set_master_shards.assert_called_once_with('poller-a', [1])
+
+    def test_rebalance(self):
+        # the other master joined and is preferred for shard 0, standby gets nothing
+        self.data.balancer.heartbeat_master.return_value = ['poller-a', 'poller-b']
+        self.data.balancer.assign_shards.return_value = [1]
+        self.data.balancer.lease_shards.return_value = {1: 7}
+        self.poller.rebalance(1000.0)
+        self.data.balancer.lease_shards.assert_called_once_with('poller-a', [1], [0], self.poller.lease_s)
+        self.assertEquals(self.poller.shards, [1])
+
+        self.data.balancer.assign_shards.return_value = []
+        self.data.balancer.lease_shards.return_value = dict()
+        self.poller.rebalance(1002.0)
+        self.assertEquals(self.poller.shards, [])
+
+    def test_throttle_queued_gids(self):
+        # 25 queued gids take up the 20 gids budget
+        self.poller.channel_len = MagicMock(return_value=3)
+        self.poller.breaker = MagicMock()
+        self.poller.breaker.is_open.return_value = False
+        self.poller.rebalance = MagicMock()
+        self.poller.schedule_shard = MagicMock(return_value=0.0)
+        self.data.quota.get_stretch.return_value = 1.0
+        self.data.balancer.queued_depth.return_value = 25
+        self.poller.schedule_next_batch()
+        self.assertFalse(self.poller.schedule_shard.called)
+        self.assertEquals(self.data.stats.record_dispatch.call_args[1]['throttled'], 1)
+
+        self.data.balancer.queued_depth.return_value = 12
+        self.poller.schedule_next_batch()
+        self.assertEquals([c[0][1] for c in self.poller.schedule_shard.call_args_list], [4, 4])
+
+    def test_spread_backlog(self):
+        # 30000 overdue gids at 5 polls per second per shard take 6000 seconds, spread over catch-up window
+        self.data.balancer.count_due.return_value = 30000
+        self.poller.smooth_shard(1, 1000.0, 10)
+        self.data.balancer.spread_due.assert_called_once_with(1, 1000.0, 1000.0, 600, owner='poller-a', token=7)
+
+        # 100 gids take 20 seconds, 10 periods of budget absorb them
+        self.data.balancer.spread_due.reset_mock()
+        self.data.balancer.count_due.return_value = 100
+        self.poller.smooth_shard(1, 1000.0, 10)
+        self.assertFalse(self.data.balancer.spread_due.called)
+
+        # budget cut by queued gids, 50 gids are spread over the 10 seconds the pool takes to poll them
+        self.data.balancer.count_due.return_value = 50
+        self.poller.smooth_shard(1, 1000.0, 2)
+        self.data.balancer.spread_due.assert_called_once_with(1, 1000.0, 1000.0, 10.0, owner='poller-a', token=7)
+
+    def test_reschedule_marks_priority(self):
+        self.poller.plans.load_config({'free': {'tag': '', 'poll': {'priority': 0}}, 'M1': {'poll': {'priority': 2}}})
+        self.data.get_source_limits_bulk.return_value = [['M1'], [None]]
+        self.data.cache.get_poll_history_bulk.return_value = [(None, 0, 0), (None, 0, 0)]
+        self.poller.schedule = MagicMock()
+        self.poller.schedule.next_poll_in.return_value = 600
+        self.poller.reschedule(['1', '2'])
+        self.data.balancer.set_priority_bulk.assert_called_once_with({'1': True, '2': False})
+
+        # no plan policy, nothing to mark
+        self.data.balancer.set_priority_bulk.reset_mock()
+        self.poller.plans.load_config(dict())
+        self.poller.reschedule(['1', '2'])
+        self.assertFalse(self.data.balancer.set_priority_bulk.called)
+
+    def test_deferred_behind_due(self):
+        self.poller.plans.load_config({'free': {'tag': '', 'poll': {'priority': 0}}, 'M1': {'poll': {'priority': 2}}})
+        self.data.get_source_limits_bulk.return_value = [['M1' if n % 2 else None] for n in range(0, 4)]
+        self.data.balancer.count_due.return_value = 0
+        self.data.balancer.claim_next_poll_set.side_effect = lambda shard, up_to, lease, num, owner, token: [(str(n), 100.0) for n in range(0, num)]
+        self.poller.schedule_shard(0, 2)
+        self.assertEquals(sorted(gid for gid, _ in self.data.balancer.dispatch_gids.call_args[0][2]), ['1', '3'])
+        deferred = self.data.balancer.add_gid_set_bulk.call_args[0][0]
+        self.assertEquals(sorted(deferred.keys()), ['0', '2'])
+        self.assertTrue(all(scheduled > 100.0 for scheduled in deferred.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
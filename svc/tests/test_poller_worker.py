@@ -0,0 +1,78 @@
+import unittest
+import logging
+from mock import MagicMock, patch
+from core.breaker import CircuitBreaker
+from services.poller_worker import PollerWorker
+
+
+class TestPollerWorker(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        self.logger = logging.getLogger(__name__)
+        self.logger.level = logging.NOTSET
+        self.data = MagicMock()
+        with patch('services.poller_worker.GooglePollAgent') as agent:
+            agent.return_value.poll.side_effect = lambda gid: gid != 'bad'
+            agent.return_value.last_outcome = 'ok'
+            agent.return_value.last_fetch_s = 0.1
+            self.worker = PollerWorker(self.logger, 'poller-a.000P', self.data, None, '.', master='poller-a')
+            self.worker.breaker = MagicMock()
+            self.worker.breaker.allow.return_value = CircuitBreaker.CLOSED
+            self.worker.concurrency = 4
+            self.worker.start_pool()
+
+    def tearDown(self):
+        self.worker.stop_pool()
+
+    def test_pool_completes_chunk(self):
+        self.worker._on_update('poller:poller-a:work', '1,2,bad,3', '100,100,100,100')
+        self.worker.stop_pool()
+
+        self.assertEquals(self.worker.in_flight, set())
+        out = self.data.pubsub.broadcast_data_list.call_args[0]
+        self.assertEquals(out[0], 'poller:poller-a:out')
+        self.assertEquals(sorted(out[1]), ['1', '2', '3'])
+        self.assertEquals(self.data.balancer.retry_gids.call_args[0][0], ['bad'])
+        self.assertEquals(len(self.data.stats.record_polls.call_args[0][2]), 4)
+
+    def test_circuit_open(self):
+        self.worker.breaker.allow.return_value = CircuitBreaker.DENIED
+        self.worker._on_update('poller:poller-a:work', '1,2', '100,100')
+        self.worker.stop_pool()
+
+        self.assertEquals(sorted(self.data.balancer.retry_gids.call_args[0][0]), ['1', '2'])
+        self.assertEquals(self.data.pubsub.broadcast_data_list.call_args[0][1], [])
+        self.assertFalse(self.data.stats.record_polls.called)
+
+    def test_in_flight_skipped(self):
+        self.worker.in_flight.add('1')
+        self.worker._on_update('poller:poller-a:work', '1,2')
+        self.worker.in_flight.discard('1')
+        self.worker.stop_pool()
+
+        self.assertEquals(self.data.pubsub.broadcast_data_list.call_args[0][1], ['2'])
+
+    def test_priority_served_between_polls(self):
+        self.worker.stop_pool()
+        registered = ['new']
+        self.data.balancer.get_next_registered.side_effect = lambda: registered.pop() if registered else None
+        # one register request waiting in priority lane
+        self.worker.pop_data_list = MagicMock(side_effect=[['~M~register/100.0'], [], []])
+        self.worker._on_update('poller:poller-a:work', '1,2', '100,100')
+
+        self.assertEquals([c[0][1] for c in self.data.pubsub.broadcast_data_list.call_args_list], [['new'], ['1', '2']])
+
+    def test_quota_not_breaker_error(self):
+        self.worker.stop_pool()
+        self.worker.complete(['1', '2', '3'], [(True, ('ok', 1, 0.1)), (False, ('quota', 1, None)), (True, ('empty', 1, 0.1))],
+                             dict())
+        self.worker.breaker.record.assert_called_once_with(self.worker.breaker.record.call_args[0][0], 1, 0)
+        self.assertEquals(len(self.data.stats.record_polls.call_args[0][2]), 3)
+
+        self.worker.breaker.record.reset_mock()
+        self.worker.complete(['2'], [(False, ('quota', 1, None))], dict())
+        self.assertFalse(self.worker.breaker.record.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import logging
+from mock import MagicMock
+from core.quota import Quota
+from core.schema import S1
+from utils import config
+
+
+class TestQuota(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        self.logger = logging.getLogger(__name__)
+        self.logger.level = logging.NOTSET
+        self.rc = MagicMock()
+        self.quota = Quota(self.logger, self.rc)
+        self.quota.load_config({'plus': {'rate': 2.0, 'daily': 1000, 'reset_s': 0}})
+        self.quota.take_script = MagicMock()
+
+    def test_load_config(self):
+        self.assertEquals(self.quota.limits['plus'], {'rate': 2.0, 'burst': 10, 'daily': 1000, 'reset_s': 0})
+        self.assertEquals(Quota.LIMITS['plus']['daily'], config.DEFAULT_PLUS_QUOTA_DAILY)
+
+    def test_take(self):
+        self.quota.take_script.return_value = [1, '4.5', 10]
+        self.assertEquals(self.quota.take('plus', 'sa@x', 1000.0), (True, 0))
+
+        # bucket empty, refills in 0.25 s at 2 calls per second
+        self.quota.take_script.return_value = [0, '0.5', 10]
+        self.assertEquals(self.quota.take('plus', 'sa@x', 1000.0), (False, 0.25))
+
+        # daily budget exhausted
+        self.quota.take_script.return_value = [0, '5', 1000]
+        self.assertEquals(self.quota.take('plus', 'sa@x', 1000.0), (False, 0))
+
+    def test_stretch(self):
+        self.rc.smembers.return_value = {'plus:sa@x', 'picasa:bare'}
+        # noon, half of daily budget is pro-rata, names are read in sorted order
+        at_time = 86400 * 100 + 43200
+        self.rc.pipeline.return_value.execute.return_value = ['5000', '400']
+        self.assertEquals(self.quota.get_stretch('plus', at_time), 1.0)
+
+        self.rc.pipeline.return_value.execute.return_value = ['5000', '800']
+        self.assertEquals(self.quota.get_stretch('plus', at_time), 2.0)
+
+        # whole budget used up in the first hour
+        self.rc.pipeline.return_value.execute.return_value = ['5000', '1000']
+        self.assertEquals(self.quota.get_stretch('plus', 86400 * 100 + 600), Quota.MAX_STRETCH)
+
+    def test_reset_boundary(self):
+        # daily budget resets at 08:00 UTC
+        self.quota.load_config({'plus': {'reset_s': 8 * 3600}})
+        self.assertEquals(Quota.day(86400 * 100 + 8 * 3600 - 1, 8 * 3600), 99)
+        self.assertEquals(Quota.day(86400 * 100 + 8 * 3600, 8 * 3600), 100)
+        self.quota.take_script.return_value = [1, '4.5', 10]
+        self.quota.take('plus', 'sa@x', 86400 * 100 + 3600)
+        self.assertEquals(self.quota.take_script.call_args[1]['keys'][1], S1.quota_daily_key('plus', 'sa@x', 99))
+
+        # 20:00 UTC is noon of the quota day
+        self.rc.smembers.return_value = {'plus:sa@x'}
+        self.rc.pipeline.return_value.execute.return_value = ['800']
+        self.assertEquals(self.quota.get_stretch('plus', 86400 * 100 + 20 * 3600), 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
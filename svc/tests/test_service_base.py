@@ -0,0 +1,51 @@
+import unittest
+from mock import MagicMock
+from services.service_base import ServiceBase, WorkerScaler
+
+
+class TestWorkerScaler(unittest.TestCase):
+    def setUp(self):
+        self.scaler = WorkerScaler(up_depth=20, down_depth=2, up_lag_s=60, up_drain_s=30, up_cooldown_s=30, down_cooldown_s=300)
+
+    def test_scale_up_cooldown(self):
+        self.assertEquals(self.scaler.decide(1000, 3, depth=100), 1)
+        # still in cooldown
+        self.assertEquals(self.scaler.decide(1010, 4, depth=100), 0)
+        self.assertEquals(self.scaler.decide(1031, 4, depth=100), 1)
+
+    def test_scale_up_lag_and_drain(self):
+        self.assertEquals(self.scaler.decide(1000, 3, depth=0, lag_s=120), 1)
+        self.assertEquals(self.scaler.decide(2000, 3, depth=50, rate=1.0), 1)
+
+    def test_hysteresis(self):
+        # between down and up thresholds the pool is kept for good
+        for t in range(1000, 2000, 10):
+            self.assertEquals(self.scaler.decide(t, 3, depth=30), 0)
+
+    def test_scale_down_after_idle(self):
+        self.assertEquals(self.scaler.decide(1000, 3, depth=0), 0)
+        self.assertEquals(self.scaler.decide(1200, 3, depth=0), 0)
+        # busy moment resets the idle period
+        self.assertEquals(self.scaler.decide(1250, 3, depth=30), 0)
+        self.assertEquals(self.scaler.decide(1500, 3, depth=0), 0)
+        self.assertEquals(self.scaler.decide(1799, 3, depth=0), 0)
+        self.assertEquals(self.scaler.decide(1800, 3, depth=0), -1)
+        # next one needs another idle period
+        self.assertEquals(self.scaler.decide(1900, 2, depth=0), 0)
+
+
+class TestServiceBase(unittest.TestCase):
+    def test_retire_most_recent(self):
+        service = ServiceBase(MagicMock(), 'poller-a', MagicMock(), None, '.')
+        service.workers_max = 3
+        service.worker_seq = 999
+        service.get_worker = MagicMock()
+        for _ in range(0, 3):
+            service.start_worker()
+        self.assertTrue(service.retire_worker())
+        self.assertEquals(service.retiring.keys(), ['poller-a.1001P'])
+        self.assertEquals(service.workers.keys(), ['poller-a.999P', 'poller-a.1000P'])
+
+
+if __name__ == '__main__':
+    unittest.main()
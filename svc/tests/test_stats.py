@@ -0,0 +1,52 @@
+import unittest
+import logging
+from mock import MagicMock
+from core.stats import PollerStats
+
+
+class TestPollerStats(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+        self.logger = logging.getLogger(__name__)
+        self.logger.level = logging.NOTSET
+        self.rc = MagicMock()
+        self.pipe = self.rc.pipeline.return_value
+        self.stats = PollerStats(self.logger, self.rc)
+
+    def test_bucket_field(self):
+        self.assertEquals(PollerStats.bucket_field('lag', PollerStats.LAG_BUCKETS, 0.5), 'lag:0')
+        self.assertEquals(PollerStats.bucket_field('lag', PollerStats.LAG_BUCKETS, 5), 'lag:1')
+        self.assertEquals(PollerStats.bucket_field('lag', PollerStats.LAG_BUCKETS, 86400), 'lag:10')
+
+    def test_record_polls(self):
+        self.stats.record_polls('poller-a', 3600 * 100 + 30, [('ok', 2, 0.3), ('ok', None, 0.3), ('retry', 700, None)])
+        counters = dict((c[0][1], c[0][2]) for c in self.pipe.hincrby.call_args_list if c[0][0] == 'stats:poller-a:m:6000')
+        self.assertEquals(counters, {'ok': 2, 'retry': 1, 'lag:1': 1, 'lag:8': 1, 'fetch:2': 2})
+        self.assertEquals(self.pipe.expire.call_count, 2)
+        self.pipe.execute.assert_called_once_with()
+
+    def test_get_rolling(self):
+        self.pipe.execute.return_value = ['1'] * 60 + ['10'] * 24 + [None] * 84
+        self.assertEquals(self.stats.get_rolling(['poller-a', 'poller-b'], 86400), {'poller-a': (60, 240), 'poller-b': (0, 0)})
+
+    def test_get_telemetry(self):
+        self.pipe.execute.return_value = [{'ok': '8', 'fail': '2', 'lag:0': '9', 'lag:4': '1', 'depth': '5'},
+                                          {'depth': '3'},
+                                          {'ok': '10', 'lag:0': '10'},
+                                          {}]
+        telemetry = self.stats.get_telemetry(['poller-a', 'poller-b'], 600, minutes=2)
+        self.assertEquals(telemetry['poller-a']['polls'], 10)
+        self.assertEquals(telemetry['poller-a']['rates']['fail'], 0.2)
+        self.assertEquals(telemetry['poller-a']['depth'], [5, 3])
+        self.assertEquals(telemetry['poller-a']['lag_p50'], 1)
+        self.assertEquals(telemetry['poller-a']['lag_p99'], 60)
+        self.assertEquals(telemetry['all']['polls'], 20)
+        self.assertEquals(telemetry['all']['polls_per_min'], 10.0)
+        self.assertEquals(telemetry['all']['depth'], [5, 3])
+
+    def test_percentile_empty(self):
+        self.assertEquals(PollerStats.percentile(PollerStats.histogram({}, 'lag', PollerStats.LAG_BUCKETS), 0.9), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
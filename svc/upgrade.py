@@ -0,0 +1,30 @@
+import os
+import logging
+
+import argparse
+
+import core
+from utils import config
+from utils.data_upgrade import DataUpgrade
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='G+RSS.Data.Upgrade')
+    parser.add_argument('--redis_port', default=6379, type=int)
+    parser.add_argument('--redis_host', default='127.0.0.1')
+    parser.add_argument('--redis_db', required=True, type=int)
+    parser.add_argument('--log_path', required=True)
+    parser.add_argument('--task', required=True)
+    parser.add_argument('--gid', required=False)
+    parser.add_argument('--spread_s', default=600, type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+    logger = logging.getLogger('upgradeLogger')
+    logger.addHandler(config.getLogHandler(os.path.join(args.log_path, 'upgrade.log')))
+    logger.level = logging.DEBUG
+
+    data = core.Data(logger, args.redis_host, args.redis_port, args.redis_db)
+
+    upgrade = DataUpgrade(logger, data, spread_s=args.spread_s)
+    upgrade.run(args.task, args.gid)
@@ -9,12 +9,25 @@ DEFAULT_FORCE_MISS_TIMEOUT = 20
 DEFAULT_ORPHANED_TIMEOUT = 3600     #1 hr timeout
 DEFAULT_MAX_ERROR_COUNT = 7         # max number of errors before crosspost is disabled
 
-DEFAULT_MAX_RESULTS = 10            # max items to fetch from google
+DEFAULT_MAX_RESULTS = 10            # max items to fetch from google for new users, items kept in cache
+DEFAULT_MAX_RESULTS_MIN = 3         # adaptive max items to fetch from google for quiet users
+DEFAULT_MAX_RESULTS_MAX = 50        # adaptive max items to fetch from google after a burst of posts
+DEFAULT_MAX_RESULTS_CACHE = 50     # max items kept in per-item activities cache
+DEFAULT_PUBLISHER_LRU_BYTES = 32 * 1024 * 1024   # max size of in-process activities copies in publishers
 DEFAULT_MAX_RESULTS_MAP = 128       # max items to keep history of
 DEFAULT_MIN_TIME_SPACE = 5          # minimum post time-space in minutes
 
 DEFAULT_LOG_LEN = 20
 
+DEFAULT_PLUS_QUOTA_RATE = 5.0       # Google+ API calls per second per credential
+DEFAULT_PLUS_QUOTA_BURST = 10
+DEFAULT_PLUS_QUOTA_DAILY = 10000    # Google+ API calls per day per credential, 0 for no daily limit
+DEFAULT_PICASA_QUOTA_RATE = 5.0     # Picasa API calls per second per credential, no daily limit
+DEFAULT_PICASA_QUOTA_BURST = 10
+DEFAULT_QUOTA_RESET_S = 8 * 3600    # daily quotas reset at midnight Pacific Time, 08:00 UTC, daylight saving is not followed
+
+DEFAULT_POLLER_SHARDS = 1           # number of gid schedule shards, run upgrade.py --task reshard after a change
+
 USER_ID_COOKIE_NAME = 'mr_siid_u'
 USER_SESSION_COOKIE_NAME = 'mr_siid_t'
 
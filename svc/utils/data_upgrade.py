@@ -0,0 +1,148 @@
+import time
+import traceback
+from logging import Logger
+
+from redis import WatchError
+
+import core
+from core.cache import Cache
+from core.codec import Codec
+from core.schema import S1
+from providers.google_rss import GoogleRSS
+
+
+class DataUpgrade:
+    def __init__(self, log, data, spread_s=600):
+        """
+        @type log: Logger
+        @type data: core.Data
+        @param spread_s: window the spread job levels the schedule over
+        """
+        self.data = data
+        self.log = log
+        self.spread_s = spread_s
+        # per gid tasks
+        self.tasks = {
+            'activity_map': self.activity_map_gid,
+            'codec': self.codec_gid,
+            'items': self.items_gid,
+        }
+        # whole database tasks
+        self.jobs = {
+            'reshard': self.reshard,
+            'spread': self.spread,
+        }
+
+    def run(self, task, gid=None):
+        if task in self.jobs:
+            return self.jobs[task]()
+
+        upgrade_gid = self.tasks[task]
+        if gid:
+            return upgrade_gid(gid)
+
+        total = 0
+        errors = 0
+        for gid in self.data.balancer.scan_gids():
+            total += 1
+            try:
+                upgrade_gid(gid)
+            except Exception as e:
+                errors += 1
+                self.log.error('Error upgrading [{0}], {1}, {2}'.format(gid, e, traceback.format_exc()))
+
+        self.log.info('Task [{0}] done, [{1}] gids, [{2}] errors'.format(task, total, errors))
+
+    def activity_map_gid(self, gid):
+        """
+        converts legacy update.minute:N fields of the gid cache hash into the activity map
+        """
+        key = S1.cache_key(gid)
+        fields = [k for k in self.data.rc.hkeys(key) if S1.get_minute_fmt_minute(k) is not None]
+        if not fields:
+            return
+
+        counts = dict()
+        for field, value in zip(fields, self.data.rc.hmget(key, fields)):
+            try:
+                minute = int(S1.get_minute_fmt_minute(field)) % Cache.ACTIVITY_MAP_SLOTS
+                counts[minute] = counts.get(minute, 0) + int(value)
+            except (TypeError, ValueError):
+                self.log.warning('Bad activity field [{0}]:[{1}]={2}'.format(gid, field, value))
+
+        # increment and drop legacy fields in one transaction
+        pipe = self.data.rc.pipeline()
+        if counts:
+            self.data.cache.incr_activity_map(gid, counts, rc=pipe)
+        pipe.hdel(key, *fields)
+        pipe.execute()
+        self.log.info('Activity map for [{0}], [{1}] fields converted'.format(gid, len(fields)))
+
+    def codec_gid(self, gid):
+        """
+        re-encodes cached activities document of the gid with the cache codec
+        """
+        key = S1.cache_key(gid)
+        value = self.data.rc.hget(key, S1.cache_items_key())
+        if not value or Codec.version_of(value) == self.data.cache.codec:
+            return
+
+        encoded = Codec.encode(Codec.decode(value), self.data.cache.codec)
+        # skip if a poller stored a new document in the meantime
+        pipe = self.data.rc.pipeline()
+        try:
+            pipe.watch(key)
+            if pipe.hget(key, S1.cache_items_key()) != value:
+                return
+            pipe.multi()
+            pipe.hset(key, S1.cache_items_key(), encoded)
+            pipe.execute()
+        except WatchError:
+            return
+        finally:
+            pipe.reset()
+        self.log.info('Activities of [{0}] re-encoded, [{1}] --> [{2}] bytes'.format(gid, len(value), len(encoded)))
+
+    def items_gid(self, gid):
+        """
+        splits legacy whole cached activities document of the gid into per-item cache
+        """
+        doc = Codec.decode(self.data.rc.hget(S1.cache_key(gid), S1.cache_items_key()))
+        if not doc:
+            return
+        for item in doc.get('items', []):
+            GoogleRSS.normalize(item)
+        written = self.data.cache.cache_activities_doc(gid, doc)
+        self.log.info('Activities of [{0}] split, [{1}] items'.format(gid, written))
+
+    def reshard(self):
+        """
+        moves scheduled gids from legacy 'all' gid set and shard sets of any shard count into
+        the shard sets of the configured shard count
+        """
+        source_keys = set(self.data.rc.scan_iter(match=S1.gid_shard_set('*')))
+        source_keys.add(S1.gid_set('all'))
+        moved = 0
+        for key in source_keys:
+            for gid, score in self.data.rc.zscan_iter(key):
+                target_key = self.data.balancer.gid_set_key(gid)
+                if target_key == key:
+                    continue
+                pipe = self.data.rc.pipeline()
+                pipe.zadd(target_key, gid, score)
+                pipe.zrem(key, gid)
+                pipe.execute()
+                moved += 1
+
+        self.log.info('Reshard to [{0}] shards done, [{1}] gids moved'.format(self.data.balancer.shards, moved))
+
+    def spread(self):
+        """
+        levels clustered schedule: gids due within the spread window are re-scheduled evenly over the window
+        """
+        at_time = time.time()
+        spread = 0
+        for shard in xrange(0, self.data.balancer.shards):
+            spread += self.data.balancer.spread_due(shard, at_time + self.spread_s, at_time, self.spread_s)
+
+        self.log.info('Spread done, [{0}] gids over [{1}]s'.format(spread, self.spread_s))